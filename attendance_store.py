@@ -0,0 +1,306 @@
+# attendance_store.py
+"""
+Local SQLite store of punches pulled from devices and whether the backend has
+acknowledged them. Device log rotation (log_rotation.py) only clears a terminal
+once every record on it is stored here and acknowledged.
+
+Records are tuples: (user_id, timestamp_iso, status, punch)
+"""
+import os
+import time
+import sqlite3
+import json
+import hashlib
+from contextlib import contextmanager
+
+STORE_PATH = os.getenv('ZK_STORE_PATH', 'zk_sync.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS punches (
+    device    TEXT NOT NULL,
+    user_id   TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    status    INTEGER,
+    punch     INTEGER NOT NULL,
+    acked_at  REAL,
+    PRIMARY KEY (device, user_id, timestamp, punch)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS log_rotations (
+    id              INTEGER PRIMARY KEY,
+    device          TEXT NOT NULL,
+    cleared_through TEXT NOT NULL,
+    record_count    INTEGER NOT NULL,
+    checksum        TEXT NOT NULL,
+    rotated_at      REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS backfill_jobs (
+    device       TEXT NOT NULL,
+    start_date   TEXT NOT NULL,
+    end_date     TEXT NOT NULL,
+    record_count INTEGER NOT NULL,
+    user_map     TEXT NOT NULL,
+    pulled_at    REAL NOT NULL,
+    PRIMARY KEY (device, start_date, end_date)
+);
+
+-- Daily summaries (daily_summary.py): every distinct punch seen by pull or push,
+-- across a tenant's devices, and the per-employee-day summary derived from them
+CREATE TABLE IF NOT EXISTS summary_punches (
+    tenant    TEXT NOT NULL,
+    user_id   TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    punch     INTEGER NOT NULL,
+    PRIMARY KEY (tenant, user_id, timestamp, punch)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS daily_summaries (
+    tenant         TEXT NOT NULL,
+    user_id        TEXT NOT NULL,
+    day            TEXT NOT NULL,
+    name           TEXT,
+    first_in       TEXT,
+    last_out       TEXT,
+    punches        INTEGER NOT NULL,
+    worked_seconds INTEGER NOT NULL,
+    updated_at     REAL NOT NULL,
+    PRIMARY KEY (tenant, user_id, day)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS daily_summaries_day ON daily_summaries (day, tenant, user_id);
+
+-- Pull scheduler sharding (device_leases.py): live schedulers and who pulls which device
+CREATE TABLE IF NOT EXISTS sync_members (
+    member     TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL,
+    started_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS device_leases (
+    device     TEXT PRIMARY KEY,
+    owner      TEXT NOT NULL,
+    expires_at REAL NOT NULL
+) WITHOUT ROWID;
+
+-- Fingerprint template backups (template_backup.py). Templates are stored once,
+-- under the SHA-256 of the raw template (zlib-compressed when that makes them
+-- smaller); devices reference them.
+CREATE TABLE IF NOT EXISTS template_blobs (
+    digest     TEXT PRIMARY KEY,
+    size       INTEGER NOT NULL,
+    compressed INTEGER NOT NULL,
+    data       BLOB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS template_backups (
+    device       TEXT NOT NULL,
+    user_id      TEXT NOT NULL,
+    fid          INTEGER NOT NULL,
+    valid        INTEGER NOT NULL,
+    digest       TEXT NOT NULL,
+    backed_up_at REAL NOT NULL,
+    PRIMARY KEY (device, user_id, fid)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS template_backups_digest ON template_backups (digest);
+
+CREATE TABLE IF NOT EXISTS template_users (
+    device    TEXT NOT NULL,
+    user_id   TEXT NOT NULL,
+    name      TEXT NOT NULL,
+    privilege INTEGER NOT NULL,
+    password  TEXT NOT NULL,
+    group_id  TEXT NOT NULL,
+    card      INTEGER NOT NULL,
+    PRIMARY KEY (device, user_id)
+) WITHOUT ROWID;
+
+-- Device clocks (clock_skew.py): last handshake skew, and the corrections applied to
+-- punches as [[from device time in seconds, correction seconds], ...], oldest first
+CREATE TABLE IF NOT EXISTS device_clocks (
+    device      TEXT PRIMARY KEY,
+    skew        REAL,
+    measured_at REAL,
+    corrections TEXT NOT NULL,
+    synced_at   REAL
+);
+
+-- Pushed punches waiting for upload (upload_batcher.py); owner is the process whose
+-- queue holds the row, claimed_at when it last renewed its claim
+CREATE TABLE IF NOT EXISTS upload_queue (
+    id         INTEGER PRIMARY KEY,
+    tenant     TEXT NOT NULL,
+    record     TEXT NOT NULL,
+    queued_at  REAL NOT NULL,
+    owner      TEXT NOT NULL,
+    claimed_at REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS upload_queue_tenant ON upload_queue (tenant, claimed_at);
+"""
+
+_initialized = set()
+
+
+def _migrate(conn):
+    """Set aside tables an older version created in a layout SCHEMA can't add to"""
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(summary_punches)')]
+    if columns and 'tenant' not in columns:
+        # Summaries gained a tenant; daily_summary.py moves the old rows over
+        try:
+            conn.executescript(
+                'BEGIN IMMEDIATE;'
+                'DROP INDEX IF EXISTS daily_summaries_day;'
+                'ALTER TABLE summary_punches RENAME TO summary_punches_pre_tenant;'
+                'ALTER TABLE daily_summaries RENAME TO daily_summaries_pre_tenant;'
+                'COMMIT;'
+            )
+        except sqlite3.OperationalError:
+            conn.rollback()  # another process got there first
+
+
+def connect(path=None):
+    """Open the store (creating tables on first use). WAL lets gunicorn workers share it."""
+    path = path or STORE_PATH
+    conn = sqlite3.connect(path, timeout=30)
+    if path not in _initialized:
+        conn.execute('PRAGMA journal_mode=WAL')
+        _migrate(conn)
+        conn.executescript(SCHEMA)
+        _initialized.add(path)
+    return conn
+
+
+@contextmanager
+def transaction():
+    """Connection that commits on success, rolls back on error and is always closed"""
+    conn = connect()
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def checksum(records):
+    """Order-independent SHA-256 over canonical record lines"""
+    digest = hashlib.sha256()
+    for user_id, timestamp, status, punch in sorted(records):
+        digest.update(f"{user_id}|{timestamp}|{status}|{punch}\n".encode())
+    return digest.hexdigest()
+
+
+def save_punches(device, records):
+    """Insert records that aren't stored yet; existing rows (and their ack state) are kept"""
+    with transaction() as conn:
+        conn.executemany(
+            'INSERT OR IGNORE INTO punches (device, user_id, timestamp, status, punch) VALUES (?, ?, ?, ?, ?)',
+            ((device, user_id, timestamp, status, punch) for user_id, timestamp, status, punch in records)
+        )
+
+
+def to_upload_data(records, user_map):
+    """Store records -> the backend's /attendance/upload payload (same shape as /attendance)"""
+    return [
+        {
+            'dateTime': timestamp,
+            'name': user_map.get(user_id, f'User {user_id}'),
+            'status': 'Check In' if punch == 0 else 'Check Out',
+            'number': user_id
+        }
+        for user_id, timestamp, _, punch in records
+    ]
+
+
+def mark_acked(device, records):
+    """Store records (if needed) and mark them as acknowledged by the backend"""
+    now = time.time()
+    with transaction() as conn:
+        conn.executemany(
+            'INSERT OR IGNORE INTO punches (device, user_id, timestamp, status, punch) VALUES (?, ?, ?, ?, ?)',
+            ((device, user_id, timestamp, status, punch) for user_id, timestamp, status, punch in records)
+        )
+        conn.executemany(
+            'UPDATE punches SET acked_at = ? WHERE device = ? AND user_id = ? AND timestamp = ? AND punch = ? AND acked_at IS NULL',
+            ((now, device, user_id, timestamp, punch) for user_id, timestamp, _, punch in records)
+        )
+
+
+def acked_records(device, records):
+    """
+    Look up `records` in the store.
+    Returns (acked, pending): acked are the stored rows (as stored) that the backend
+    acknowledged, pending are the input records that are missing or unacknowledged.
+    """
+    if not records:
+        return [], []
+    oldest = min(r[1] for r in records)
+    with transaction() as conn:
+        rows = conn.execute(
+            'SELECT user_id, timestamp, status, punch FROM punches '
+            'WHERE device = ? AND timestamp >= ? AND acked_at IS NOT NULL',
+            (device, oldest)
+        ).fetchall()
+    stored = {(user_id, timestamp, punch): (user_id, timestamp, status, punch) for user_id, timestamp, status, punch in rows}
+    acked, pending = [], []
+    for record in records:
+        row = stored.get((record[0], record[1], record[3]))
+        if row is None:
+            pending.append(record)
+        else:
+            acked.append(row)
+    return acked, pending
+
+
+def record_rotation(device, cleared_through, record_count, record_checksum):
+    with transaction() as conn:
+        conn.execute(
+            'INSERT INTO log_rotations (device, cleared_through, record_count, checksum, rotated_at) VALUES (?, ?, ?, ?, ?)',
+            (device, cleared_through, record_count, record_checksum, time.time())
+        )
+
+
+def last_rotation(device):
+    with transaction() as conn:
+        row = conn.execute(
+            'SELECT cleared_through, record_count, checksum, rotated_at FROM log_rotations '
+            'WHERE device = ? ORDER BY id DESC LIMIT 1',
+            (device,)
+        ).fetchone()
+    if not row:
+        return None
+    return {'cleared_through': row[0], 'record_count': row[1], 'checksum': row[2], 'rotated_at': row[3]}
+
+
+def pending_punches(device, start, end):
+    """Stored records for device in [start, end] (ISO strings) the backend hasn't acknowledged, oldest first"""
+    with transaction() as conn:
+        return conn.execute(
+            'SELECT user_id, timestamp, status, punch FROM punches '
+            'WHERE device = ? AND timestamp >= ? AND timestamp <= ? AND acked_at IS NULL '
+            'ORDER BY timestamp',
+            (device, start, end)
+        ).fetchall()
+
+
+def save_backfill_job(device, start_date, end_date, record_count, user_map):
+    with transaction() as conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO backfill_jobs (device, start_date, end_date, record_count, user_map, pulled_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (device, start_date, end_date, record_count, json.dumps(user_map), time.time())
+        )
+
+
+def get_backfill_job(device, start_date, end_date):
+    """The pulled snapshot for a backfill, or None if this device/range hasn't been pulled yet"""
+    with transaction() as conn:
+        row = conn.execute(
+            'SELECT record_count, user_map, pulled_at FROM backfill_jobs '
+            'WHERE device = ? AND start_date = ? AND end_date = ?',
+            (device, start_date, end_date)
+        ).fetchone()
+    if not row:
+        return None
+    return {'record_count': row[0], 'user_map': json.loads(row[1]), 'pulled_at': row[2]}
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# backfill.py
+"""
+Resumable bulk backfill of historical attendance to the HRMS backend.
+
+Each device is pulled once and its records in the date range are stored in the
+local SQLite store (attendance_store.py). The pending records are then split
+into chunks and uploaded in parallel (bounded by --concurrency). Every chunk the
+backend acknowledges is marked as acked in the store right away, so an
+interrupted backfill can simply be run again: devices that were already pulled
+are not pulled again, and only unacknowledged chunks are sent.
+
+Usage:
+    python backfill.py --start 2020-01-01 --end 2025-12-31 --environment prod
+    python backfill.py --device 192.168.1.100:4370 --device 192.168.1.101 \\
+        --start 2023-01-01 --end 2023-12-31 --chunk-size 500 --concurrency 8
+    python backfill.py ... --repull     # pull the devices again (new punches)
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from dotenv import load_dotenv
+
+import attendance_store
+import circuit_breaker
+import clock_skew
+import daily_summary
+import device_registry
+import serialization
+from record_batch import RecordBatch
+
+load_dotenv()
+
+
+def pull_device(device, start, end, timeout, ommit_ping):
+    """Read users and the attendance log once; returns (records in range, user_map)"""
+    zk = device.zk(timeout=timeout, ommit_ping=ommit_ping)
+    conn = zk.connect()
+    try:
+        users = conn.get_users()
+        batch = RecordBatch.from_device(conn, users)
+    finally:
+        try:
+            conn.disconnect()
+        except Exception:
+            pass
+    user_map = {str(user.user_id): user.name for user in users}
+    return batch.filter_range(start, end).dedup().to_records(), user_map
+
+
+class Progress:
+    """Thread-safe counters with a throughput line per acknowledged chunk"""
+
+    def __init__(self, total_records, total_chunks):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.total_records = total_records
+        self.total_chunks = total_chunks
+        self.records = 0
+        self.chunks = 0
+        self.failed_chunks = 0
+
+    def chunk_done(self, device, count, seconds):
+        with self.lock:
+            self.records += count
+            self.chunks += 1
+            elapsed = time.monotonic() - self.started
+            rate = self.records / elapsed if elapsed else 0
+            remaining = (self.total_records - self.records) / rate if rate else 0
+            print(f"✅ {self.chunks}/{self.total_chunks} chunks  {self.records:,}/{self.total_records:,} records  "
+                  f"{rate:,.0f} rec/s  ETA {remaining:,.0f}s  ({device}, {count} in {seconds:.2f}s)")
+
+    def chunk_failed(self):
+        with self.lock:
+            self.failed_chunks += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--device', action='append', help='ip or ip:port (repeatable, default: every device in the inventory)')
+    parser.add_argument('--start', required=True, help='YYYY-MM-DD')
+    parser.add_argument('--end', required=True, help='YYYY-MM-DD')
+    parser.add_argument('--environment', choices=['dev', 'prod'], default='dev')
+    parser.add_argument('--chunk-size', type=int, default=int(os.getenv('BACKFILL_CHUNK_SIZE', '1000')))
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv('BACKFILL_CONCURRENCY', '4')))
+    parser.add_argument('--retries', type=int, default=3, help='attempts per chunk before leaving it for the next run')
+    parser.add_argument('--timeout', type=int, default=30, help='upload timeout per chunk (seconds)')
+    parser.add_argument('--device-timeout', type=int, default=60)
+    parser.add_argument('--ommit-ping', action='store_true', help='skip the ping check before connecting')
+    parser.add_argument('--repull', action='store_true', help='pull devices again even if already pulled for this range')
+    parser.add_argument('--token', default='', help="bearer token (default: the device's tenant token, "
+                                                    "ADMS_SERVICE_TOKEN for dev/prod)")
+    args = parser.parse_args()
+
+    # Inventory devices carry their comm key, serial and tenant; others are used as given
+    registry = device_registry.current()
+    if args.device:
+        devices = [registry.device(*address) or device_registry.Device(*address)
+                   for address in map(device_registry.parse_address, args.device)]
+    else:
+        devices = registry.ordered
+    if not devices:
+        parser.error('no devices given and the device inventory is empty')
+
+    start = datetime.strptime(args.start, '%Y-%m-%d')
+    end = datetime.strptime(args.end, '%Y-%m-%d').replace(hour=23, minute=59, second=59, microsecond=999999)
+
+    # 1. Pull each device once (skipped for devices already pulled for this range)
+    user_maps = {}
+    # Stored clock corrections (clock_skew.py): summaries and uploads get corrected times
+    corrections = {device.key: clock_skew.stored_corrections(device.key) for device in devices}
+    for inventory_device in devices:
+        device = inventory_device.key
+        job = attendance_store.get_backfill_job(device, args.start, args.end)
+        if job and not args.repull:
+            print(f"📦 {device}: using pull from {datetime.fromtimestamp(job['pulled_at']):%Y-%m-%d %H:%M} "
+                  f"({job['record_count']:,} records)")
+            user_maps[device] = job['user_map']
+            continue
+        print(f"📡 {device}: pulling attendance...")
+        pull_started = time.monotonic()
+        try:
+            records, user_map = pull_device(inventory_device, start, end, args.device_timeout, args.ommit_ping)
+        except Exception as e:
+            print(f"❌ {device}: pull failed: {e}")
+            continue
+        attendance_store.save_punches(device, records)  # device clock, as on the terminal
+        tenant = registry.tenant_for(inventory_device.host, inventory_device.port, args.environment)
+        daily_summary.record_batch(tenant.name, clock_skew.correct_records(records, corrections[device]), user_map)
+        attendance_store.save_backfill_job(device, args.start, args.end, len(records), user_map)
+        user_maps[device] = user_map
+        print(f"📦 {device}: {len(records):,} records in range, pulled in {time.monotonic() - pull_started:.1f}s")
+
+    # 2. Chunk everything not yet acknowledged
+    chunks = []
+    for device, user_map in user_maps.items():
+        pending = attendance_store.pending_punches(device, start.isoformat(), end.isoformat())
+        for i in range(0, len(pending), args.chunk_size):
+            chunks.append((device, pending[i:i + args.chunk_size]))
+    total_records = sum(len(records) for _, records in chunks)
+    if not chunks:
+        print("✅ Nothing to upload - every record in range is already acknowledged")
+        return 0 if len(user_maps) == len(devices) else 1
+
+    # Each device uploads to its tenant's backend (device_registry.py), through that tenant's breaker
+    tenants = {device.key: registry.tenant_for(device.host, device.port, args.environment)
+               for device in devices if device.key in user_maps}
+    for tenant in {tenant.name: tenant for tenant in tenants.values()}.values():
+        if not (args.token or tenant.token):
+            print(f"⚠️  No token for tenant '{tenant.name}' (upload may fail if backend requires auth)")
+    sessions = threading.local()
+    progress = Progress(total_records, len(chunks))
+
+    def upload_chunk(device, records):
+        tenant = tenants[device]
+        if not hasattr(sessions, 'by_tenant'):
+            sessions.by_tenant = {}
+        session = sessions.by_tenant.get(tenant.name)
+        if session is None:
+            session = sessions.by_tenant[tenant.name] = requests.Session()
+        upload_data = attendance_store.to_upload_data(clock_skew.correct_records(records, corrections[device]),
+                                                      user_maps[device])
+        body, upload_headers = serialization.upload_body(upload_data, tenant.headers(args.token or None))
+        attempt = 0
+        while attempt < args.retries:
+            started = time.monotonic()
+            try:
+                response = circuit_breaker.post(tenant.breaker, tenant.upload_url, session=session,
+                                                data=body, headers=upload_headers, timeout=args.timeout)
+                response.raise_for_status()
+            except circuit_breaker.CircuitOpenError as e:
+                # Nothing was sent: wait for the breaker's trial call instead of using up an attempt
+                time.sleep(e.retry_in)
+                continue
+            except requests.exceptions.RequestException as e:
+                attempt += 1
+                if attempt == args.retries:
+                    print(f"❌ {device}: chunk of {len(records)} failed after {attempt} attempts: {e}")
+                    progress.chunk_failed()
+                    return
+                time.sleep(min(2 ** attempt, 30))
+                continue
+            # Checkpoint: this chunk is never sent again
+            attendance_store.mark_acked(device, records)
+            progress.chunk_done(device, len(records), time.monotonic() - started)
+            return
+
+    # 3. Upload with bounded concurrency
+    print(f"📤 Uploading {total_records:,} records in {len(chunks)} chunks of up to {args.chunk_size} "
+          f"to {', '.join(sorted({t.upload_url for t in tenants.values()}))} ({args.concurrency} in parallel)")
+    pool = ThreadPoolExecutor(max_workers=args.concurrency)
+    try:
+        futures = [pool.submit(upload_chunk, device, records) for device, records in chunks]
+        for future in as_completed(futures):
+            future.result()
+    except KeyboardInterrupt:
+        # Chunks already in flight finish (and checkpoint); queued ones are dropped
+        print("\n⏸️  Interrupted - finishing in-flight chunks, run the same command again to resume")
+        pool.shutdown(wait=True, cancel_futures=True)
+        return 130
+    pool.shutdown()
+
+    elapsed = time.monotonic() - progress.started
+    print(f"\n📊 Uploaded {progress.records:,} records in {elapsed:.1f}s "
+          f"({progress.records / elapsed if elapsed else 0:,.0f} rec/s)")
+    if progress.failed_chunks or len(user_maps) != len(devices):
+        print(f"⚠️  {progress.failed_chunks} chunks failed, {len(devices) - len(user_maps)} devices not pulled - "
+              f"run the same command again to resume")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
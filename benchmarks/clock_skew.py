@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Clock skew benchmark: how well skew is estimated, and what correcting costs.
+
+handshake: --devices simulators (zk_simulator.py) with random clock offsets of up
+to +/- --max-skew seconds and --latency-ms per packet; each is connected and
+measured the way a pull does it (clock_skew.handshake). Reports the estimate
+error and the cost of the extra CMD_GET_TIME round trip.
+
+push: --devices iClock terminals with random offsets post a punch every
+--post-minutes, delivered after a random delay (exponential, mean --delay-s),
+after first flushing an hour of backlog. Reports the estimate error once the
+estimate is confirmed, and with and without correction the punches the real-time
+filter drops (server started at the beginning of the run) and how far the
+recorded times are off.
+
+correction: --records pulled records corrected in bulk (RecordBatch columns,
+one and four segments) vs record by record (store tuples).
+
+Usage:
+    python benchmarks/clock_skew.py --devices 20 --latency-ms 20 --records 1000000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+from array import array
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_store_dir = tempfile.TemporaryDirectory()
+os.environ['ZK_STORE_PATH'] = os.path.join(_store_dir.name, 'clock.db')
+os.environ['CLOCK_SKEW_CORRECTION'] = 'True'
+
+from zk_simulator import SimulatedDevice, start_simulator  # noqa: E402
+import clock_skew  # noqa: E402
+import device_registry  # noqa: E402
+import punch_parsing  # noqa: E402
+from record_batch import RecordBatch, to_seconds  # noqa: E402
+
+
+def _quiet(*args, **kwargs):
+    pass
+
+
+def handshake(args, rng):
+    errors, costs = [], []
+    for i in range(args.devices):
+        skew = rng.uniform(-args.max_skew, args.max_skew)
+        simulator = SimulatedDevice(users=1, records=0, serial=f'SIM{i:07d}', latency_ms=args.latency_ms,
+                                    clock_skew=skew)
+        tcp_server, _ = start_simulator(simulator, port=0)
+        device = device_registry.Device('127.0.0.1', tcp_server.server_address[1])
+        conn = device.zk(timeout=10, ommit_ping=True).connect()
+        try:
+            started = time.perf_counter()
+            clock_skew.handshake(conn, device.key)
+            costs.append((time.perf_counter() - started) * 1000)
+        finally:
+            conn.disconnect()
+            tcp_server.shutdown()
+        errors.append(abs(clock_skew.clock(device.key).skew - skew))
+    print(f"handshake  {args.devices} devices, {args.latency_ms} ms per packet: estimate error "
+          f"median {statistics.median(errors):.2f} s, max {max(errors):.2f} s; "
+          f"measurement {statistics.median(costs):.1f} ms")
+
+
+def push(args, rng):
+    server_start = datetime.now().replace(microsecond=0)
+    errors, confirm_minutes = [], []
+    dropped = {'uncorrected': 0, 'corrected': 0}
+    misdated = {'uncorrected': [], 'corrected': []}  # seconds between punch and recorded time
+    posts = 0
+    for i in range(args.devices):
+        skew = rng.uniform(-args.max_skew, args.max_skew)
+        device_clock = clock_skew.DeviceClock(f'SN:PUSH{i:04d}')
+        # An hour of backlog resent in a burst after reconnecting
+        for j in range(12):
+            line = f"{j}\t{server_start - timedelta(minutes=60 - j * 5, seconds=-skew):%Y-%m-%d %H:%M:%S}\t0"
+            punch_parsing.parse_iclock_lines(line, server_start + timedelta(seconds=j), server_start, log=_quiet,
+                                             clock=device_clock)
+        confirmed = None
+        for j in range(int(args.minutes / args.post_minutes)):
+            punched = server_start + timedelta(minutes=(j + 1) * args.post_minutes)
+            now = punched + timedelta(seconds=rng.expovariate(1 / args.delay_s))
+            line = f"{j}\t{punched + timedelta(seconds=skew):%Y-%m-%d %H:%M:%S}\t0"
+            posts += 1
+            for name, clock in (('uncorrected', None), ('corrected', device_clock)):
+                punches = punch_parsing.parse_iclock_lines(line, now, server_start, log=_quiet, clock=clock)
+                if punches:
+                    misdated[name].append(abs((punches[0][1] - punched).total_seconds()))
+                else:
+                    dropped[name] += 1
+            if device_clock.skew is not None and confirmed is None:
+                confirmed = (now - server_start).total_seconds() / 60
+        confirm_minutes.append(confirmed)
+        errors.append(abs(device_clock.skew - skew))
+    print(f"push       {args.devices} devices, a post every {args.post_minutes} min, {args.delay_s} s mean delay: "
+          f"estimate error median {statistics.median(errors):.1f} s, max {max(errors):.1f} s; "
+          f"confirmed after {statistics.median(confirm_minutes):.0f} min")
+    for name in ('uncorrected', 'corrected'):
+        print(f"           {name:<11} {posts:,} punches: {dropped[name]:,} dropped by the real-time filter, "
+              f"time off by median {statistics.median(misdated[name]):.0f} s")
+
+
+def correction(args, rng):
+    batch = RecordBatch()
+    now = datetime.now().replace(microsecond=0)
+    for i in range(args.records):
+        batch.append(str(i % 1000), now - timedelta(seconds=i * 5), 1, i % 2)
+    records = batch.to_records()
+    newest = to_seconds(now)
+    single = [[0, -300]]
+    segmented = [[0, -300], [newest - 3 * 86400, 0], [newest - 2 * 86400, 95], [newest - 86400, 0]]
+    for name, corrections in (('1 segment', single), ('4 segments', segmented)):
+        copy = RecordBatch()
+        copy.timestamps = array('q', batch.timestamps)
+        started = time.perf_counter()
+        clock_skew.correct_batch(copy, corrections)
+        elapsed = time.perf_counter() - started
+        print(f"correction {name:<11} RecordBatch   {elapsed * 1000:8.1f} ms  "
+              f"{args.records / elapsed / 1e6:6.1f} M records/s")
+    started = time.perf_counter()
+    clock_skew.correct_records(records, single)
+    elapsed = time.perf_counter() - started
+    print(f"correction {'1 segment':<11} record tuples {elapsed * 1000:8.1f} ms  "
+          f"{args.records / elapsed / 1e6:6.1f} M records/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=20)
+    parser.add_argument('--max-skew', type=float, default=900, help='largest clock offset in seconds')
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--minutes', type=float, default=120, help='push run length')
+    parser.add_argument('--post-minutes', type=float, default=2)
+    parser.add_argument('--delay-s', type=float, default=5.0, help='mean push delivery delay')
+    parser.add_argument('--records', type=int, default=1000000)
+    args = parser.parse_args()
+    rng = random.Random(1)
+    handshake(args, rng)
+    push(args, rng)
+    correction(args, rng)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Concurrency benchmark: simultaneous device sessions per gunicorn worker.
+
+Starts N simulated terminals (zk_simulator.py) with per-packet latency, runs
+one gunicorn worker with the project's gunicorn.conf.py for each worker class,
+and sends one POST /connect per terminal, all at once. Each request opens a pyzk
+session, reads the user directory and disconnects, so it spends nearly all of
+its time waiting on the device.
+
+"Peak sessions" is the most terminals that had an open session at the same
+moment (sampled from the simulators). With gthread it is capped by
+GUNICORN_THREADS; with gevent, by nothing but the number of requests.
+
+pyzk pings the device before connecting, so `ping` must be on PATH.
+
+Usage:
+    python benchmarks/concurrency.py --devices 64 --latency-ms 50
+    python benchmarks/concurrency.py --devices 200 --worker-class gevent
+"""
+import os
+import sys
+import time
+import socket
+import tempfile
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from zk_simulator import SimulatedDevice, start_simulator  # noqa: E402
+
+SECRET_KEY = 'concurrency-benchmark'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def session_cookie():
+    app = Flask('benchmark')
+    app.secret_key = SECRET_KEY
+    return SecureCookieSessionInterface().get_signing_serializer(app).dumps({'user_id': 'benchmark'})
+
+
+def start_gunicorn(worker_class, threads, store_dir):
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), GUNICORN_WORKER_CLASS=worker_class, GUNICORN_THREADS=str(threads),
+               SECRET_KEY=SECRET_KEY, ZK_STORE_PATH=os.path.join(store_dir, f'{worker_class}.db'),
+               DEVICE_REGISTRY_PATH=os.path.join(store_dir, 'none.json'), PULL_SCHEDULER='False')
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'server:app', '--config', 'gunicorn.conf.py',
+                                '--workers', '1', '--log-level', 'warning'],
+                               cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return process, port
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"gunicorn ({worker_class}) did not start")
+
+
+def run(worker_class, devices, ports, threads, store_dir):
+    process, port = start_gunicorn(worker_class, threads, store_dir)
+    cookie = session_cookie()
+    peak = 0
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak
+        while not done.is_set():
+            peak = max(peak, sum(1 for device in devices if device.session is not None))
+            time.sleep(0.002)
+
+    def connect(device_port):
+        started = time.monotonic()
+        response = requests.post(f'http://127.0.0.1:{port}/connect', json={'ip': f'127.0.0.1:{device_port}'},
+                                 cookies={'session': cookie}, timeout=300)
+        return response.status_code, time.monotonic() - started
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=len(ports)) as pool:
+            results = list(pool.map(connect, ports))
+        elapsed = time.monotonic() - started
+    finally:
+        done.set()
+        process.terminate()
+        process.wait(timeout=30)
+
+    ok = sum(1 for status, _ in results if status == 200)
+    latencies = sorted(seconds for _, seconds in results)
+    print(f"{worker_class:<8} {elapsed:8.2f} s  {ok / elapsed:8.1f} req/s  peak sessions {peak:>4}  "
+          f"p50 {latencies[len(latencies) // 2]:6.2f} s  max {latencies[-1]:6.2f} s  ok {ok}/{len(ports)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=64)
+    parser.add_argument('--users', type=int, default=200, help='users per simulated terminal')
+    parser.add_argument('--latency-ms', type=float, default=50.0, help='per-packet device latency')
+    parser.add_argument('--threads', type=int, default=8, help='GUNICORN_THREADS for gthread')
+    parser.add_argument('--worker-class', action='append', choices=['gthread', 'gevent'],
+                        help='repeatable (default: gthread and gevent)')
+    args = parser.parse_args()
+
+    devices, ports = [], []
+    for i in range(args.devices):
+        device = SimulatedDevice(users=args.users, records=0, serial=f'SIM{i:07d}', latency_ms=args.latency_ms)
+        tcp_server, _ = start_simulator(device, port=0)
+        devices.append(device)
+        ports.append(tcp_server.server_address[1])
+    print(f"{args.devices} terminals, {args.users} users each, {args.latency_ms} ms per packet, "
+          f"1 worker ({args.threads} threads for gthread)\n")
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        for worker_class in args.worker_class or ['gthread', 'gevent']:
+            run(worker_class, devices, ports, args.threads, store_dir)
+
+
+if __name__ == '__main__':
+    main()
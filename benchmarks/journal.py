@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Ingest journal benchmark: cost on the request path, and replay throughput.
+
+request path: --requests /iclock/cdata posts (--lines punches each) through the
+Flask test client, with the journal off and on, each in a fresh process. Uploads
+are off (no backend configured), so a request is parse + daily summaries (+ the
+journal).
+
+replay: writes a synthetic journal of --entries pushes from --devices terminals
+(80% iClock posts, 20% webhook JSON in the three formats) with the journal's own
+writer, then replays it with ingest_journal.py's engine:
+
+- dry run: parse only
+- full: parse, daily summaries and uploads to a local stub backend
+
+Usage:
+    python benchmarks/journal.py --requests 2000 --entries 200000
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def request_worker(requests, lines):
+    """Time `requests` iClock posts through the app; prints microseconds per request as JSON"""
+    import server
+    client = server.app.test_client()
+    now = datetime.now()
+    bodies = ['\n'.join(f"{1000 + (i * lines + j) % 500}\t{now:%Y-%m-%d %H:%M:%S}\t{j % 2}\t1\t0" for j in range(lines))
+              for i in range(requests)]
+    for body in bodies[:50]:  # warm up
+        client.post('/iclock/cdata?SN=BENCH0001', data=body)
+    started = time.perf_counter()
+    for body in bodies:
+        client.post('/iclock/cdata?SN=BENCH0001', data=body)
+    elapsed = time.perf_counter() - started
+    print(json.dumps({'us_per_request': elapsed / requests * 1e6}))
+
+
+def time_requests(args, work_dir, journal):
+    env = dict(os.environ, ZK_STORE_PATH=os.path.join(work_dir, f"requests-{journal}.db"), DEV_BACKEND_URL='',
+               PROD_BACKEND_URL='', PULL_SCHEDULER='False', TRACE_FILE='',
+               INGEST_JOURNAL_DIR=os.path.join(work_dir, 'request-journal') if journal else '')
+    out = subprocess.run([sys.executable, __file__, '--request-worker', str(args.requests), '--lines', str(args.lines)],
+                         cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads([line for line in out.splitlines() if line.startswith('{')][-1])['us_per_request']
+
+
+class _Backend(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = b'{"success": true}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def write_journal(args, directory):
+    import ingest_journal
+    import serialization
+    rng = random.Random(1)
+    raw = 0
+    writer = ingest_journal.JournalWriter(directory, 64 * 1024 * 1024, 3600, 0, datetime.now() - timedelta(hours=1),
+                                          max_queue=args.entries + 1)
+    received = time.time() - 3600
+    for i in range(args.entries):
+        received += 0.01
+        at = datetime.fromtimestamp(received - rng.uniform(0, 60))
+        device = rng.randrange(args.devices)
+        user_id = str(1000 + rng.randrange(2000))
+        entry = {'t': received, 'm': 'POST', 'ip': f"10.0.{device // 250}.{device % 250}", 's': 200,
+                 'h': {'User-Agent': 'iClock Proxy/1.09'}}
+        if rng.random() < 0.8:
+            lines = '\n'.join(f"{user_id}\t{at:%Y-%m-%d %H:%M:%S}\t{rng.randrange(2)}\t1\t0"
+                              for _ in range(rng.randint(1, 3)))
+            entry.update(p='/iclock/cdata', q=f"SN=SIM{device:07d}&table=ATTLOG", b=lines)
+        else:
+            payload = rng.choice([
+                {'user_id': user_id, 'timestamp': f"{at:%Y-%m-%d %H:%M:%S}", 'punch': rng.randrange(2)},
+                {'data': [{'userId': user_id, 'time': at.isoformat(), 'punch': rng.randrange(2)}]},
+                {'attendance': [{'user_id': user_id, 'time': at.isoformat(), 'punch': rng.randrange(2)}]},
+            ])
+            entry.update(p='/adms/webhook', q='', b=json.dumps(payload))
+            entry['h']['Content-Type'] = 'application/json'
+        raw += len(serialization.dumps(entry)) + 1
+        writer.put(entry)
+    writer.flush(600)
+    writer.close()
+    return ingest_journal.segments(directory), raw
+
+
+def replay(name, paths, dry_run):
+    import ingest_journal
+    args = SimpleNamespace(failed=False, since=None, until=None, path=None, device=None, progress_seconds=3600)
+    replayer = ingest_journal.Replayer(dry_run=dry_run)
+    read, elapsed = ingest_journal.run_replay(paths, args, replayer)
+    drain = 0.0
+    if not dry_run:
+        import upload_batcher
+        drain_started = time.monotonic()
+        upload_batcher.flush(600)
+        drain = time.monotonic() - drain_started
+    counters = replayer.counters
+    total = elapsed + drain
+    print(f"{name:<14} {total:7.1f} s  {read:>9,} entries  {read / total:9,.0f} entries/s  "
+          f"{counters['punches']:>9,} punches  {counters['punches'] / total:9,.0f} punches/s"
+          f"{f'  (upload drain {drain:.1f} s)' if not dry_run else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--request-worker', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--lines', type=int, default=2, help='punches per iClock post (request path)')
+    parser.add_argument('--entries', type=int, default=200000)
+    parser.add_argument('--devices', type=int, default=200)
+    args = parser.parse_args()
+    if args.request_worker:
+        request_worker(args.request_worker, args.lines)
+        return
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        print(f"request path: {args.requests:,} /iclock/cdata posts, {args.lines} punches each")
+        off = time_requests(args, work_dir, journal=False)
+        on = time_requests(args, work_dir, journal=True)
+        print(f"journal off    {off:8.0f} us/request")
+        print(f"journal on     {on:8.0f} us/request  (+{on - off:.0f} us, {(on - off) / off:+.1%})\n")
+
+        backend = ThreadingHTTPServer(('127.0.0.1', 0), _Backend)
+        threading.Thread(target=backend.serve_forever, daemon=True).start()
+        os.environ.update(ZK_STORE_PATH=os.path.join(work_dir, 'replay.db'), PULL_SCHEDULER='False',
+                          DEV_BACKEND_URL=f"http://127.0.0.1:{backend.server_address[1]}",
+                          UPLOAD_QUEUE_SIZE='20000', UPLOAD_BATCH_SIZE='500')
+        directory = os.path.join(work_dir, 'journal')
+        started = time.monotonic()
+        paths, raw = write_journal(args, directory)
+        size = sum(os.path.getsize(path) for path in paths)
+        print(f"replay: {args.entries:,} pushes from {args.devices} devices written in "
+              f"{time.monotonic() - started:.1f}s, {raw / 1024 / 1024:.1f} MB -> {size / 1024 / 1024:.1f} MB "
+              f"gzip ({size / args.entries:.0f} bytes per push)")
+        replay('dry run', paths, dry_run=True)
+        replay('full', paths, dry_run=False)
+
+
+if __name__ == '__main__':
+    main()
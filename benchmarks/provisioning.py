@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Provisioning benchmark: roll a roster out to many simulated terminals.
+
+Starts --devices simulators (zk_simulator.py) with per-packet latency, each
+already holding --existing users, and runs provisioning.py's engine in-process:
+
+- rollout: the roster (--roster users) onto every device
+- changes: --change-rate of the roster renamed, then rolled out again; only the
+           changed users are written
+- baseline: what the same rollout costs with plain pyzk calls on one device
+            (set_user per user, each followed by its own refresh), extrapolated
+            to all users and devices done one after another
+
+"Disabled" is the longest time any terminal stayed disabled, as measured by the
+simulators.
+
+Usage:
+    python benchmarks/provisioning.py --devices 50 --roster 5000 --latency-ms 2
+    python benchmarks/provisioning.py --devices 10 --roster 1000 --concurrency 4 --window 100
+"""
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from zk import ZK  # noqa: E402
+from zk_simulator import SimulatedDevice, start_simulator  # noqa: E402
+import device_registry  # noqa: E402
+import provisioning  # noqa: E402
+
+
+def rollout(name, devices, simulators, roster, args):
+    for simulator in simulators:
+        simulator.stats['max_disabled_seconds'] = 0.0
+    options = SimpleNamespace(prune=False, dry_run=False, window=args.window, pause=args.pause,
+                              retries=3, device_timeout=60, ommit_ping=True)
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda device: provisioning.provision_device(device, roster, options), devices))
+    elapsed = time.monotonic() - started
+    writes = sum(r['added'] + r['updated'] + r['deleted'] for r in results)
+    errors = sum(1 for r in results if r['error'])
+    apply_times = sorted(r['apply_seconds'] for r in results)
+    disabled = max(s.stats['max_disabled_seconds'] for s in simulators)
+    print(f"{name:<10} {elapsed:8.1f} s  {writes:>9,} writes  {writes / elapsed if elapsed else 0:9,.0f} writes/s  "
+          f"apply per device p50 {apply_times[len(apply_times) // 2]:6.1f} s max {apply_times[-1]:6.1f} s  "
+          f"longest disabled {disabled:5.2f} s  errors {errors}")
+
+
+def baseline(port, roster, args, sample=200):
+    """Plain pyzk on one device: disabled throughout, set_user + refresh per user"""
+    conn = ZK('127.0.0.1', port=port, ommit_ping=True).connect()
+    try:
+        users = conn.get_users()
+        uid = max((user.uid for user in users), default=0) + 1
+        sample_ids = list(roster)[:sample]
+        conn.disable_device()
+        started = time.monotonic()
+        for offset, user_id in enumerate(sample_ids):
+            conn.set_user(uid=uid + offset, name=f"Baseline {user_id}", user_id=f"b{user_id}")
+        per_user = (time.monotonic() - started) / len(sample_ids)
+        conn.enable_device()
+    finally:
+        conn.disconnect()
+    per_device = per_user * len(roster)
+    total = per_device * args.devices
+    print(f"{'baseline':<10} {total:8.1f} s  {len(roster) * args.devices:>9,} writes  "
+          f"{1 / per_user:9,.0f} writes/s  (pyzk set_user, one device at a time; each terminal disabled "
+          f"{per_device:.1f} s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=20)
+    parser.add_argument('--roster', type=int, default=5000, help='users on the roster')
+    parser.add_argument('--existing', type=int, default=0, help='users already on each terminal')
+    parser.add_argument('--change-rate', type=float, default=0.02, help='share of users changed for the second run')
+    parser.add_argument('--latency-ms', type=float, default=2.0, help='per-packet device latency')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--window', type=int, default=200)
+    parser.add_argument('--pause', type=float, default=0.5)
+    args = parser.parse_args()
+
+    simulators, devices = [], []
+    for i in range(args.devices):
+        simulator = SimulatedDevice(users=args.existing, records=0, serial=f'SIM{i:07d}', latency_ms=args.latency_ms)
+        tcp_server, _ = start_simulator(simulator, port=0)
+        simulators.append(simulator)
+        devices.append(device_registry.Device('127.0.0.1', tcp_server.server_address[1]))
+    roster = {str(i): {'name': f"Employee {i:05d}", 'privilege': 0, 'password': None, 'group_id': None, 'card': None}
+              for i in range(1, args.roster + 1)}
+    print(f"{args.devices} terminals ({args.existing} users each), roster of {args.roster:,}, "
+          f"{args.latency_ms} ms per packet, {args.concurrency} devices at a time, window {args.window}\n")
+
+    rollout('rollout', devices, simulators, roster, args)
+    step = max(1, int(1 / args.change_rate)) if args.change_rate else 0
+    for user_id in list(roster)[::step] if step else []:
+        roster[user_id] = dict(roster[user_id], name=f"Renamed {user_id}")
+    rollout('changes', devices, simulators, roster, args)
+    baseline(devices[0].port, roster, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Pull-path benchmark against the local ZK simulator (zk_simulator.py).
+
+Starts a simulated terminal in-process and times zk_utils.fetch_attendance:
+
+- full:        every record on the device falls inside the date range
+- incremental: new punches are added, then only today's window is requested
+               (pyzk has no offset read, so the whole log is still transferred)
+- transfer:    raw CMD_ATTLOG_RRQ buffer read without pyzk's record parsing,
+               to separate wire time from parse time
+
+"Disabled" is how long the terminal stayed disabled (measured by the simulator).
+
+Usage:
+    python benchmarks/pull.py --records 50000 --users 500
+    python benchmarks/pull.py --records 20000 --latency-ms 2 --udp
+"""
+import os
+import sys
+import time
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from zk import ZK, const  # noqa: E402
+from zk_simulator import SimulatedDevice, start_simulator  # noqa: E402
+from zk_utils import fetch_attendance  # noqa: E402
+
+
+def report(name, seconds, transferred, returned, device, bytes_before):
+    rate = transferred / seconds if seconds else 0
+    print(f"{name:<12} {seconds:8.2f} s  {rate:12,.0f} rec/s  transferred {transferred:>9,}  "
+          f"returned {returned:>9,}  disabled {device.stats['last_disabled_seconds']:7.2f} s  "
+          f"wire {(device.stats['bytes_sent'] - bytes_before) / 1e6:8.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--records', type=int, default=50000)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--new-records', type=int, default=200, help='punches added before the incremental pull')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--loss', type=float, default=0.0)
+    parser.add_argument('--udp', action='store_true')
+    args = parser.parse_args()
+
+    device = SimulatedDevice(users=args.users, records=args.records, days=args.days,
+                             latency_ms=args.latency_ms, loss=args.loss)
+    tcp_server, udp_server = start_simulator(device, port=0)
+    port = tcp_server.server_address[1]
+    print(f"Simulator: {args.users:,} users, {args.records:,} records, latency {args.latency_ms} ms, "
+          f"loss {args.loss * 100:.1f}%, {'UDP' if args.udp else 'TCP'}\n")
+
+    try:
+        # Full pull: the date range covers every record on the device
+        start_date = (datetime.now() - timedelta(days=args.days + 1)).strftime('%Y-%m-%d')
+        end_date = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
+        bytes_before = device.stats['bytes_sent']
+        started = time.perf_counter()
+        records = fetch_attendance('127.0.0.1', port, start_date, end_date, force_udp=args.udp, ommit_ping=True)
+        report('full', time.perf_counter() - started, device.record_count, len(records), device, bytes_before)
+
+        # Incremental pull: a few new punches, then only today's window
+        for i in range(args.new_records):
+            device.add_punch(str(i % args.users + 1), punch=i % 2)
+        today = datetime.now().strftime('%Y-%m-%d')
+        tomorrow = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
+        bytes_before = device.stats['bytes_sent']
+        started = time.perf_counter()
+        records = fetch_attendance('127.0.0.1', port, today, tomorrow, force_udp=args.udp, ommit_ping=True)
+        report('incremental', time.perf_counter() - started, device.record_count, len(records), device, bytes_before)
+
+        # Wire-only: same transfer without pyzk's per-record parsing
+        zk = ZK('127.0.0.1', port=port, timeout=5, force_udp=args.udp, ommit_ping=True)
+        conn = zk.connect()
+        bytes_before = device.stats['bytes_sent']
+        started = time.perf_counter()
+        conn.disable_device()
+        conn.read_sizes()
+        data, size = conn.read_with_buffer(const.CMD_ATTLOG_RRQ)
+        conn.enable_device()
+        report('transfer', time.perf_counter() - started, device.record_count, device.record_count, device, bytes_before)
+        conn.disconnect()
+    finally:
+        tcp_server.shutdown()
+        udp_server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Record-path benchmark: list-of-dicts vs RecordBatch (record_batch.py).
+
+Both paths start from the same raw attendance buffer (as read from a device)
+and do what /attendance does: decode, filter to a date range, build the upload
+payload and the dashboard's logs, and serialize both to JSON.
+
+- dicts: pyzk Attendance objects -> `logs` dicts -> `upload_data` dicts -> json.dumps
+         (records decoded linearly here, so pyzk's quadratic parse isn't counted)
+- batch: RecordBatch.parse -> filter_range -> dedup -> to_upload_json / to_logs_json
+
+"Memory" is what the decoded records hold while the request is being handled
+(tracemalloc, raw buffer excluded), "peak" the highest allocation during the run.
+
+Usage:
+    python benchmarks/records.py --records 100000 --users 500
+"""
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import tracemalloc
+from struct import unpack, iter_unpack
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from zk.attendance import Attendance  # noqa: E402
+from zk.user import User  # noqa: E402
+from record_batch import RecordBatch  # noqa: E402
+from zk_simulator import SimulatedDevice  # noqa: E402
+
+
+def decode_time(t):
+    second = t % 60
+    t //= 60
+    minute = t % 60
+    t //= 60
+    hour = t % 24
+    t //= 24
+    day = t % 31 + 1
+    t //= 31
+    month = t % 12 + 1
+    year = t // 12 + 2000
+    return datetime(year, month, day, hour, minute, second)
+
+
+def dicts_path(data, user_map, start, end):
+    attendance = []
+    for uid, user_id, status, timestamp, punch, _ in iter_unpack('<H24sBIB8s', data[4:]):
+        user_id = user_id.split(b'\x00')[0].decode(errors='ignore')
+        attendance.append(Attendance(user_id, decode_time(timestamp), status, punch, uid))
+    logs = []
+    for a in attendance:
+        if start <= a.timestamp <= end:
+            logs.append({
+                'user_id': a.user_id,
+                'name': user_map.get(str(a.user_id), f'User {a.user_id}'),
+                'number': str(a.user_id),
+                'dateTime': a.timestamp.isoformat(),
+                'status': 'Check In' if a.punch == 0 else 'Check Out'
+            })
+    upload_data = [
+        {'dateTime': log['dateTime'], 'name': log['name'], 'status': log['status'], 'number': log['number']}
+        for log in logs
+    ]
+    return (attendance, logs, upload_data), lambda: (json.dumps(upload_data), json.dumps(logs))
+
+
+def batch_path(data, users, start, end):
+    batch = RecordBatch.parse(data, unpack('<I', data[:4])[0] // 40, users)
+    batch = batch.filter_range(start, end).dedup()
+    return batch, lambda: (batch.to_upload_json(), batch.to_logs_json())
+
+
+def measure(name, build, *args, repeat=3):
+    # Timing runs without tracemalloc (it slows every allocation down)
+    build_times, serialize_times = [], []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        held, serialize = build(*args)
+        built = time.perf_counter()
+        upload_json, logs_json = serialize()
+        serialize_times.append(time.perf_counter() - built)
+        build_times.append(built - started)
+        del held, serialize
+
+    gc.collect()
+    tracemalloc.start()
+    held, serialize = build(*args)
+    holding, _ = tracemalloc.get_traced_memory()
+    serialize()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<6} build {min(build_times):7.3f} s  serialize {min(serialize_times):7.3f} s  "
+          f"memory {holding / 1e6:8.1f} MB  peak {peak / 1e6:8.1f} MB  upload JSON {len(upload_json) / 1e6:6.1f} MB")
+    return upload_json, logs_json
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--records', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--range-days', type=int, default=365, help='date range kept by the filter')
+    args = parser.parse_args()
+
+    device = SimulatedDevice(users=args.users, records=args.records, days=args.days)
+    data = len(device.attlog).to_bytes(4, 'little') + bytes(device.attlog)
+    users = [User(u['uid'], u['name'], u['privilege'], user_id=u['user_id']) for u in device.users.values()]
+    user_map = {str(user.user_id): user.name for user in users}
+    end = datetime.now().replace(hour=23, minute=59, second=59, microsecond=999000)
+    start = (end - timedelta(days=args.range_days)).replace(hour=0, minute=0, second=0, microsecond=0)
+    print(f"{args.records:,} records, {args.users:,} users, keeping the last {args.range_days} days\n")
+
+    dicts_json = measure('dicts', dicts_path, data, user_map, start, end)
+    batch_json = measure('batch', batch_path, data, users, start, end)
+    if [json.loads(s) for s in dicts_json] != [json.loads(s) for s in batch_json]:
+        print("\n⚠️  Outputs differ")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Serialization benchmark: bytes on the wire and CPU per 10,000 records.
+
+Encodes the /attendance/upload payload and the /attendance response logs with:
+
+- requests:  json.dumps defaults (what requests.post(json=...) sends)
+- json:      stdlib, compact separators (serialization.dumps without orjson)
+- orjson:    orjson.dumps, if installed
+- batch:     RecordBatch.to_upload_json / to_logs_json (record_batch.py)
+
+and then gzips the upload body at a few compression levels.
+
+Usage:
+    python benchmarks/serialization.py --records 10000 --users 500
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from zk.user import User  # noqa: E402
+from record_batch import RecordBatch  # noqa: E402
+from zk_simulator import SimulatedDevice  # noqa: E402
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def cpu_ms(fn, repeat):
+    """Best-of-`repeat` CPU time of fn() in milliseconds, and its result"""
+    best = None
+    for _ in range(repeat):
+        started = time.process_time()
+        result = fn()
+        elapsed = time.process_time() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--records', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    device = SimulatedDevice(users=args.users, records=args.records, days=30)
+    data = len(device.attlog).to_bytes(4, 'little') + bytes(device.attlog)
+    users = [User(u['uid'], u['name'], u['privilege'], user_id=u['user_id']) for u in device.users.values()]
+    batch = RecordBatch.parse(data, device.record_count, users)
+    logs = [
+        {'user_id': user_id, 'name': batch.names[batch.user_idx[i]], 'number': user_id,
+         'dateTime': timestamp, 'status': 'Check In' if punch == 0 else 'Check Out'}
+        for i, (user_id, timestamp, _, punch) in enumerate(batch.to_records())
+    ]
+    upload_data = [{k: log[k] for k in ('dateTime', 'name', 'status', 'number')} for log in logs]
+    scale = 10000 / args.records
+
+    encoders = [
+        ('requests', lambda obj: json.dumps(obj).encode()),
+        ('json', lambda obj: json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode()),
+    ]
+    if orjson:
+        encoders.append(('orjson', orjson.dumps))
+
+    print(f"{args.records:,} records, {args.users:,} users, orjson {'installed' if orjson else 'not installed'} "
+          f"(figures per 10,000 records)\n")
+    print(f"{'encoder':<10} {'upload ms':>10} {'upload KB':>10} {'logs ms':>9} {'logs KB':>9}")
+    bodies = {}
+    for name, encode in encoders:
+        upload_ms, body = cpu_ms(lambda: encode(upload_data), args.repeat)
+        logs_ms, logs_body = cpu_ms(lambda: encode(logs), args.repeat)
+        bodies[name] = body
+        print(f"{name:<10} {upload_ms * scale:10.1f} {len(body) * scale / 1024:10.1f} "
+              f"{logs_ms * scale:9.1f} {len(logs_body) * scale / 1024:9.1f}")
+    upload_ms, body = cpu_ms(lambda: batch.to_upload_json().encode(), args.repeat)
+    logs_ms, logs_body = cpu_ms(lambda: batch.to_logs_json().encode(), args.repeat)
+    bodies['batch'] = body
+    print(f"{'batch':<10} {upload_ms * scale:10.1f} {len(body) * scale / 1024:10.1f} "
+          f"{logs_ms * scale:9.1f} {len(logs_body) * scale / 1024:9.1f}")
+
+    print(f"\n{'gzip':<10} {'ms':>10} {'KB':>10} {'ratio':>9}")
+    body = bodies['batch']
+    for level in (1, 6, 9):
+        ms, compressed = cpu_ms(lambda: gzip.compress(body, level), args.repeat)
+        print(f"{'level ' + str(level):<10} {ms * scale:10.1f} {len(compressed) * scale / 1024:10.1f} "
+              f"{len(body) / len(compressed):8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Sharded pull benchmark: scheduled-pull throughput with 1..N scheduler processes.
+
+Starts --devices simulated terminals (zk_simulator.py) with per-packet latency,
+writes a device inventory where every terminal wants a pull every
+--interval seconds, and runs --workers scheduler processes (pull_scheduler.py
+with PULL_SHARDING=True) sharing one local store. Each process pulls at most
+PULL_CONCURRENCY devices at a time, so one process can't keep up with many
+terminals; more processes split the devices through leases (device_leases.py).
+
+Reported per worker count:
+- pulls/s:   completed pulls per second, all processes together
+- busy:      connections a terminal refused because another session held it
+             (two processes pulling the same device); should stay 0
+- per proc:  pulls done by each process
+
+--failover kills one of the processes halfway through and reports how long its
+devices went without a pull before another process took them over
+(about PULL_LEASE_SECONDS).
+
+pyzk pings the device before connecting, so `ping` must be on PATH.
+
+Usage:
+    python benchmarks/sharding.py --devices 120 --workers 1 2 4
+    python benchmarks/sharding.py --devices 60 --workers 3 --failover --lease-seconds 6
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def worker(seconds):
+    """Run one sharded scheduler for `seconds`, then print its pull counts as JSON"""
+    import pull_scheduler
+    scheduler = pull_scheduler.start()
+    time.sleep(seconds)
+    with scheduler.lock:
+        pulls = {key: schedule.pulls for key, schedule in scheduler.schedules.items() if schedule.pulls}
+    scheduler.stop()
+    print(json.dumps({'member': scheduler.leases.member, 'pulls': pulls}))
+
+
+def longest_gap(simulators, since, until):
+    """Longest time any terminal went without a new session between since and until (time.time())"""
+    last = {id(s): (since, s.stats['connects']) for s in simulators}
+    gap = 0.0
+    while time.time() < until:
+        now = time.time()
+        for s in simulators:
+            seen_at, connects = last[id(s)]
+            if s.stats['connects'] != connects:
+                gap = max(gap, now - seen_at)
+                last[id(s)] = (now, s.stats['connects'])
+        time.sleep(0.05)
+    return max([gap] + [until - seen_at for seen_at, _ in last.values()])
+
+
+def run(workers, args, store_dir, simulators, kill_one=False):
+    from attendance_store import connect
+    store = os.path.join(store_dir, f'store-{workers}{"-failover" if kill_one else ""}.db')
+    connect(store).close()
+    env = dict(os.environ, ZK_STORE_PATH=store, DEVICE_REGISTRY_PATH=os.path.join(store_dir, 'devices.json'),
+               PULL_SCHEDULER='True', PULL_SHARDING='True', PULL_CONCURRENCY=str(args.concurrency),
+               PULL_LEASE_SECONDS=str(args.lease_seconds), PULL_LOOKBACK_DAYS='1', DEV_BACKEND_URL='')
+    processes = [subprocess.Popen([sys.executable, __file__, '--worker', str(args.seconds)], cwd=ROOT, env=env,
+                                  stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+                 for _ in range(workers)]
+
+    gap = None
+    if kill_one:
+        time.sleep(args.seconds / 2)
+        processes[0].send_signal(signal.SIGKILL)  # no clean release: its leases have to expire
+        killed_at = time.time()
+        gap = longest_gap(simulators, killed_at, killed_at + args.seconds / 2 - 1)
+    results = []
+    for process in processes:
+        out, _ = process.communicate(timeout=args.seconds + 60)
+        lines = [line for line in out.splitlines() if line.startswith('{')]
+        if lines:  # the killed process never prints its counts
+            results.append(json.loads(lines[-1]))
+    return results, gap
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--worker', type=float, help=argparse.SUPPRESS)
+    parser.add_argument('--devices', type=int, default=120)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--records', type=int, default=2000, help='attendance records per terminal')
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='per-packet device latency')
+    parser.add_argument('--interval', type=int, default=1, help='pull_interval of every device (seconds)')
+    parser.add_argument('--concurrency', type=int, default=4, help='PULL_CONCURRENCY per process')
+    parser.add_argument('--lease-seconds', type=float, default=6.0)
+    parser.add_argument('--seconds', type=float, default=20.0, help='run time per worker count')
+    parser.add_argument('--failover', action='store_true', help='kill one process halfway through')
+    args = parser.parse_args()
+    if args.worker:
+        worker(args.worker)
+        return
+
+    from zk_simulator import SimulatedDevice, start_simulator
+    simulators, entries = [], []
+    for i in range(args.devices):
+        simulator = SimulatedDevice(users=50, records=args.records, days=1, serial=f'SIM{i:07d}',
+                                    latency_ms=args.latency_ms)
+        tcp_server, _ = start_simulator(simulator, port=0)
+        simulators.append(simulator)
+        entries.append({'host': '127.0.0.1', 'port': tcp_server.server_address[1], 'serial': simulator.serial,
+                        'pull_interval': args.interval})
+    print(f"{args.devices} terminals ({args.records:,} records, {args.latency_ms} ms per packet), pull every "
+          f"{args.interval}s, {args.concurrency} pulls at a time per process, {args.seconds:.0f}s per run\n")
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        with open(os.path.join(store_dir, 'devices.json'), 'w') as f:
+            json.dump({'devices': entries}, f)
+        for workers in ([max(args.workers)] if args.failover else args.workers):
+            busy_before = sum(s.stats['busy_rejections'] for s in simulators)
+            results, gap = run(workers, args, store_dir, simulators, kill_one=args.failover)
+            busy = sum(s.stats['busy_rejections'] for s in simulators) - busy_before
+            per_process = sorted((sum(r['pulls'].values()) for r in results), reverse=True)
+            total = sum(per_process)
+            print(f"workers {workers:>2}  {total / args.seconds:8.1f} pulls/s  busy {busy:>4}  "
+                  f"per proc {per_process}")
+            if gap is not None:
+                print(f"killed 1 of {workers} processes after {args.seconds / 2:.0f}s: longest time a terminal "
+                      f"then went without a pull {gap:.1f}s (lease {args.lease_seconds:.0f}s, "
+                      f"interval {args.interval}s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Import-time / RSS report for the server entry point.
+
+Spawns a fresh interpreter per run (like a new gunicorn worker), imports the
+module and reports cold-start time, peak RSS and the slowest imports.
+
+Usage:
+    python benchmarks/startup.py                 # measures server:app
+    python benchmarks/startup.py app --runs 10   # compare against the desktop launcher
+"""
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import resource, sys, time
+t = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(f"RESULT {{elapsed:.6f}} {{rss_kb}} {{len(sys.modules)}}")
+"""
+
+
+def run_once(module, importtime=False):
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ['-X', 'importtime']
+    cmd += ['-c', CHILD.format(module=module)]
+    proc = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+    match = re.search(r'RESULT (\S+) (\d+) (\d+)', proc.stdout)
+    if not match:
+        print(proc.stdout)
+        print(proc.stderr)
+        sys.exit(f"Failed to import {module}")
+    elapsed, rss_kb, modules = float(match.group(1)), int(match.group(2)), int(match.group(3))
+    return elapsed, rss_kb, modules, proc.stderr
+
+
+def top_imports(importtime_output, module, limit):
+    """Parse `-X importtime` output and return the slowest imports made directly by module"""
+    children = {}
+    for line in importtime_output.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)', line)
+        if not match:
+            continue
+        cumulative, indent, name = int(match.group(1)), len(match.group(2)), match.group(3)
+        # Children are printed before their parent, two extra spaces deeper
+        if indent == 3:
+            children[name] = cumulative
+        elif indent == 1:
+            if name == module:
+                return sorted(children.items(), key=lambda item: -item[1])[:limit]
+            children = {}
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('module', nargs='?', default='server')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    results = [run_once(args.module) for _ in range(args.runs)]
+    times = sorted(r[0] for r in results)
+    rss = sorted(r[1] for r in results)
+    print(f"Module: {args.module} ({args.runs} cold starts)")
+    print(f"   Import time  median {times[len(times) // 2] * 1000:.1f} ms   min {times[0] * 1000:.1f} ms")
+    print(f"   Peak RSS     median {rss[len(rss) // 2] / 1024:.1f} MB")
+    print(f"   Modules      {results[0][2]}")
+
+    _, _, _, importtime_output = run_once(args.module, importtime=True)
+    print(f"\nSlowest imports made by {args.module} (cumulative):")
+    for name, micros in top_imports(importtime_output, args.module, args.top):
+        print(f"   {micros / 1000:8.1f} ms  {name}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Template backup benchmark: back up fingerprint templates of many simulated
+terminals, then restore them.
+
+Starts --devices simulators (zk_simulator.py) with per-packet latency, all
+enrolled with the same --users people and --fingers fingers each (one company
+roster across sites, so identical templates are everywhere), and runs
+template_backup.py's engine in-process against a temporary store:
+
+- backup (1 at a time / parallel): every device read and stored
+- restore (empty): the first device's backup pushed to a factory-new terminal
+- restore (5% missing): --missing of the templates deleted on a device, restored
+- restore (nothing missing): the same restore again; nothing is written
+
+Store size is the raw size of all backed-up templates vs what the store keeps
+(each unique template once, compressed).
+
+Usage:
+    python benchmarks/template_backup.py --devices 20 --users 500 --fingers 2 --latency-ms 2
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_store_dir = tempfile.TemporaryDirectory()
+os.environ['ZK_STORE_PATH'] = os.path.join(_store_dir.name, 'templates.db')
+
+from zk_simulator import SimulatedDevice, start_simulator  # noqa: E402
+import device_registry  # noqa: E402
+import template_backup  # noqa: E402
+
+
+def backup(name, devices, concurrency, options):
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda device: template_backup.backup_device(device, options), devices))
+    elapsed = time.monotonic() - started
+    templates = sum(r['templates'] for r in results)
+    errors = sum(1 for r in results if r['error'])
+    print(f"{name:<28} {elapsed:7.1f} s  {templates:>8,} templates  {templates / elapsed:8,.0f} templates/s  "
+          f"errors {errors}")
+
+
+def restore(name, device, source, simulator, options):
+    simulator.stats['max_disabled_seconds'] = 0.0
+    written_before = simulator.stats['templates_written']
+    result = template_backup.restore_device(device, source.key, options)
+    pushed = simulator.stats['templates_written'] - written_before
+    print(f"{name:<28} {result['total_seconds']:7.1f} s  {pushed:>8,} pushed     "
+          f"{result['templates_present']:>8,} already there  longest disabled "
+          f"{simulator.stats['max_disabled_seconds']:5.2f} s  {result['error'] or ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=20)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--fingers', type=int, default=2)
+    parser.add_argument('--missing', type=float, default=0.05, help='share of templates deleted before the incremental restore')
+    parser.add_argument('--latency-ms', type=float, default=2.0, help='per-packet device latency')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--window', type=int, default=50)
+    parser.add_argument('--pause', type=float, default=0.5)
+    args = parser.parse_args()
+    options = SimpleNamespace(dry_run=False, window=args.window, pause=args.pause, retries=3, device_timeout=60,
+                              ommit_ping=True)
+
+    def simulate(serial, users):
+        simulator = SimulatedDevice(users=users, records=0, serial=serial, latency_ms=args.latency_ms,
+                                    fingers=args.fingers)
+        tcp_server, _ = start_simulator(simulator, port=0)
+        return simulator, device_registry.Device('127.0.0.1', tcp_server.server_address[1])
+
+    terminals = [simulate(f'SIM{i:07d}', args.users) for i in range(args.devices)]
+    simulators = [simulator for simulator, _ in terminals]
+    devices = [device for _, device in terminals]
+    print(f"{args.devices} terminals, {args.users} users x {args.fingers} fingers each, "
+          f"{args.latency_ms} ms per packet, {args.concurrency} devices at a time\n")
+
+    backup('backup (1 at a time)', devices, 1, options)
+    backup(f'backup ({args.concurrency} at a time)', devices, args.concurrency, options)
+    summary = template_backup.stats()
+    raw, stored = summary['raw_bytes'], summary['stored_bytes']
+    print(f"{'store':<28} {summary['templates']:,} templates, {raw / 1024:,.0f} KB raw -> "
+          f"{summary['unique_templates']:,} unique, {summary['unique_bytes'] / 1024:,.0f} KB -> "
+          f"{stored / 1024:,.0f} KB compressed ({raw / stored:.1f}x smaller)\n")
+
+    replacement, replacement_device = simulate('SIMNEW0001', 0)
+    restore('restore (empty terminal)', replacement_device, devices[0], replacement, options)
+
+    simulator = simulators[1]
+    step = max(1, int(1 / args.missing))
+    for key in sorted(simulator.templates)[::step]:
+        del simulator.templates[key]
+    restore(f'restore ({args.missing:.0%} missing)', devices[1], devices[1], simulator, options)
+    restore('restore (nothing missing)', devices[1], devices[1], simulator, options)
+
+
+if __name__ == '__main__':
+    main()
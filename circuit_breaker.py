@@ -0,0 +1,188 @@
+# circuit_breaker.py
+"""
+Circuit breaker for HRMS backend calls.
+
+One breaker per backend tenant (the built-in dev/prod, plus any in the device
+registry). While the backend is healthy the breaker
+is CLOSED and calls go straight through. When too many recent calls fail or are
+slow it OPENS, and calls fail immediately with CircuitOpenError instead of
+waiting for the request timeout. After BREAKER_OPEN_SECONDS it goes HALF-OPEN
+and lets a few trial calls through; if they succeed it closes, otherwise it
+opens again. Each state change starts a new generation, and a call's outcome only
+counts for the generation it was admitted in: a slow call from before an outage
+can't close the breaker in place of a trial.
+"""
+import os
+import time
+import threading
+from collections import deque
+
+import requests
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised instead of calling the backend while the breaker is open"""
+
+    def __init__(self, message, retry_in=1.0):
+        super().__init__(message)
+        self.retry_in = retry_in  # seconds until the breaker may let a call through
+
+
+class CircuitBreaker:
+    def __init__(self, name, window=20, min_calls=5, failure_rate=0.5,
+                 slow_call_seconds=5.0, slow_call_rate=0.8, open_seconds=30.0, half_open_calls=1):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.calls = deque(maxlen=window)  # (failed, slow) per recent call
+        self.opened_at = None
+        self.generation = 0
+        self.trials_in_flight = 0
+        self.trial_successes = 0
+        self.last_error = None
+        self.counters = {'calls': 0, 'failures': 0, 'slow_calls': 0, 'short_circuited': 0, 'times_opened': 0}
+
+    @classmethod
+    def from_env(cls, name):
+        return cls(
+            name,
+            window=int(os.getenv('BREAKER_WINDOW', '20')),
+            min_calls=int(os.getenv('BREAKER_MIN_CALLS', '5')),
+            failure_rate=float(os.getenv('BREAKER_FAILURE_RATE', '0.5')),
+            slow_call_seconds=float(os.getenv('BREAKER_SLOW_CALL_SECONDS', '5')),
+            slow_call_rate=float(os.getenv('BREAKER_SLOW_CALL_RATE', '0.8')),
+            open_seconds=float(os.getenv('BREAKER_OPEN_SECONDS', '30')),
+            half_open_calls=int(os.getenv('BREAKER_HALF_OPEN_CALLS', '1')),
+        )
+
+    def _open(self, now):
+        self.state = OPEN
+        self.generation += 1
+        self.opened_at = now
+        self.trials_in_flight = 0
+        self.trial_successes = 0
+        self.counters['times_opened'] += 1
+        print(f"🔌 Circuit breaker '{self.name}' OPEN - backend calls will fail fast for {self.open_seconds:.0f}s")
+
+    def before_call(self):
+        """Reserve permission for one call and return its generation for record(), or raise CircuitOpenError"""
+        with self.lock:
+            now = time.monotonic()
+            if self.state == OPEN:
+                if now - self.opened_at < self.open_seconds:
+                    self.counters['short_circuited'] += 1
+                    retry_in = self.open_seconds - (now - self.opened_at)
+                    raise CircuitOpenError(f"{self.name} backend circuit is open (retry in {retry_in:.0f}s)", retry_in)
+                self.state = HALF_OPEN
+                self.generation += 1
+                print(f"🔌 Circuit breaker '{self.name}' HALF-OPEN - sending trial request")
+            if self.state == HALF_OPEN:
+                if self.trials_in_flight >= self.half_open_calls:
+                    self.counters['short_circuited'] += 1
+                    raise CircuitOpenError(f"{self.name} backend circuit is half-open (trial in progress)")
+                self.trials_in_flight += 1
+            self.counters['calls'] += 1
+            return self.generation
+
+    def record(self, generation, failed, elapsed, error=None):
+        """Report the outcome of a call that before_call allowed (and returned `generation` for)"""
+        slow = elapsed >= self.slow_call_seconds
+        with self.lock:
+            if failed:
+                self.counters['failures'] += 1
+                self.last_error = error
+            if slow:
+                self.counters['slow_calls'] += 1
+            now = time.monotonic()
+            if generation != self.generation:
+                return  # admitted before the last state change
+
+            if self.state == HALF_OPEN:
+                self.trials_in_flight = max(0, self.trials_in_flight - 1)
+                if failed or slow:
+                    self._open(now)
+                else:
+                    self.trial_successes += 1
+                    if self.trial_successes >= self.half_open_calls:
+                        self.state = CLOSED
+                        self.generation += 1
+                        self.calls.clear()
+                        print(f"🔌 Circuit breaker '{self.name}' CLOSED - backend recovered")
+                return
+
+            if self.state != CLOSED:
+                return
+            self.calls.append((failed, slow))
+            if len(self.calls) < self.min_calls:
+                return
+            failures = sum(1 for f, _ in self.calls if f)
+            slow_calls = sum(1 for _, s in self.calls if s)
+            if failures / len(self.calls) >= self.failure_rate or slow_calls / len(self.calls) >= self.slow_call_rate:
+                self._open(now)
+
+    def snapshot(self):
+        with self.lock:
+            recent = len(self.calls)
+            snapshot = {
+                'state': self.state,
+                'recent_calls': recent,
+                'recent_failure_rate': round(sum(1 for f, _ in self.calls if f) / recent, 3) if recent else 0,
+                'recent_slow_rate': round(sum(1 for _, s in self.calls if s) / recent, 3) if recent else 0,
+                'last_error': self.last_error,
+                **self.counters,
+            }
+            if self.state == OPEN:
+                snapshot['retry_in_seconds'] = round(max(0, self.open_seconds - (time.monotonic() - self.opened_at)), 1)
+            return snapshot
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """Breaker for one backend tenant, created on first use"""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker.from_env(name)
+        return breaker
+
+
+def snapshot_all():
+    with _breakers_lock:
+        breakers = list(_breakers.items())
+    return {name: breaker.snapshot() for name, breaker in breakers}
+
+
+def post(breaker, url, session=None, **kwargs):
+    """
+    requests.post through a breaker. Connection errors, timeouts and 5xx responses
+    count as failures; 4xx means the backend is up and counts as a success.
+    Raises CircuitOpenError without touching the network while the breaker is open.
+    Pass a requests.Session to reuse connections across calls.
+    """
+    generation = breaker.before_call()
+    start = time.monotonic()
+    try:
+        response = (session or requests).post(url, **kwargs)
+    except requests.exceptions.RequestException as e:
+        breaker.record(generation, True, time.monotonic() - start, str(e))
+        raise
+    except BaseException:
+        breaker.record(generation, True, time.monotonic() - start, 'interrupted')
+        raise
+    failed = response.status_code >= 500
+    breaker.record(generation, failed, time.monotonic() - start, f"HTTP {response.status_code}" if failed else None)
+    return response
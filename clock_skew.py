@@ -0,0 +1,407 @@
+# clock_skew.py
+"""
+Per-device clock skew: how far each terminal's clock is from the server's, and
+correcting punch timestamps by it.
+
+Terminals stamp punches with their own wall clock, which drifts and is often set
+by hand. A skewed clock mis-dates every punch, and the iClock real-time filter
+drops punches from a clock that is behind. Skew is device time minus server time
+in seconds (positive: the device is ahead).
+
+Estimates, kept per device:
+- handshake (pulled devices): when a pull connects, the device clock is read (one
+  CMD_GET_TIME round trip) and compared with the midpoint of the round trip. The
+  error is half the round trip plus half a second (the clock reports whole
+  seconds).
+- push (iClock devices): the iClock heartbeat carries no device time, so every
+  /iclock/cdata post is a sample: newest punch time minus receipt time, i.e. the
+  skew minus the delivery delay. The largest sample of the last PUSH_WINDOW is
+  the estimate (a minimum-delay filter). It is only used once the samples span
+  PUSH_CONFIRM, so a burst of resent backlog is not taken for a clock that is
+  hours behind.
+
+With CLOCK_SKEW_CORRECTION=True the skew is subtracted from punch timestamps,
+once per batch: the RecordBatch columns of a pull, the parsed lines of a post.
+Skews under CLOCK_SKEW_THRESHOLD seconds are left alone, and the correction in
+use only changes when the estimate moves away from it by more than the
+threshold. Pulled devices keep their corrections in the local store as segments
+of device time, so punches that are pulled again (or were recorded before a
+clock sync) keep the correction they were first given. The store keeps raw
+device times, which log rotation checks the device log against; uploads that
+don't handshake first (log rotation, backfill.py) use the stored corrections.
+Pushing devices' corrections are stored as segments of receipt time, which a
+journal replay (ingest_journal.py) applies instead of estimating. A handshake
+only reads and writes the store when correcting or syncing, after its device
+I/O, and only writes when the corrections or the measured skew changed.
+
+With CLOCK_SYNC_HOURS set, a scheduled pull that finds the skew over the
+threshold sets the terminal's clock to server time (at most once per interval).
+"""
+import os
+import json
+import time
+import threading
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+
+import attendance_store
+import cooperative
+from record_batch import to_seconds
+
+PUSH_WINDOW = 2 * 3600  # seconds of push samples the estimate is taken from
+PUSH_CONFIRM = 600  # push samples must span this long before they are trusted
+MAX_SEGMENTS = 8  # correction segments kept per pulled device
+MAX_TRACKED_DEVICES = 10000  # clocks kept in memory, least recently seen dropped first
+
+
+def _settings():
+    global _config
+    if _config is None:
+        _config = (
+            os.getenv('CLOCK_SKEW_CORRECTION', 'False').lower() == 'true',
+            float(os.getenv('CLOCK_SKEW_THRESHOLD', '60')),
+            float(os.getenv('CLOCK_SYNC_HOURS', '0')),
+        )
+    return _config
+
+
+_config = None
+
+
+def is_correcting():
+    return _settings()[0]
+
+
+def _sticky(current, skew, threshold):
+    """Correction to use next: `current` unless the estimate moved away from it by the threshold"""
+    if skew is None or abs(skew - current) < threshold:
+        return current
+    return round(skew) if abs(skew) >= threshold else 0
+
+
+class DeviceClock:
+    def __init__(self, key):
+        self.key = key
+        self.lock = threading.Lock()
+        self.samples = deque()  # (received epoch, newest punch minus receipt in seconds)
+        self.skew = None
+        self.source = None
+        self.error = None  # +/- seconds, handshakes only
+        self.measured_at = None
+        self.correction = 0  # seconds subtracted from this device's pushed punches
+        self.handshakes = 0
+        self.posts = 0
+        self.synced_at = None
+
+    def observe_handshake(self, device_time, sent, received):
+        # The device reports whole seconds: on average it is half a second further on
+        skew = device_time.timestamp() + 0.5 - (sent + received) / 2
+        with self.lock:
+            self.skew, self.source, self.measured_at = skew, 'handshake', received
+            self.error = (received - sent) / 2 + 0.5
+            self.handshakes += 1
+        return skew
+
+    def observe_push(self, newest, received):
+        """newest: latest device timestamp in a post; received: the post's receipt time (datetime)"""
+        received_at = received.timestamp()
+        with self.lock:
+            self.posts += 1
+            self.samples.append((received_at, (newest - received).total_seconds()))
+            while self.samples[0][0] < received_at - PUSH_WINDOW:
+                self.samples.popleft()
+            if len(self.samples) > 1 and received_at - self.samples[0][0] >= PUSH_CONFIRM:
+                self.skew = max(sample for _, sample in self.samples)
+                self.source, self.error, self.measured_at = 'push', None, received_at
+
+    def push_correction(self):
+        """Seconds to subtract from this device's pushed punch times (0 unless correcting)"""
+        correcting, threshold, _ = _settings()
+        with self.lock:
+            previous, self.correction = self.correction, _sticky(self.correction, self.skew, threshold)
+            correction = self.correction
+        if correcting and correction != previous:
+            _save_push_correction(self.key, correction)
+        return correction if correcting else 0
+
+    def describe(self):
+        with self.lock:
+            return {
+                'skew_seconds': round(self.skew, 1) if self.skew is not None else None,
+                'source': self.source,
+                'error_seconds': round(self.error, 2) if self.error is not None else None,
+                'measured_at': datetime.fromtimestamp(self.measured_at).isoformat(timespec='seconds')
+                if self.measured_at else None,
+                'correction_seconds': self.correction if is_correcting() else 0,
+                'handshakes': self.handshakes,
+                'posts': self.posts,
+                'synced_at': datetime.fromtimestamp(self.synced_at).isoformat(timespec='seconds')
+                if self.synced_at else None,
+            }
+
+
+_clocks = OrderedDict()
+_lock = threading.Lock()
+
+
+def clock(key):
+    """
+    This process's clock state for a device (host:port or iClock device ID). Keys
+    come from the device, so at most MAX_TRACKED_DEVICES are kept; an evicted push
+    device starts collecting samples again.
+    """
+    with _lock:
+        device_clock = _clocks.get(key)
+        if device_clock is None:
+            device_clock = _clocks[key] = DeviceClock(key)
+            if len(_clocks) > MAX_TRACKED_DEVICES:
+                _clocks.popitem(last=False)
+        else:
+            _clocks.move_to_end(key)
+        return device_clock
+
+
+# ---------------------------------------------------------------------------
+# Pulled devices
+
+def _measure(conn, device_clock):
+    sent = time.time()
+    device_time = conn.get_time()
+    return device_clock.observe_handshake(device_time, sent, time.time())
+
+
+def _load(conn, key):
+    """(corrections, synced_at, stored skew) for a device; ([], None, None) when nothing is stored"""
+    row = conn.execute('SELECT corrections, synced_at, skew FROM device_clocks WHERE device = ?', (key,)).fetchone()
+    return (json.loads(row[0]), row[1], row[2]) if row else ([], None, None)
+
+
+def _stored(key):
+    with attendance_store.transaction() as store:
+        return _load(store, key)
+
+
+def _add_segment(corrections, start, seconds):
+    """Use `seconds` for punches stamped from device time `start` on"""
+    return (corrections + [[to_seconds(start), seconds]])[-MAX_SEGMENTS:]
+
+
+def _update(key, skew, measured_at, threshold, sync_boundary=None, synced_at=None, synced_skew=None):
+    """
+    One short read-modify-write of a device's stored clock (no device I/O inside):
+    a new correction segment when `skew` moved past the threshold, a 0 segment from
+    `sync_boundary` after a clock sync. Writes only when something changed.
+    Returns the corrections.
+    """
+    with attendance_store.transaction() as store:
+        store.execute('BEGIN IMMEDIATE')  # another process may be updating the same device
+        loaded, stored_synced_at, stored_skew = _load(store, key)
+        current = loaded[-1][1] if loaded else 0
+        correction = _sticky(current, skew, threshold)
+        if not loaded:
+            corrections = [[0, correction]]  # the first measurement also covers punches already on the device
+        elif correction != current:
+            corrections = _add_segment(loaded, datetime.now() + timedelta(seconds=skew), correction)
+        else:
+            corrections = loaded
+        if correction != current:
+            print(f"🕒 {key}: clock {skew:+.0f}s off" if correction else f"🕒 {key}: clock back in step")
+        if sync_boundary is not None:
+            corrections = _add_segment(corrections, sync_boundary, 0)
+            skew = synced_skew
+        new_skew = skew is not None and (stored_skew is None or abs(skew - stored_skew) >= 1)
+        if corrections != loaded or sync_boundary is not None or new_skew:
+            store.execute(
+                'INSERT INTO device_clocks (device, skew, measured_at, corrections, synced_at) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (device) DO UPDATE SET skew = COALESCE(excluded.skew, skew), '
+                'measured_at = COALESCE(excluded.measured_at, measured_at), corrections = excluded.corrections, '
+                'synced_at = excluded.synced_at',
+                (key, skew, measured_at if skew is not None else None, json.dumps(corrections),
+                 synced_at or stored_synced_at)
+            )
+    return corrections
+
+
+def handshake(conn, key, sync=False):
+    """
+    Measure a connected device's skew and return its correction segments
+    ([[from device seconds, correction seconds]], oldest first; see correct_batch),
+    or [] when not correcting. With sync=True (scheduled pulls) the device clock is
+    set when a sync is due. The local store is only read and written when correcting
+    or syncing, after the device I/O; a failed measurement keeps the stored
+    corrections, and a store failure is logged and returns [].
+    """
+    device_clock = clock(key)
+    correcting, threshold, sync_hours = _settings()
+    try:
+        skew = _measure(conn, device_clock)
+    except Exception as e:
+        print(f"⚠️  Could not read the clock of {key}: {e}")
+        skew = None
+    syncing = sync and sync_hours
+    if not (correcting or syncing):
+        return []
+
+    sync_boundary = synced_at = synced_skew = None
+    try:
+        if syncing and skew is not None and abs(skew) >= threshold:
+            last_sync = cooperative.offload(_stored, key)[1]
+            if last_sync is None or time.time() - last_sync >= sync_hours * 3600:
+                # Punches from here on carry the new clock's time; the boundary is the
+                # old clock's next second (for a clock that was ahead, punches in the first
+                # `skew` seconds after the sync still get the old correction)
+                boundary = datetime.now() + timedelta(seconds=skew + 1)
+                try:
+                    conn.set_time(datetime.now())
+                except Exception as e:
+                    print(f"⚠️  Could not set the clock of {key}: {e}")
+                else:
+                    sync_boundary, synced_at = boundary, time.time()
+                    device_clock.synced_at = synced_at
+                    print(f"🕒 {key}: clock was {skew:+.0f}s off, set to server time")
+                    try:
+                        synced_skew = _measure(conn, device_clock)
+                    except Exception as e:
+                        print(f"⚠️  Could not read the clock of {key} after setting it: {e}")
+        corrections = cooperative.offload(_update, key, skew, device_clock.measured_at, threshold, sync_boundary,
+                                          synced_at, synced_skew)
+    except Exception as e:
+        print(f"⚠️  Could not update the stored clock of {key}: {e}")
+        return []
+    device_clock.correction = corrections[-1][1] if corrections else 0
+    return corrections if correcting else []
+
+
+def correct_batch(batch, corrections):
+    """Apply handshake() corrections to a RecordBatch in place; returns whether any applied"""
+    if not any(seconds for _, seconds in corrections):
+        return False
+    batch.shift_timestamps([start for start, _ in corrections[1:]], [seconds for _, seconds in corrections])
+    return True
+
+
+def correct_records(records, corrections):
+    """Apply handshake() corrections to store records (user_id, timestamp_iso, status, punch)"""
+    if not any(seconds for _, seconds in corrections):
+        return records
+    starts = [start for start, _ in corrections[1:]]
+    corrected = []
+    for user_id, timestamp, status, punch in records:
+        device_time = datetime.fromisoformat(timestamp)
+        seconds = corrections[bisect_right(starts, to_seconds(device_time))][1]
+        corrected.append((user_id, (device_time - timedelta(seconds=seconds)).isoformat(), status, punch))
+    return corrected
+
+
+def stored_corrections(key):
+    """
+    A pulled device's stored correction segments (as handshake() returns them), for
+    uploads that don't connect first: log rotation, backfill. [] when not correcting.
+    """
+    if not is_correcting():
+        return []
+    try:
+        return cooperative.offload(_stored, key)[0]
+    except Exception as e:
+        print(f"⚠️  Could not read the stored clock of {key}: {e}")
+        return []
+
+
+# ---------------------------------------------------------------------------
+# Pushing devices
+
+def _append_push_segment(key, seconds, now):
+    with attendance_store.transaction() as store:
+        store.execute('BEGIN IMMEDIATE')
+        corrections = _load(store, key)[0] or [[0, 0]]
+        corrections = (corrections + [[int(now), seconds]])[-MAX_SEGMENTS:]
+        store.execute(
+            'INSERT INTO device_clocks (device, corrections) VALUES (?, ?) '
+            'ON CONFLICT (device) DO UPDATE SET corrections = excluded.corrections',
+            (key, json.dumps(corrections))
+        )
+
+
+def _save_push_correction(key, seconds):
+    """
+    Keep a pushing device's correction history, as segments of server (receipt)
+    time, so a journal replay (ingest_journal.py) applies what the route applied
+    """
+    try:
+        cooperative.offload(_append_push_segment, key, seconds, time.time())
+    except Exception as e:
+        print(f"⚠️  Could not store the clock correction of {key}: {e}")
+
+
+class StoredCorrection:
+    """Stands in for a DeviceClock in punch_parsing: a fixed correction, no sampling"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def observe_push(self, newest, received):
+        pass
+
+    def push_correction(self):
+        return self.seconds
+
+
+def push_corrections(key):
+    """A pushing device's stored correction segments ([[from receipt epoch, seconds]], oldest first)"""
+    with attendance_store.transaction() as store:
+        return _load(store, key)[0]
+
+
+def correction_at(corrections, received):
+    """The correction in use at receipt time `received` (epoch seconds)"""
+    if not corrections:
+        return 0
+    return corrections[bisect_right([start for start, _ in corrections[1:]], received)][1]
+
+
+# ---------------------------------------------------------------------------
+# Reporting
+
+def _stored_clocks(keys):
+    with attendance_store.transaction() as store:
+        return store.execute(
+            f"SELECT device, skew, measured_at, corrections, synced_at FROM device_clocks "
+            f"WHERE device IN ({','.join('?' * len(keys))})", keys
+        ).fetchall()
+
+
+def statuses(keys):
+    """Skew per device: this process's estimate, else what the device's last handshake stored"""
+    with _lock:
+        result = {key: _clocks[key].describe() for key in keys if key in _clocks}
+    stored = [key for key in keys if key not in result]
+    if stored:
+        rows = cooperative.offload(_stored_clocks, stored)
+        correcting = is_correcting()
+        for device, skew, measured_at, corrections, synced_at in rows:
+            corrections = json.loads(corrections)
+            result[device] = {
+                'skew_seconds': round(skew, 1) if skew is not None else None,
+                'source': 'handshake',
+                'measured_at': datetime.fromtimestamp(measured_at).isoformat(timespec='seconds') if measured_at else None,
+                'correction_seconds': corrections[-1][1] if corrections and correcting else 0,
+                'synced_at': datetime.fromtimestamp(synced_at).isoformat(timespec='seconds') if synced_at else None,
+            }
+    return result
+
+
+def snapshot():
+    """Settings, and the devices whose clock is off by at least the threshold (GET /devices has the rest)"""
+    correcting, threshold, sync_hours = _settings()
+    with _lock:
+        clocks = list(_clocks.values())
+    described = (device_clock.describe() for device_clock in clocks)
+    return {
+        'correction': correcting,
+        'threshold_seconds': threshold,
+        'sync_hours': sync_hours,
+        'tracked_devices': len(clocks),
+        'devices': {device_clock.key: status for device_clock, status in zip(clocks, described)
+                    if status['skew_seconds'] is not None and abs(status['skew_seconds']) >= threshold},
+    }
@@ -0,0 +1,48 @@
+# cooperative.py
+"""
+Support for running under gevent workers (GUNICORN_WORKER_CLASS=gevent).
+
+gunicorn's gevent worker monkey-patches the standard library before it imports
+server.py. pyzk's device sockets, requests' backend calls, time.sleep, locks,
+queues and background "threads" then all yield to each other, so one worker can
+hold hundreds of device sessions and uploads at once. Two things still need care:
+
+- CPU-heavy work and blocking C calls (gzip, SQLite writes that may wait on the
+  database lock) don't yield. While one runs, every other request in the worker
+  waits. offload() runs them on gevent's pool of real OS threads instead.
+- Limits sized for a handful of OS threads (live feed streams, concurrent ingest
+  requests, pools) can be much higher when a request only costs a greenlet.
+  default_limit() picks the default for the current mode.
+
+Without gevent, both are no-ops and the server behaves exactly as before.
+"""
+import sys
+
+
+def is_cooperative():
+    """True when gevent has monkey-patched sockets in this process"""
+    if 'gevent' not in sys.modules:
+        return False
+    from gevent import monkey
+    return monkey.is_module_patched('socket')
+
+
+def mode():
+    return 'gevent' if is_cooperative() else 'threads'
+
+
+def offload(fn, *args, **kwargs):
+    """
+    fn(*args, **kwargs), on a native thread when running under gevent so the
+    worker's other greenlets keep running. fn must not use locks or other state
+    shared with greenlets.
+    """
+    if not is_cooperative():
+        return fn(*args, **kwargs)
+    import gevent
+    return gevent.get_hub().threadpool.apply(fn, args, kwargs)
+
+
+def default_limit(threaded, cooperative):
+    """Default for an env-configurable limit (as a string, for os.getenv)"""
+    return str(cooperative if is_cooperative() else threaded)
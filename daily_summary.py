@@ -0,0 +1,253 @@
+# daily_summary.py
+"""
+Daily attendance summaries per employee: first check-in, last check-out,
+number of punches and worked time.
+
+Summaries are kept up to date as punches come in (pulls in /attendance, the pull
+scheduler and backfill.py; pushes on /adms/webhook and /iclock/cdata) instead
+of being derived from raw logs at report time. Summaries are per tenant
+(device_registry.py): the same user ID on two tenants' devices is two employees.
+Each punch is recorded once per tenant in summary_punches, whichever device or
+path it came through. Timestamps are stored as naive local time, the way
+terminals stamp punches; a push with a UTC offset is converted. A punch that is new
+costs one insert plus re-summarizing its own (user, day) from that day's few
+punches; punches already seen cost one ignored insert. Nothing else is touched.
+
+Worked time adds up each check-in and the next check-out after it. A check-in
+without a check-out (or the reverse) adds nothing.
+
+Usage (fill summaries from punches already in the local store):
+    python daily_summary.py --rebuild --start 2025-01-01 --end 2025-12-31
+"""
+import sys
+import time
+import argparse
+from datetime import datetime
+
+import attendance_store
+import cooperative
+import device_registry
+
+def is_check_in(punch):
+    """Pulled records carry punch 0/1, pushes a status code or 'Check In' / 'Check Out'"""
+    return punch in (0, '0', 'Check In')
+
+
+def local_time(timestamp):
+    """ISO timestamp as naive local time: one with a UTC offset is converted, others are kept"""
+    if len(timestamp) <= 19:  # no room for an offset (YYYY-MM-DDTHH:MM:SS)
+        return timestamp
+    parsed = datetime.fromisoformat(timestamp)
+    return parsed.astimezone().replace(tzinfo=None).isoformat() if parsed.tzinfo else timestamp
+
+
+def summarize(day_punches):
+    """[(timestamp_iso, punch), ...] sorted -> (first_in, last_out, punches, worked_seconds)"""
+    first_in = last_out = opened = None
+    worked = 0
+    for timestamp, punch in day_punches:
+        if punch == 0:
+            first_in = first_in or timestamp
+            opened = opened or timestamp
+        else:
+            last_out = timestamp
+            if opened:
+                worked += int((datetime.fromisoformat(timestamp[:19]) - datetime.fromisoformat(opened[:19])).total_seconds())
+                opened = None
+    return first_in, last_out, len(day_punches), worked
+
+
+def _record(conn, tenant, punches, names):
+    """Returns the (user, day)s re-summarized and the positions in `punches` that were new"""
+    affected = set()
+    new = []
+    for position, (user_id, timestamp, punch) in enumerate(punches):
+        user_id = str(user_id)
+        timestamp = local_time(timestamp)
+        inserted = conn.execute(
+            'INSERT OR IGNORE INTO summary_punches (tenant, user_id, timestamp, punch) VALUES (?, ?, ?, ?)',
+            (tenant, user_id, timestamp, 0 if is_check_in(punch) else 1)
+        ).rowcount
+        if inserted:
+            affected.add((user_id, timestamp[:10]))
+            new.append(position)
+
+    now = time.time()
+    for user_id, day in affected:
+        day_punches = conn.execute(
+            'SELECT timestamp, punch FROM summary_punches '
+            'WHERE tenant = ? AND user_id = ? AND timestamp >= ? AND timestamp < ? ORDER BY timestamp',
+            (tenant, user_id, day, day + '\uffff')
+        ).fetchall()
+        first_in, last_out, count, worked = summarize(day_punches)
+        conn.execute(
+            'INSERT INTO daily_summaries (tenant, user_id, day, name, first_in, last_out, punches, worked_seconds, '
+            'updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (tenant, user_id, day) DO UPDATE SET name = COALESCE(excluded.name, name), '
+            'first_in = excluded.first_in, last_out = excluded.last_out, punches = excluded.punches, '
+            'worked_seconds = excluded.worked_seconds, updated_at = excluded.updated_at',
+            (tenant, user_id, day, names.get(user_id), first_in, last_out, count, worked, now)
+        )
+    return affected, new
+
+
+def _migrate():
+    """
+    Move summaries kept before they had a tenant (set aside by attendance_store.py)
+    into the current tables, under tenant '', re-summarizing with local timestamps.
+    """
+    global _migrated
+    if _migrated:
+        return
+    with attendance_store.transaction() as conn:
+        conn.execute('BEGIN IMMEDIATE')  # one process moves them; the others find them gone
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'summary_punches_pre_tenant'").fetchone():
+            names = dict(conn.execute('SELECT user_id, name FROM daily_summaries_pre_tenant WHERE name IS NOT NULL'))
+            punches = conn.execute('SELECT user_id, timestamp, punch FROM summary_punches_pre_tenant').fetchall()
+            updated = len(_record(conn, '', punches, names)[0])
+            conn.execute('DROP TABLE summary_punches_pre_tenant')
+            conn.execute('DROP TABLE daily_summaries_pre_tenant')
+            print(f"📊 Moved {len(punches):,} summary punches ({updated:,} employee-days) from before "
+                  f"summaries had a tenant to tenant ''")
+    _migrated = True
+
+
+_migrated = False
+
+
+def record(tenant, punches, names=None):
+    """
+    Add a tenant's punches [(user_id, timestamp_iso, punch), ...] and update the
+    summaries of the (user, day)s that gained a new punch. names maps user_id ->
+    display name. Returns the number of (user, day) summaries updated.
+    """
+    _migrate()
+    with attendance_store.transaction() as conn:
+        return len(_record(conn, tenant, punches, names or {})[0])
+
+
+def record_new(tenant, punches, names=None):
+    """record(), returning the positions in `punches` of those not recorded before"""
+    _migrate()
+    with attendance_store.transaction() as conn:
+        return _record(conn, tenant, list(punches), names or {})[1]
+
+
+def record_safely(tenant, punches, names=None):
+    """record() for ingest paths: a summary problem is logged, never raised"""
+    try:
+        # SQLite may wait on the database lock; keep that off the gevent loop
+        cooperative.offload(record, tenant, list(punches), names)
+    except Exception as e:
+        print(f"⚠️  Daily summary update failed: {e}")
+
+
+def record_batch(tenant, records, user_map=None):
+    """attendance_store records (user_id, timestamp, status, punch) from a pull"""
+    record_safely(tenant, ((user_id, timestamp, punch) for user_id, timestamp, _, punch in records), user_map)
+
+
+def query(start, end, user_ids=None, cursor=None, limit=100, tenant=None):
+    """
+    Summaries for days start..end (YYYY-MM-DD), ordered by (day, tenant, user_id),
+    optionally for one tenant. cursor is the (day, tenant, user_id) of the last row
+    of the previous page. Returns (rows, next cursor or None).
+    """
+    _migrate()
+    sql = ('SELECT tenant, user_id, day, name, first_in, last_out, punches, worked_seconds FROM daily_summaries '
+           'WHERE day >= ? AND day <= ?')
+    params = [start, end]
+    if tenant is not None:
+        sql += ' AND tenant = ?'
+        params.append(tenant)
+    if user_ids:
+        sql += f" AND user_id IN ({','.join('?' * len(user_ids))})"
+        params += list(user_ids)
+    if cursor:
+        sql += ' AND (day, tenant, user_id) > (?, ?, ?)'
+        params += list(cursor)
+    sql += ' ORDER BY day, tenant, user_id LIMIT ?'
+    params.append(limit + 1)
+    with attendance_store.transaction() as conn:
+        rows = conn.execute(sql, params).fetchall()
+
+    summaries = [{
+        'tenant': row_tenant,
+        'user_id': user_id,
+        'date': day,
+        'name': name,
+        'first_in': first_in,
+        'last_out': last_out,
+        'punches': punches,
+        'worked_seconds': worked,
+        'worked_hours': round(worked / 3600, 2),
+    } for row_tenant, user_id, day, name, first_in, last_out, punches, worked in rows[:limit]]
+    last = rows[limit - 1] if len(rows) > limit else None
+    return summaries, (last[2], last[0], last[1]) if last else None
+
+
+def totals(start, end, user_ids=None, tenant=None):
+    """Per-employee (tenant, user) totals over days start..end, from the summaries only"""
+    _migrate()
+    sql = ('SELECT tenant, user_id, MAX(name), COUNT(*), SUM(punches), SUM(worked_seconds) FROM daily_summaries '
+           'WHERE day >= ? AND day <= ?')
+    params = [start, end]
+    if tenant is not None:
+        sql += ' AND tenant = ?'
+        params.append(tenant)
+    if user_ids:
+        sql += f" AND user_id IN ({','.join('?' * len(user_ids))})"
+        params += list(user_ids)
+    sql += ' GROUP BY tenant, user_id ORDER BY tenant, user_id'
+    with attendance_store.transaction() as conn:
+        rows = conn.execute(sql, params).fetchall()
+    return [{
+        'tenant': row_tenant,
+        'user_id': user_id,
+        'name': name,
+        'days': days,
+        'punches': punches,
+        'worked_seconds': worked,
+        'worked_hours': round(worked / 3600, 2),
+    } for row_tenant, user_id, name, days, punches, worked in rows]
+
+
+def rebuild(start, end):
+    """
+    Feed punches already in the local store (start..end, YYYY-MM-DD) into the
+    summaries, each under its device's tenant
+    """
+    with attendance_store.transaction() as conn:
+        rows = conn.execute(
+            'SELECT device, user_id, timestamp, punch FROM punches WHERE timestamp >= ? AND timestamp < ? '
+            'ORDER BY timestamp',
+            (start, end + '\uffff')
+        ).fetchall()
+    registry = device_registry.current()
+    tenants, by_tenant = {}, {}
+    for device, user_id, timestamp, punch in rows:
+        tenant = tenants.get(device)
+        if tenant is None:
+            host, _, port = device.rpartition(':')
+            tenant = tenants[device] = registry.tenant_for(host, int(port)).name
+        by_tenant.setdefault(tenant, []).append((user_id, timestamp, punch))
+    return len(rows), sum(record(tenant, punches) for tenant, punches in by_tenant.items())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rebuild', action='store_true', help='summarize punches from the local store')
+    parser.add_argument('--start', required=True, help='YYYY-MM-DD')
+    parser.add_argument('--end', required=True, help='YYYY-MM-DD')
+    args = parser.parse_args()
+    if not args.rebuild:
+        parser.error('nothing to do (use --rebuild)')
+
+    started = time.monotonic()
+    seen, new = rebuild(args.start, args.end)
+    print(f"📊 {seen:,} stored punches read, {new:,} employee-days updated in {time.monotonic() - started:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+# device_leases.py
+"""
+Splits scheduled pulls (pull_scheduler.py) across several processes.
+
+Terminals allow one session at a time, so two schedulers pulling the same device
+just lock each other out. With PULL_SHARDING=True every scheduler registers as a
+member in the local store (attendance_store.py) and pulls only the devices it
+holds a lease on:
+
+- Members heartbeat every PULL_LEASE_SECONDS / 3. A member whose heartbeat is
+  older than PULL_LEASE_SECONDS is considered gone.
+- Each device belongs to one member, picked by consistent hashing (a hash ring
+  with VNODES points per member). When a member joins or leaves, only the
+  devices on its share of the ring change hands.
+- Ownership is only acted on through a lease row (device, owner, expires_at).
+  A lease can be taken when it is free, expired or already ours, so two members
+  that briefly disagree about the ring never pull the same device. A member
+  gives up devices that hashed away from it once their pull in flight finishes.
+  A member that dies stops renewing, and its devices fail over once their
+  leases expire.
+
+All members must share one store file on a local filesystem (SQLite locking is
+not reliable over NFS): gunicorn workers, or several app.py/server processes on
+one host.
+"""
+import os
+import time
+import uuid
+import socket
+import hashlib
+from bisect import bisect
+
+import attendance_store
+import cooperative
+
+VNODES = 64
+
+
+def _hash(value):
+    # Stable across processes (unlike hash()), which every member must agree on
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    def __init__(self, members, vnodes=VNODES):
+        points = sorted((_hash(f"{member}#{i}"), member) for member in members for i in range(vnodes))
+        self.points = [point for point, _ in points]
+        self.members = [member for _, member in points]
+
+    def owner(self, key):
+        if not self.points:
+            return None
+        return self.members[bisect(self.points, _hash(key)) % len(self.points)]
+
+
+class LeaseManager:
+    def __init__(self, lease_seconds=30.0, member=None):
+        self.lease_seconds = lease_seconds
+        self.member = member or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.members = []
+        self.held = {}  # device -> lease expiry (time.time())
+        self.last_heartbeat = 0.0
+
+    def due(self):
+        return time.time() - self.last_heartbeat >= self.lease_seconds / 3
+
+    def heartbeat(self, devices, busy=()):
+        """
+        Renew membership, then take or renew leases on the devices (keys) that hash to
+        this member and release the others. Devices in `busy` (pulls in flight) keep
+        their lease until the next heartbeat after the pull.
+        """
+        now = time.time()
+        members, held = cooperative.offload(self._sync, devices, busy, now)
+        self.members = members
+        self.held = dict(held)  # replaced whole, so owns() never sees a half-updated dict
+        self.last_heartbeat = now
+
+    def _sync(self, devices, busy, now):
+        expires_at = now + self.lease_seconds
+        with attendance_store.transaction() as conn:
+            conn.execute(
+                'INSERT INTO sync_members (member, expires_at, started_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (member) DO UPDATE SET expires_at = excluded.expires_at',
+                (self.member, expires_at, now)
+            )
+            conn.execute('DELETE FROM sync_members WHERE expires_at < ?', (now,))
+            members = [member for (member,) in conn.execute('SELECT member FROM sync_members ORDER BY member')]
+            ring = HashRing(members)
+            wanted = {device for device in devices if ring.owner(device) == self.member}
+            wanted |= set(self.held) & set(busy)
+
+            conn.executemany(
+                'DELETE FROM device_leases WHERE device = ? AND owner = ?',
+                [(device, self.member) for device in self.held if device not in wanted]
+            )
+            conn.executemany(
+                'INSERT INTO device_leases (device, owner, expires_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (device) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at '
+                'WHERE device_leases.owner = excluded.owner OR device_leases.expires_at < ?',
+                [(device, self.member, expires_at, now) for device in wanted]
+            )
+            held = conn.execute(
+                'SELECT device, expires_at FROM device_leases WHERE owner = ? AND expires_at > ?',
+                (self.member, now)
+            ).fetchall()
+        return members, held
+
+    def owns(self, device):
+        """Whether this member holds an unexpired lease on the device"""
+        return self.held.get(device, 0) > time.time()
+
+    def release_all(self):
+        """Leave the ring and free our leases right away (clean shutdown)"""
+        cooperative.offload(self._leave)
+        self.held = {}
+
+    def _leave(self):
+        with attendance_store.transaction() as conn:
+            conn.execute('DELETE FROM device_leases WHERE owner = ?', (self.member,))
+            conn.execute('DELETE FROM sync_members WHERE member = ?', (self.member,))
+
+    def snapshot(self):
+        return {'member': self.member, 'members': len(self.members), 'leased_devices': len(self.held),
+                'lease_seconds': self.lease_seconds}
@@ -0,0 +1,350 @@
+# device_registry.py
+"""
+Device inventory and device -> tenant routing for backend uploads.
+
+DEVICE_REGISTRY_PATH (default devices.json) lists the devices, their tenant and
+how to reach them. Each tenant has its own backend URL, x-tenant header and
+credentials:
+
+    {
+      "tenants": {
+        "acme": {"backend_url": "https://hrms.acme.example", "x_tenant": "acme",
+                 "token_env": "ACME_SERVICE_TOKEN"}
+      },
+      "devices": [
+        {"host": "192.168.1.100", "port": 4370, "serial": "ABC1234567", "site": "HQ",
+         "tenant": "acme", "pull_interval": 300, "password_env": "HQ_COMM_KEY"},
+        {"serial": "XYZ7654321", "tenant": "acme"}
+      ]
+    }
+
+Devices with a host (or "ip") are in the inventory: the dashboard lists them
+and the pull scheduler (pull_scheduler.py) pulls those with a pull_interval.
+Entries with only a serial just route pushed punches. "password" is the
+device's comm key (or read from the variable named by password_env).
+
+Tokens are read from the environment variable named by token_env (or given
+inline as "token"). Devices without a tenant use the built-in "dev" / "prod"
+tenants from DEV_BACKEND_URL / PROD_BACKEND_URL / ADMS_SERVICE_TOKEN with
+x-tenant "default". Without a registry file (or with no devices in it), the
+inventory is DEVICE_IP_1, DEVICE_IP_2, ... from the environment.
+
+The file is re-read when its modification time changes (checked at most every
+DEVICE_REGISTRY_CHECK_SECONDS). A reload builds a new Registry and swaps it in
+whole; requests already running keep the one they started with. A reload that
+fails to parse keeps the previous registry. Each tenant gets its own
+requests.Session (connection pool) and circuit breaker.
+"""
+import os
+import json
+import time
+import threading
+
+from bisect import bisect_left, bisect_right
+
+import requests
+from requests.adapters import HTTPAdapter
+from zk import ZK
+
+import circuit_breaker
+import cooperative
+
+DEFAULT_DEV_URL = 'https://code-huddle-hrms-dev-61ae656862e5.herokuapp.com'
+DEFAULT_PROD_URL = 'http://localhost:3001'
+
+
+class Tenant:
+    def __init__(self, name, backend_url, token='', x_tenant='default', configured=True):
+        self.name = name
+        self.backend_url = backend_url.rstrip('/')
+        self.token = token
+        self.x_tenant = x_tenant
+        # False for a built-in tenant whose *_BACKEND_URL isn't set (only the default URL)
+        self.configured = configured
+
+    @property
+    def upload_url(self):
+        return f"{self.backend_url}/attendance/upload"
+
+    def headers(self, access_token=None):
+        """Upload headers; a logged-in user's access token takes precedence over the tenant token"""
+        headers = {'Content-Type': 'application/json', 'x-tenant': self.x_tenant}
+        token = access_token or self.token
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        return headers
+
+    @property
+    def breaker(self):
+        return circuit_breaker.get_breaker(self.name)
+
+    @property
+    def session(self):
+        return _session_for(self.name)
+
+    def describe(self):
+        """Safe to return from an API: no credentials"""
+        return {'name': self.name, 'backend_url': self.backend_url, 'x_tenant': self.x_tenant,
+                'has_token': bool(self.token), 'configured': self.configured}
+
+
+class Device:
+    def __init__(self, host, port=4370, serial=None, site=None, tenant=None, pull_interval=0, password=0, name=None):
+        self.host = host
+        self.port = int(port)
+        self.serial = serial
+        self.site = site
+        self.tenant = tenant
+        self.pull_interval = int(pull_interval or 0)
+        self.password = int(password or 0)
+        self.name = name
+
+    @property
+    def key(self):
+        """host:port, the id used by the local store, caches and /attendance"""
+        return f"{self.host}:{self.port}"
+
+    @property
+    def sort_key(self):
+        return ((self.site or '').casefold(), self.key)
+
+    def zk(self, timeout=10, **kwargs):
+        return ZK(self.host, port=self.port, timeout=timeout, password=self.password, **kwargs)
+
+    def config(self):
+        return (self.host, self.port, self.serial, self.site, self.tenant, self.pull_interval, self.password, self.name)
+
+    def describe(self):
+        """Safe to return from an API: no comm key"""
+        return {'id': self.key, 'host': self.host, 'port': self.port, 'serial': self.serial,
+                'site': self.site, 'name': self.name, 'tenant': self.tenant,
+                'pull_interval': self.pull_interval, 'has_password': bool(self.password)}
+
+
+def parse_address(value):
+    """'ip' or 'ip:port' -> (ip, port)"""
+    if ':' in value:
+        host, port = value.rsplit(':', 1)
+        return host, int(port)
+    return value, 4370
+
+
+def env_devices():
+    """DEVICE_IP_1, DEVICE_IP_2, ... (until the first one that isn't set)"""
+    devices = {}
+    i = 1
+    while os.getenv(f'DEVICE_IP_{i}'):
+        device = Device(*parse_address(os.getenv(f'DEVICE_IP_{i}')))
+        devices[device.key] = device
+        i += 1
+    return devices
+
+
+def builtin_tenants():
+    service_token = os.getenv('ADMS_SERVICE_TOKEN', '')
+    return {
+        'dev': Tenant('dev', os.getenv('DEV_BACKEND_URL') or DEFAULT_DEV_URL, service_token,
+                      configured=bool(os.getenv('DEV_BACKEND_URL'))),
+        'prod': Tenant('prod', os.getenv('PROD_BACKEND_URL') or DEFAULT_PROD_URL, service_token,
+                       configured=bool(os.getenv('PROD_BACKEND_URL'))),
+    }
+
+
+class Registry:
+    """Immutable snapshot of one registry file; reloads build a new one"""
+
+    def __init__(self, tenants=None, by_serial=None, by_ip=None, devices=None, mtime=None):
+        self.tenants = builtin_tenants()
+        self.tenants.update(tenants or {})
+        self.by_serial = by_serial or {}
+        self.by_ip = by_ip or {}
+        self.devices = devices or env_devices()
+        # Inventory ordered by (site, host:port) for /devices pagination
+        self.ordered = sorted(self.devices.values(), key=lambda d: d.sort_key)
+        self.keys = [d.sort_key for d in self.ordered]
+        self.mtime = mtime
+
+    @classmethod
+    def load(cls, path):
+        mtime = os.path.getmtime(path)
+        with open(path) as f:
+            data = json.load(f)
+
+        tenants = {}
+        for name, cfg in (data.get('tenants') or {}).items():
+            if name in ('dev', 'prod'):
+                raise ValueError(f"Tenant name '{name}' is reserved for the built-in tenants")
+            if not cfg.get('backend_url'):
+                raise ValueError(f"Tenant '{name}' has no backend_url")
+            token = cfg.get('token') or (os.getenv(cfg['token_env'], '') if cfg.get('token_env') else '')
+            tenants[name] = Tenant(name, cfg['backend_url'], token, cfg.get('x_tenant', name))
+
+        by_serial, by_ip, devices = {}, {}, {}
+        known = set(tenants) | {'dev', 'prod'}
+        for entry in data.get('devices') or []:
+            tenant = entry.get('tenant')
+            if tenant is not None and tenant not in known:
+                raise ValueError(f"Device {entry} refers to unknown tenant '{tenant}'")
+            host = entry.get('host') or entry.get('ip')
+            if not (host or entry.get('serial')):
+                raise ValueError(f"Device {entry} has neither host nor serial")
+            if tenant and entry.get('serial'):
+                by_serial[str(entry['serial'])] = tenant
+            if tenant and host:
+                by_ip[str(host)] = tenant
+            if host:
+                password = entry.get('password') or (os.getenv(entry['password_env'], '0')
+                                                     if entry.get('password_env') else 0)
+                device = Device(host, entry.get('port', 4370), entry.get('serial'), entry.get('site'), tenant,
+                                entry.get('pull_interval', 0), password, entry.get('name'))
+                if device.key in devices:
+                    raise ValueError(f"Device {device.key} is listed twice")
+                devices[device.key] = device
+        return cls(tenants, by_serial, by_ip, devices, mtime)
+
+    def resolve(self, serial=None, ip=None, environment=None):
+        """Tenant for a device: by serial, then IP, then the built-in tenant for `environment`"""
+        name = (serial and self.by_serial.get(str(serial))) or (ip and self.by_ip.get(str(ip)))
+        if name:
+            return self.tenants[name]
+        environment = environment or os.getenv('ADMS_DEFAULT_ENV', 'dev')
+        return self.tenants['prod' if environment == 'prod' else 'dev']
+
+    def device(self, host, port=4370):
+        return self.devices.get(f"{host}:{port}")
+
+    def tenant_for(self, host, port=4370, environment=None):
+        """Tenant for a pull device: its own inventory entry first, then resolve() by IP"""
+        device = self.device(host, port)
+        if device and device.tenant:
+            return self.tenants[device.tenant]
+        return self.resolve(serial=device.serial if device else None, ip=host, environment=environment)
+
+    def page(self, cursor=None, limit=100, site=None):
+        """
+        One page of the inventory ordered by (site, host:port), optionally for one site.
+        cursor is the sort key of the last device of the previous page.
+        Returns (devices, next_cursor key or None, total).
+        """
+        start = bisect_right(self.keys, cursor) if cursor else 0
+        if site is None:
+            devices = self.ordered[start:start + limit + 1]
+            total = len(self.ordered)
+        else:
+            site_key = site.casefold()
+            lo = bisect_left(self.keys, (site_key,))
+            hi = bisect_left(self.keys, (site_key, '\U0010ffff'))
+            devices = self.ordered[max(start, lo):hi][:limit + 1]
+            total = hi - lo
+        has_more = len(devices) > limit
+        devices = devices[:limit]
+        return devices, (devices[-1].sort_key if has_more else None), total
+
+
+def registry_path():
+    return os.getenv('DEVICE_REGISTRY_PATH', 'devices.json')
+
+
+_registry = None
+_checked_at = 0.0
+_failed_mtime = None
+_lock = threading.Lock()
+
+
+def current():
+    """The current registry, reloading it first if the file changed"""
+    global _registry, _checked_at, _failed_mtime
+    registry = _registry
+    now = time.monotonic()
+    check_seconds = float(os.getenv('DEVICE_REGISTRY_CHECK_SECONDS', '2'))
+    if registry is not None and now - _checked_at < check_seconds:
+        return registry
+    with _lock:
+        if _registry is not None and now - _checked_at < check_seconds:
+            return _registry
+        _checked_at = now
+        path = registry_path()
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+        if _registry is not None and (mtime == _registry.mtime or (mtime is not None and mtime == _failed_mtime)):
+            return _registry
+        previous = _registry
+        if mtime is None:
+            _registry = Registry()
+        else:
+            try:
+                _registry = Registry.load(path)
+                print(f"🗂️  Device registry loaded: {len(_registry.tenants) - 2} tenants, "
+                      f"{len(_registry.devices)} devices, {len(_registry.by_serial) + len(_registry.by_ip)} device routes")
+            except Exception as e:
+                _failed_mtime = mtime
+                print(f"⚠️  Device registry {path} not loaded (keeping the previous one): {e}")
+                if _registry is None:
+                    _registry = Registry()
+        registry = _registry
+    if previous is not None and registry is not previous:
+        for listener in list(_listeners):
+            try:
+                listener(previous, registry)
+            except Exception as e:
+                print(f"⚠️  Device registry listener failed: {e}")
+    return registry
+
+
+_listeners = []
+
+
+def subscribe(listener):
+    """
+    Call listener(old, new) whenever a reload replaces the registry, so long-lived
+    components (pull scheduler, connection pools) can apply just what changed.
+    """
+    _listeners.append(listener)
+
+
+def changes(old, new):
+    """(added, removed, changed) inventory devices between two registries, by host:port"""
+    added = [new.devices[key] for key in new.devices.keys() - old.devices.keys()]
+    removed = [old.devices[key] for key in old.devices.keys() - new.devices.keys()]
+    changed = [new.devices[key] for key in new.devices.keys() & old.devices.keys()
+               if new.devices[key].config() != old.devices[key].config()]
+    return added, removed, changed
+
+
+def resolve(serial=None, ip=None, environment=None):
+    return current().resolve(serial, ip, environment)
+
+
+def tenant(name):
+    return current().tenants.get(name)
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _session_for(name):
+    """One pooled requests.Session per tenant, so tenants don't share connections"""
+    with _sessions_lock:
+        session = _sessions.get(name)
+        if session is None:
+            pool_size = int(os.getenv('TENANT_POOL_SIZE', cooperative.default_limit(4, 32)))
+            session = requests.Session()
+            session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+            session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+            _sessions[name] = session
+        return session
+
+
+def _close_removed_sessions(old, new):
+    """Drop the connection pools of tenants that are no longer in the registry"""
+    with _sessions_lock:
+        removed = [name for name in _sessions if name not in new.tenants]
+        sessions = [_sessions.pop(name) for name in removed]
+    for session in sessions:
+        session.close()
+
+
+subscribe(_close_removed_sessions)
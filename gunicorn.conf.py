@@ -0,0 +1,17 @@
+# gunicorn.conf.py
+# gunicorn settings for the Procfile. GUNICORN_WORKER_CLASS picks the worker model:
+#
+#   gthread (default)  GUNICORN_THREADS OS threads per worker; a device transfer or
+#                      backend upload holds one thread until it finishes
+#   gevent             greenlets; socket I/O (pyzk, requests) yields, so one worker
+#                      serves up to GUNICORN_WORKER_CONNECTIONS requests at once
+#
+# gevent workers patch the standard library before importing server.py, so the app
+# must not be preloaded (see cooperative.py).
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
+preload_app = False
@@ -0,0 +1,573 @@
+#!/usr/bin/env python3
+# ingest_journal.py
+"""
+Raw ingest journal: every device push (/adms/webhook, /iclock/cdata) kept as it
+was received, so punches that a parser bug mangled or dropped can be recovered
+once the parser is fixed.
+
+Recording is on when INGEST_JOURNAL_DIR is set. After each push server.py hands
+the request to record(): method, path, query string, the headers parsing depends
+on, client IP, raw body and the response status. The request thread only queues
+a small dict. A background thread appends batches to a gzip segment:
+
+    <dir>/ingest-<YYYYmmddTHHMMSS>-<pid>.jsonl.gz
+
+Segments hold one JSON object per line. The first line is a header with the
+process's server start time, which the iClock real-time filter depends on. Each
+process writes its own segments, so gunicorn workers never share a file. Every
+batch is sync-flushed: a crash loses at most the batch in flight, and the segment
+stays readable up to there. A segment is closed after INGEST_JOURNAL_SEGMENT_MB
+of raw data or INGEST_JOURNAL_SEGMENT_MINUTES. Segments older than
+INGEST_JOURNAL_RETENTION_DAYS are deleted.
+
+replay streams segments (oldest first) back through punch_parsing.py, i.e. the
+current parsers, and then the normal pipeline: daily summaries and the tenant
+upload queues (upload_batcher.py). Missing timestamps and the real-time filter
+use the original receipt time, and iClock posts get the clock correction the route
+applied then (clock_skew.py). Pushes that were answered 401/429/503 are skipped,
+because the device resent them or they were never accepted. Punches already in
+the daily summaries (same tenant, user, time and in/out) were ingested before and
+are not uploaded again; --all re-sends them too.
+
+Usage:
+    python ingest_journal.py list
+    python ingest_journal.py replay --dry-run
+    python ingest_journal.py replay --since "2024-05-01 08:00" --until 2024-05-02 --failed
+    python ingest_journal.py replay --device SN:CQZ7224460049 --path /iclock/cdata
+    python ingest_journal.py replay --since 2024-05-01 --all
+"""
+import os
+import sys
+import glob
+import gzip
+import time
+import zlib
+import queue
+import atexit
+import base64
+import socket
+import argparse
+import threading
+from datetime import datetime
+from urllib.parse import parse_qs
+
+from dotenv import load_dotenv
+
+import cooperative
+import serialization
+
+JOURNALED_PATHS = ('/adms/webhook', '/iclock/cdata')
+HEADERS = ('Content-Type', 'Content-Encoding', 'X-Forwarded-For', 'User-Agent')
+SKIPPED_STATUSES = (401, 429, 503)  # rejected, or refused and resent by the device
+COMPRESSION_LEVEL = 6
+
+
+def _settings():
+    global _config
+    if _config is None:
+        _config = (
+            os.getenv('INGEST_JOURNAL_DIR', ''),
+            int(float(os.getenv('INGEST_JOURNAL_SEGMENT_MB', '64')) * 1024 * 1024),
+            float(os.getenv('INGEST_JOURNAL_SEGMENT_MINUTES', '60')) * 60,
+            float(os.getenv('INGEST_JOURNAL_RETENTION_DAYS', '30')),
+        )
+    return _config
+
+
+_config = None
+
+
+def is_enabled():
+    return bool(_settings()[0])
+
+
+# ---------------------------------------------------------------------------
+# Recording
+# ---------------------------------------------------------------------------
+
+class JournalWriter:
+    """Appends journal entries to this process's current segment from a background thread"""
+
+    def __init__(self, directory, segment_bytes, segment_seconds, retention_days, server_start,
+                 max_queue=10000, interval=0.2):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.retention_days = retention_days
+        self.server_start = server_start
+        self.interval = interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.segments = 0
+        self.file = None
+        self.path = None
+        self.opened_at = 0.0
+        self.raw_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        self.thread = threading.Thread(target=self._run, name='ingest-journal', daemon=True)
+        self.thread.start()
+
+    def put(self, entry):
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def _run(self):
+        while True:
+            items = [self.queue.get()]
+            time.sleep(self.interval)  # one compressed write per batch
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(b''.join(serialization.dumps(item) + b'\n' for item in items), len(items))
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+
+    def _open_segment(self):
+        self.close()
+        now = time.time()
+        self.path = os.path.join(self.directory,
+                                 f"ingest-{datetime.fromtimestamp(now):%Y%m%dT%H%M%S}-{os.getpid()}.jsonl.gz")
+        self.file = gzip.open(self.path, 'ab', compresslevel=COMPRESSION_LEVEL)
+        header = {'segment': os.path.basename(self.path), 'host': socket.gethostname(), 'pid': os.getpid(),
+                  'server_start': self.server_start.isoformat(), 'opened_at': now}
+        self.file.write(serialization.dumps(header) + b'\n')
+        self.opened_at = now
+        self.raw_bytes = 0
+        self.segments += 1
+        self._expire_segments()
+
+    def _expire_segments(self):
+        if not self.retention_days:
+            return
+        cutoff = time.time() - self.retention_days * 86400
+        for path in glob.glob(os.path.join(self.directory, 'ingest-*.jsonl.gz')):
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _append(self, data):
+        # Compression and file I/O only (no self.lock), so it can run off the gevent loop
+        if (self.file is None or self.raw_bytes >= self.segment_bytes
+                or time.time() - self.opened_at >= self.segment_seconds):
+            self._open_segment()
+        self.file.write(data)
+        self.file.flush()  # Z_SYNC_FLUSH: everything so far can be decompressed
+        self.raw_bytes += len(data)
+
+    def _write(self, data, count):
+        try:
+            cooperative.offload(self._append, data)
+        except OSError as e:
+            print(f"⚠️  Could not write the ingest journal {self.path}: {e}")
+            with self.lock:
+                self.dropped += count
+            return
+        with self.lock:
+            self.written += count
+
+    def close(self):
+        if self.file is not None:
+            try:
+                self.file.close()  # writes the gzip trailer
+            except OSError:
+                pass
+            self.file = None
+
+    def flush(self, timeout):
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def snapshot(self):
+        with self.lock:
+            return {'written': self.written, 'dropped': self.dropped, 'pending': self.queue.qsize(),
+                    'segments': self.segments, 'segment': self.path}
+
+
+_writer = None
+_lock = threading.Lock()
+
+
+def start(server_start):
+    """Start this process's journal writer (server.py, when INGEST_JOURNAL_DIR is set)"""
+    global _writer
+    directory, segment_bytes, segment_seconds, retention_days = _settings()
+    with _lock:
+        if _writer is None:
+            _writer = JournalWriter(directory, segment_bytes, segment_seconds, retention_days, server_start)
+    print(f"📼 Ingest journal: {directory}")
+    return _writer
+
+
+def record(request, status, received_at):
+    """Queue one push (a Flask request after its response) for the journal"""
+    with _lock:
+        journal_writer = _writer
+    if journal_writer is None:
+        return
+    body = request.get_data()  # cached by the route, so this doesn't read the stream again
+    entry = {'t': received_at, 'm': request.method, 'p': request.path,
+             'q': request.query_string.decode('latin-1'), 'ip': request.remote_addr, 's': status,
+             'h': {name: request.headers[name] for name in HEADERS if name in request.headers}}
+    try:
+        entry['b'] = body.decode('utf-8')
+    except UnicodeDecodeError:
+        entry['b64'] = base64.b64encode(body).decode('ascii')
+    journal_writer.put(entry)
+
+
+def snapshot():
+    if not is_enabled():
+        return {'enabled': False}
+    with _lock:
+        counters = _writer.snapshot() if _writer else {}
+    return {'enabled': True, 'dir': _settings()[0], **counters}
+
+
+@atexit.register
+def _close_at_exit():
+    with _lock:
+        journal_writer = _writer
+    if journal_writer:
+        journal_writer.flush(2)
+        journal_writer.close()
+
+
+# ---------------------------------------------------------------------------
+# Reading and replay
+# ---------------------------------------------------------------------------
+
+def segments(directory):
+    """Segment paths, oldest first (names start with their opening time)"""
+    return sorted(glob.glob(os.path.join(directory, 'ingest-*.jsonl.gz')), key=os.path.basename)
+
+
+def opened_at(path):
+    """Opening time of a segment, from its name (ingest-<YYYYmmddTHHMMSS>-<pid>.jsonl.gz)"""
+    return datetime.strptime(os.path.basename(path).split('-')[1], '%Y%m%dT%H%M%S').timestamp()
+
+
+def read_segment(path):
+    """
+    (header, entries generator, position) for one segment. position() is how far
+    into the compressed file reading has got. A segment cut short (still open, or
+    its process crashed) yields its entries up to the cut.
+    """
+    f = gzip.open(path, 'rb')
+    lines = iter(f)
+
+    def entries():
+        try:
+            for line in lines:
+                if line.endswith(b'\n'):
+                    entry = serialization.loads(line)
+                    if 'segment' not in entry:  # header of a segment reopened within the same second
+                        yield entry
+        except (EOFError, zlib.error):
+            pass
+        finally:
+            f.close()
+
+    try:
+        header = serialization.loads(next(lines))
+    except (StopIteration, EOFError, zlib.error, ValueError):
+        f.close()
+        return None, iter(()), lambda: 0
+    return header, entries(), lambda: f.fileobj.tell() if not f.closed else os.path.getsize(path)
+
+
+def entry_body(entry):
+    return base64.b64decode(entry['b64']) if 'b64' in entry else entry.get('b', '').encode('utf-8')
+
+
+def _serial(entry):
+    return parse_qs(entry.get('q', '')).get('SN', [None])[0]
+
+
+def entry_device(entry):
+    """Same identity as server.get_device_id(): iClock serial, else client IP"""
+    serial = _serial(entry)
+    if serial:
+        return f"SN:{serial}"
+    return _client_ip(entry) or 'unknown'
+
+
+def _client_ip(entry):
+    return entry.get('ip')  # request.remote_addr, i.e. after ProxyFix, like server.get_client_ip()
+
+
+def _quiet(*args, **kwargs):
+    pass
+
+
+class Replayer:
+    """Re-parses journal entries and (unless dry_run) feeds the results into the ingest pipeline"""
+
+    def __init__(self, dry_run=False, summary_batch=1000, resend_known=False):
+        import punch_parsing
+        self.parsing = punch_parsing
+        self.dry_run = dry_run
+        self.summary_batch = summary_batch
+        self.resend_known = resend_known
+        self.pending = {}  # tenant -> (summary punches, names, upload records or None) not recorded yet
+        self.pending_count = 0
+        self.counters = {'entries': 0, 'punches': 0, 'unparsed': 0, 'filtered': 0, 'queued': 0,
+                         'known': 0, 'waits': 0}
+        self.by_device = {}
+        self.corrections = {}  # device -> stored push clock corrections (clock_skew.py)
+
+    def replay(self, entry, server_start):
+        self.counters['entries'] += 1
+        device = entry_device(entry)
+        if entry['p'] == '/iclock/cdata':
+            punches = self._iclock(entry, server_start)
+        else:
+            punches = self._adms(entry)
+        stats = self.by_device.setdefault(device, {'entries': 0, 'punches': 0, 'unparsed': 0})
+        stats['entries'] += 1
+        stats['punches'] += punches
+        if punches == 0 and entry['p'] == '/adms/webhook':
+            stats['unparsed'] += 1
+
+    def _iclock(self, entry, server_start):
+        if entry['m'] != 'POST':
+            return 0
+        raw_data = entry_body(entry).decode('utf-8', errors='replace')
+        if not raw_data.strip():
+            return 0
+        lines = sum(1 for line in raw_data.strip().split('\n') if line.strip())
+        punches = self.parsing.parse_iclock_lines(raw_data, datetime.fromtimestamp(entry['t']), server_start,
+                                                  log=_quiet, clock=self._clock(entry))
+        self.counters['punches'] += len(punches)
+        self.counters['filtered'] += lines - len(punches)
+        if self.dry_run or not punches:
+            return len(punches)
+
+        import device_registry
+        serial = _serial(entry)
+        tenant = device_registry.resolve(serial=serial, ip=_client_ip(entry))
+        self._add(tenant.name,
+                  [(user_id, timestamp.isoformat(), status) for user_id, timestamp, status, _ in punches],
+                  [{'number': user_id, 'dateTime': timestamp.isoformat(),
+                    'status': 'Check In' if status == '0' else 'Check Out', 'name': f"User {user_id}"}
+                   if tenant.configured else None for user_id, timestamp, status, _ in punches])
+        return len(punches)
+
+    def _clock(self, entry):
+        """The clock correction the route applied to this post, from the stored history"""
+        import clock_skew
+        device = entry_device(entry)
+        corrections = self.corrections.get(device)
+        if corrections is None:
+            try:
+                corrections = clock_skew.push_corrections(device)
+            except Exception as e:
+                print(f"⚠️  Could not read the stored clock corrections of {device}: {e}")
+                corrections = []
+            self.corrections[device] = corrections
+        return clock_skew.StoredCorrection(clock_skew.correction_at(corrections, entry['t']))
+
+    def _adms(self, entry):
+        from werkzeug.test import EnvironBuilder
+        builder = EnvironBuilder(method=entry['m'], path=entry['p'], query_string=entry.get('q', ''),
+                                 headers=entry.get('h', {}), data=entry_body(entry))
+        try:
+            request = builder.get_request()
+            data = self.parsing.read_adms_payload(request, log=_quiet)
+            record = self.parsing.parse_adms_record(data, datetime.fromtimestamp(entry['t']), log=_quiet)
+        except Exception:
+            record = None  # the route answered 500 for these too
+        finally:
+            builder.close()
+        if not record:
+            self.counters['unparsed'] += 1
+            return 0
+        self.counters['punches'] += 1
+        if self.dry_run:
+            return 1
+
+        import device_registry
+        environment = data.get('environment', os.getenv('ADMS_DEFAULT_ENV', 'dev'))
+        serial = _serial(entry) or data.get('serial') or data.get('SN')
+        tenant = device_registry.resolve(serial=serial, ip=_client_ip(entry), environment=environment)
+        placeholder = record['name'] == f"User {record['user_id']}"
+        self._add(tenant.name, [(record['user_id'], record['dateTime'], record['status'])],
+                  [{'dateTime': record['dateTime'], 'name': record['name'],
+                    'status': record['status'], 'number': record['number']}],
+                  None if placeholder else {record['user_id']: record['name']})
+        return 1
+
+    def _add(self, tenant_name, punches, uploads, names=None):
+        """Buffer punches (and their upload records, None for no upload) for flush()"""
+        summary_punches, summary_names, upload_records = self.pending.setdefault(tenant_name, ([], {}, []))
+        summary_punches.extend(punches)
+        summary_names.update(names or {})
+        upload_records.extend(uploads)
+        self.pending_count += len(punches)
+        if self.pending_count >= self.summary_batch:
+            self.flush()
+
+    def flush(self):
+        """Record buffered punches in the daily summaries and queue uploads of those that were new"""
+        import daily_summary
+        for tenant_name, (summary_punches, summary_names, upload_records) in self.pending.items():
+            if self.resend_known:
+                daily_summary.record_safely(tenant_name, summary_punches, summary_names or None)
+                new = range(len(summary_punches))
+            else:
+                try:
+                    new = daily_summary.record_new(tenant_name, summary_punches, summary_names or None)
+                except Exception as e:
+                    print(f"⚠️  Could not check {len(summary_punches):,} punches against the daily summaries, "
+                          f"not uploaded: {e}")
+                    continue
+            self.counters['known'] += len(summary_punches) - len(new)
+            uploads = [upload_records[position] for position in new if upload_records[position] is not None]
+            if uploads:
+                self._upload(tenant_name, uploads)
+        self.pending, self.pending_count = {}, 0
+
+    def _upload(self, tenant_name, upload_records):
+        import upload_batcher
+        tenant_batcher = upload_batcher.batcher(tenant_name)
+        chunk = max(1, min(tenant_batcher.batch_size, tenant_batcher.capacity))
+        for i in range(0, len(upload_records), chunk):
+            items = [(record, None, None) for record in upload_records[i:i + chunk]]
+            # Wait for room instead of dropping: replay runs at the speed the backend takes
+            while not tenant_batcher.submit_many(items):
+                self.counters['waits'] += 1
+                time.sleep(0.05)
+            self.counters['queued'] += len(items)
+
+
+def _parse_time(value):
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt).timestamp()
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError(f"expected YYYY-MM-DD[ HH:MM[:SS]], got {value!r}")
+
+
+def selected(entry, args):
+    if entry.get('s') in SKIPPED_STATUSES:
+        return False
+    if args.failed and (entry.get('s') or 0) < 400:
+        return False
+    if args.since and entry['t'] < args.since:
+        return False
+    if args.until and entry['t'] >= args.until:
+        return False
+    if args.path and entry['p'] != args.path:
+        return False
+    if args.device and entry_device(entry) not in args.device:
+        return False
+    return True
+
+
+def run_replay(paths, args, replayer):
+    """Stream the segments through replayer, printing progress; returns (entries read, seconds)"""
+    total_bytes = sum(os.path.getsize(path) for path in paths) or 1
+    done_bytes = 0
+    read = 0
+    started = last_report = time.monotonic()
+    for index, path in enumerate(paths, 1):
+        header, entries, position = read_segment(path)
+        if header is None:
+            print(f"⚠️  {os.path.basename(path)}: unreadable, skipped")
+            done_bytes += os.path.getsize(path)
+            continue
+        server_start = datetime.fromisoformat(header['server_start'])
+        for entry in entries:
+            read += 1
+            if selected(entry, args):
+                replayer.replay(entry, server_start)
+            now = time.monotonic()
+            if now - last_report >= args.progress_seconds:
+                last_report = now
+                fraction = (done_bytes + position()) / total_bytes
+                elapsed = now - started
+                counters = replayer.counters
+                print(f"⏩ segment {index}/{len(paths)}  {fraction:6.1%}  {read:,} read  "
+                      f"{counters['entries']:,} replayed  {counters['punches']:,} punches  "
+                      f"{read / elapsed:,.0f} entries/s  ETA {elapsed / fraction - elapsed if fraction else 0:,.0f}s")
+        done_bytes += os.path.getsize(path)
+    replayer.flush()
+    return read, time.monotonic() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['list', 'replay'])
+    parser.add_argument('--dir', help='journal directory (default: INGEST_JOURNAL_DIR)')
+    parser.add_argument('--since', type=_parse_time, help='only pushes received at or after this time')
+    parser.add_argument('--until', type=_parse_time, help='only pushes received before this time')
+    parser.add_argument('--path', choices=JOURNALED_PATHS, help='only this ingest route')
+    parser.add_argument('--device', action='append', help='SN:<serial> or client IP (repeatable)')
+    parser.add_argument('--failed', action='store_true', help='only pushes the route answered with an error (400/500)')
+    parser.add_argument('--all', action='store_true',
+                        help='also upload punches already in the daily summaries (ingested before)')
+    parser.add_argument('--dry-run', action='store_true', help='parse and count only; nothing is stored or uploaded')
+    parser.add_argument('--progress-seconds', type=float, default=2.0)
+    parser.add_argument('--flush-seconds', type=float, default=600,
+                        help='how long to wait at the end for queued uploads to be sent')
+    args = parser.parse_args()
+    load_dotenv()
+
+    directory = args.dir or os.getenv('INGEST_JOURNAL_DIR', '')
+    if not directory:
+        parser.error('no journal directory (set INGEST_JOURNAL_DIR or pass --dir)')
+    paths = segments(directory)
+    if args.until:
+        paths = [path for path in paths if opened_at(path) < args.until]
+    if args.since:
+        paths = [path for path in paths if os.path.getmtime(path) >= args.since]
+    if not paths:
+        print(f"No journal segments in {directory}{' for that time range' if args.since or args.until else ''}")
+        return 0
+
+    if args.command == 'list':
+        for path in paths:
+            header, _, _ = read_segment(path)
+            opened = datetime.fromtimestamp(header['opened_at']) if header else None
+            print(f"{os.path.basename(path):<44} {os.path.getsize(path) / 1024 / 1024:8.1f} MB  "
+                  f"{f'opened {opened:%Y-%m-%d %H:%M:%S}' if opened else 'unreadable'}  "
+                  f"last write {datetime.fromtimestamp(os.path.getmtime(path)):%Y-%m-%d %H:%M:%S}")
+        return 0
+
+    print(f"📼 Replaying {len(paths)} segments ({sum(os.path.getsize(p) for p in paths) / 1024 / 1024:.1f} MB)"
+          f"{' (dry run)' if args.dry_run else ''}")
+    replayer = Replayer(dry_run=args.dry_run, resend_known=args.all)
+    read, elapsed = run_replay(paths, args, replayer)
+    counters = replayer.counters
+    print(f"\n{'device':<28} {'entries':>9} {'punches':>9} {'unparsed':>9}")
+    for device, stats in sorted(replayer.by_device.items()):
+        print(f"{device:<28} {stats['entries']:>9,} {stats['punches']:>9,} {stats['unparsed']:>9,}")
+    print(f"\n📊 {read:,} entries read, {counters['entries']:,} replayed in {elapsed:.1f}s "
+          f"({read / elapsed if elapsed else 0:,.0f} entries/s): {counters['punches']:,} punches, "
+          f"{counters['unparsed']:,} webhook bodies still unparsed, {counters['filtered']:,} iClock lines "
+          f"outside the real-time window")
+    if not args.dry_run:
+        import upload_batcher
+        skipped = '' if args.all else f", {counters['known']:,} already ingested and skipped (--all sends them too)"
+        print(f"📤 {counters['queued']:,} punches queued for upload{skipped}; waiting for the queues to drain...")
+        upload_batcher.flush(args.flush_seconds)
+        for name, queue_stats in upload_batcher.snapshot().items():
+            print(f"   {name}: {queue_stats['uploaded']:,} uploaded, {queue_stats['failed']:,} failed, "
+                  f"{queue_stats['pending']:,} still queued")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,175 @@
+# live_feed.py
+"""
+Live punch feed for the dashboard (Server-Sent Events).
+
+Punches received on /adms/webhook and /iclock/cdata are published into one
+fixed-size ring buffer (LIVE_FEED_BUFFER events). Each event gets an increasing
+id. A connected dashboard only remembers the last id it has sent; it waits on a
+shared condition and reads whatever is newer straight from the buffer. Nothing
+is queued per client, so memory stays the same however many dashboards are open.
+
+Browsers reconnect with Last-Event-ID and resume from the buffer. A client that
+has fallen further behind than the buffer holds gets a 'reset' event first.
+
+The buffer lives in the worker process: with several gunicorn workers, a
+dashboard sees the punches received by the worker that serves its stream.
+"""
+import os
+import json
+import time
+import threading
+from collections import deque
+
+import cooperative
+
+
+class PunchFeed:
+    def __init__(self, capacity=1000):
+        self.events = deque(maxlen=capacity)  # (id, event type or None, serialized data)
+        self.last_id = 0
+        self.condition = threading.Condition()
+        self.clients = 0
+        self.published = 0
+
+    def publish(self, punch, event=None):
+        data = json.dumps(punch, separators=(',', ':'))
+        with self.condition:
+            self.last_id += 1
+            self.events.append((self.last_id, event, data))
+            self.published += 1
+            self.condition.notify_all()
+            return self.last_id
+
+    def events_after(self, last_seen):
+        """
+        (events newer than last_seen, gap, position). gap is True when events after
+        last_seen were already overwritten, or the id is from before a server
+        restart. position is the id to continue from afterwards.
+        """
+        with self.condition:
+            return self._events_after(last_seen)
+
+    def _events_after(self, last_seen):
+        if last_seen > self.last_id:
+            return list(self.events), True, self.last_id  # id from a previous server process
+        if not self.events or last_seen == self.last_id:
+            return [], False, self.last_id
+        oldest = self.events[0][0]
+        if last_seen < oldest - 1:
+            return list(self.events), last_seen > 0, self.last_id
+        return list(self.events)[last_seen - oldest + 1:], False, self.last_id
+
+    def wait(self, last_seen, timeout):
+        """Block until something newer than last_seen is published (or timeout)"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.last_id != last_seen, timeout)
+            return self._events_after(last_seen)
+
+    def snapshot(self):
+        with self.condition:
+            return {
+                'clients': self.clients,
+                'buffered': len(self.events),
+                'capacity': self.events.maxlen,
+                'last_id': self.last_id,
+                'published': self.published,
+            }
+
+
+feed = PunchFeed(int(os.getenv('LIVE_FEED_BUFFER', '1000')))
+
+# Worker threads always left for /attendance, /connect and the UI
+INTERACTIVE_THREADS = 2
+
+
+def default_max_clients():
+    """
+    A stream holds an OS thread with gthread workers, only a greenlet with gevent.
+    With threads, streams get what is left of GUNICORN_THREADS after the ingest
+    slots (INGEST_MAX_CONCURRENCY, all threads when uncapped) and INTERACTIVE_THREADS.
+    """
+    if cooperative.is_cooperative():
+        return '500'
+    threads = int(os.getenv('GUNICORN_THREADS', '8'))
+    ingest_slots = int(os.getenv('INGEST_MAX_CONCURRENCY', '4')) or threads
+    return str(max(threads - ingest_slots - INTERACTIVE_THREADS, 0))
+
+
+MAX_CLIENTS = int(os.getenv('LIVE_FEED_MAX_CLIENTS', default_max_clients()))
+HEARTBEAT_SECONDS = 15
+# Streams end after this long and the browser reconnects with Last-Event-ID,
+# so a worker thread is never held by one dashboard indefinitely
+MAX_STREAM_SECONDS = int(os.getenv('LIVE_FEED_MAX_SECONDS', '300'))
+
+_clients_lock = threading.Lock()
+
+
+def publish(source, device, user_id, timestamp, status, uploaded=None, name=None):
+    """
+    Add a received punch to the live feed as soon as it is parsed, before it is
+    uploaded; returns its event id for upload_failed(). Never raises into the
+    ingest path.
+    """
+    try:
+        return feed.publish({
+            'source': source,
+            'device': device,
+            'user_id': str(user_id),
+            'name': name,
+            'dateTime': timestamp,
+            'status': status,
+            'uploaded': uploaded,
+            'received_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        })
+    except Exception as e:
+        print(f"⚠️  Live feed publish failed: {e}")
+        return None
+
+
+def upload_failed(punch_id, error=None):
+    """Mark a published punch whose upload failed (an 'upload' event naming its id)"""
+    if punch_id is None:
+        return
+    try:
+        feed.publish({'punch': punch_id, 'uploaded': False, 'error': error}, event='upload')
+    except Exception as e:
+        print(f"⚠️  Live feed publish failed: {e}")
+
+
+def try_join():
+    """Reserve a stream slot; False when LIVE_FEED_MAX_CLIENTS streams are already open"""
+    with _clients_lock:
+        if feed.clients >= MAX_CLIENTS:
+            return False
+        feed.clients += 1
+        return True
+
+
+def leave():
+    with _clients_lock:
+        feed.clients -= 1
+
+
+def stream(last_seen):
+    """
+    SSE body generator for one client, starting after event id last_seen.
+    The route releases the client slot (leave) when the response is closed.
+    """
+    yield "retry: 3000\n\n"
+    events, gap, position = feed.events_after(last_seen)
+    deadline = time.monotonic() + MAX_STREAM_SECONDS
+    while True:
+        if gap:
+            yield "event: reset\ndata: {}\n\n"
+        for event_id, event, data in events:
+            if event:
+                yield f"id: {event_id}\nevent: {event}\ndata: {data}\n\n"
+            else:
+                yield f"id: {event_id}\ndata: {data}\n\n"
+        last_seen = position
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        events, gap, position = feed.wait(last_seen, min(HEARTBEAT_SECONDS, remaining))
+        if not events and not gap:
+            yield ": keep-alive\n\n"
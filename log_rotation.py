@@ -0,0 +1,119 @@
+# log_rotation.py
+"""
+Opt-in device log rotation (DEVICE_LOG_ROTATION=True).
+
+Terminals never clear their attendance log on their own, so every
+get_attendance() transfer grows with the device's lifetime. Rotation clears the
+log once everything on it is safely stored locally and acknowledged by the
+backend, so pulls only carry what arrived since the last rotation.
+
+1. Device enabled: pull the log, store it, upload anything not yet acknowledged.
+2. Device disabled (no new punches can arrive):
+   - re-read the log and check the count against the device's record counter
+   - upload any punches that arrived during step 1
+   - check the device records against the acknowledged rows in the local store
+     (same count, same checksum)
+   - clear the log and check the device now reports zero records
+3. Re-enable the device and record the rotation (stamp, count, checksum).
+
+A failed check before the clear aborts the rotation and leaves the log untouched.
+"""
+import os
+
+from zk import ZK
+
+import attendance_store
+import cooperative
+
+
+class RotationAborted(Exception):
+    """A safety check failed during rotation"""
+
+
+def is_enabled():
+    return os.getenv('DEVICE_LOG_ROTATION', 'False').lower() == 'true'
+
+
+def to_records(attendance):
+    """pyzk Attendance objects -> store records"""
+    return [(str(a.user_id), a.timestamp.isoformat(), int(a.status), int(a.punch)) for a in attendance]
+
+
+def _read_log(conn):
+    """Read the device log and check it against the device's own record counter"""
+    conn.read_sizes()
+    expected = conn.records
+    records = to_records(conn.get_attendance())
+    if len(records) != expected:
+        raise RotationAborted(f"Device reports {expected} records but {len(records)} were read")
+    return records
+
+
+def rotate_device_log(host, port, upload, timeout=10, password=0):
+    """
+    Rotate one device's attendance log.
+
+    upload(records, user_map) must send records to the backend and raise if the
+    backend does not acknowledge them.
+    Returns a report dict; raises RotationAborted if the log was not cleared.
+    """
+    device = f"{host}:{port}"
+    zk = ZK(host, port=port, timeout=timeout, password=password)
+    conn = zk.connect()
+    try:
+        user_map = {str(user.user_id): user.name for user in conn.get_users()}
+
+        # Phase 1: device stays enabled while the bulk of the log is stored and uploaded
+        records = _read_log(conn)
+        cooperative.offload(attendance_store.save_punches, device, records)
+        _, pending = cooperative.offload(attendance_store.acked_records, device, records)
+        if pending:
+            upload(pending, user_map)
+            cooperative.offload(attendance_store.mark_acked, device, pending)
+        uploaded = len(pending)
+
+        # Phase 2: short disabled window for the final verification and clear
+        conn.disable_device()
+        try:
+            records = _read_log(conn)
+            cooperative.offload(attendance_store.save_punches, device, records)
+            _, pending = cooperative.offload(attendance_store.acked_records, device, records)
+            if pending:
+                upload(pending, user_map)
+                cooperative.offload(attendance_store.mark_acked, device, pending)
+                uploaded += len(pending)
+
+            acked, pending = cooperative.offload(attendance_store.acked_records, device, records)
+            if pending:
+                raise RotationAborted(f"{len(pending)} records are not acknowledged by the backend")
+            device_checksum = attendance_store.checksum(records)
+            store_checksum = attendance_store.checksum(acked)
+            if len(acked) != len(records) or device_checksum != store_checksum:
+                raise RotationAborted("Local store does not match the device log (checksum mismatch)")
+
+            if not records:
+                return {'device': device, 'cleared': 0, 'uploaded': uploaded, 'message': 'Device log already empty'}
+
+            cleared_through = max(r[1] for r in records)
+            conn.clear_attendance()
+            conn.read_sizes()
+            if conn.records != 0:
+                raise RotationAborted(f"Device still reports {conn.records} records after clearing")
+            cooperative.offload(attendance_store.record_rotation, device, cleared_through, len(records),
+                                device_checksum)
+        finally:
+            conn.enable_device()
+    finally:
+        try:
+            conn.disconnect()
+        except Exception:
+            pass
+
+    print(f"🧹 Rotated {device}: cleared {len(records)} records through {cleared_through} (uploaded {uploaded})")
+    return {
+        'device': device,
+        'cleared': len(records),
+        'cleared_through': cleared_through,
+        'checksum': device_checksum,
+        'uploaded': uploaded,
+    }
@@ -0,0 +1,180 @@
+# profiler.py
+"""
+On-demand profiling for the live server process.
+
+Nothing in this module runs until a profile is started, so request handling
+is untouched while profiling is off. Two modes are supported:
+
+- 'sample':  a background thread snapshots every other thread's stack at a
+             fixed interval and writes collapsed stacks ("a;b;c 42" lines)
+             that flamegraph.pl / speedscope can render directly.
+- 'cprofile': app.wsgi_app is temporarily wrapped so every request handled by
+             this worker during the window runs under cProfile. The wrapper is
+             removed when the window ends and the merged stats are written as a
+             .pstats file (load with pstats / snakeviz).
+
+Results are written to PROFILE_DIR so any gunicorn worker can serve them.
+"""
+import os
+import sys
+import time
+import uuid
+import threading
+import tempfile
+
+import cooperative
+
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'zk-sync-profiles'))
+MAX_PROFILE_SECONDS = 300
+MODES = ('sample', 'cprofile')
+
+_lock = threading.Lock()
+_active = None  # Only one profile per worker at a time
+
+
+def _result_path(profile_id, mode):
+    ext = 'folded' if mode == 'sample' else 'pstats'
+    return os.path.join(PROFILE_DIR, f"{profile_id}.{ext}")
+
+
+def _write_atomic(path, write):
+    """Write via a temp file + rename so readers never see partial output"""
+    tmp_path = f"{path}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _run_sampler(profile_id, seconds, interval):
+    """Sample all other threads' stacks until the window closes"""
+    global _active
+    own_ident = threading.get_ident()
+    counts = {}
+    samples = 0
+    deadline = time.monotonic() + seconds
+    try:
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                key = ';'.join(reversed(stack))
+                counts[key] = counts.get(key, 0) + 1
+            samples += 1
+            time.sleep(interval)
+
+        def write(path):
+            with open(path, 'w') as f:
+                f.write(f"# pid={os.getpid()} samples={samples} interval={interval}\n")
+                for stack, count in sorted(counts.items(), key=lambda item: -item[1]):
+                    f.write(f"{stack} {count}\n")
+
+        _write_atomic(_result_path(profile_id, 'sample'), write)
+    finally:
+        with _lock:
+            _active = None
+
+
+def _run_cprofile(app, profile_id, seconds):
+    """Wrap app.wsgi_app with cProfile for the duration of the window"""
+    global _active
+    import cProfile
+    import pstats
+
+    original_wsgi_app = app.wsgi_app
+    profiles = []
+    profiles_lock = threading.Lock()
+
+    def profiled_wsgi_app(environ, start_response):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return original_wsgi_app(environ, start_response)
+        finally:
+            profile.disable()
+            with profiles_lock:
+                profiles.append(profile)
+
+    app.wsgi_app = profiled_wsgi_app
+    try:
+        time.sleep(seconds)
+    finally:
+        app.wsgi_app = original_wsgi_app
+
+        with profiles_lock:
+            collected = list(profiles)
+
+        def write(path):
+            if collected:
+                stats = pstats.Stats(collected[0])
+                for profile in collected[1:]:
+                    stats.add(profile)
+            else:
+                # No requests hit this worker during the window; dump an empty profile
+                empty = cProfile.Profile()
+                empty.enable()
+                empty.disable()
+                stats = pstats.Stats(empty)
+            stats.dump_stats(path)
+
+        try:
+            _write_atomic(_result_path(profile_id, 'cprofile'), write)
+        finally:
+            with _lock:
+                _active = None
+
+
+def start_profile(app, mode='sample', seconds=10, interval_ms=10):
+    """
+    Start a profile in the background and return its description.
+    Raises ValueError for bad arguments and RuntimeError if one is already running.
+    """
+    global _active
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {', '.join(MODES)}")
+    if mode == 'sample' and cooperative.is_cooperative():
+        # Greenlets share one OS thread; sys._current_frames() can't see them
+        raise ValueError("sample mode needs thread workers; use mode=cprofile with gevent workers")
+    seconds = float(seconds)
+    if not 0 < seconds <= MAX_PROFILE_SECONDS:
+        raise ValueError(f"seconds must be between 0 and {MAX_PROFILE_SECONDS}")
+    interval = max(float(interval_ms), 1.0) / 1000.0
+
+    with _lock:
+        if _active is not None:
+            raise RuntimeError(f"Profile {_active['profile_id']} is already running in this worker")
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profile_id = uuid.uuid4().hex[:12]
+        _active = {
+            'profile_id': profile_id,
+            'pid': os.getpid(),
+            'mode': mode,
+            'seconds': seconds,
+            'started_at': time.time(),
+        }
+        info = dict(_active)
+
+    if mode == 'sample':
+        target, args = _run_sampler, (profile_id, seconds, interval)
+    else:
+        target, args = _run_cprofile, (app, profile_id, seconds)
+    threading.Thread(target=target, args=args, daemon=True, name=f"profiler-{profile_id}").start()
+    return info
+
+
+def get_profile_result(profile_id):
+    """Return (path, mode) for a finished profile, or (None, None) if not available yet"""
+    if not profile_id.isalnum():
+        return None, None
+    for mode in MODES:
+        path = _result_path(profile_id, mode)
+        if os.path.exists(path):
+            return path, mode
+    return None, None
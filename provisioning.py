@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# provisioning.py
+"""
+Bulk user provisioning: roll a desired roster out to many terminals.
+
+Each device's directory is read once per run (one buffered transfer) and diffed
+against the roster. Only the difference is written: set_user for new or changed
+users, delete_user for users who are no longer on the roster (with --prune).
+Devices are provisioned in parallel, --concurrency at a time, one session each.
+
+A terminal is disabled (keypad and sensor locked) while it is written to, so
+writes go in windows of --window users: disable, write the window, refresh the
+device's data once, enable, and leave it enabled for --pause seconds so staff can
+punch before the next window. (pyzk's set_user/delete_user refresh after every
+single write; here that happens once per window.)
+
+Roster: CSV with a header row, or a JSON list of objects, with user_id (required)
+and any of name, privilege (user / admin, or 0 / 14), card, group_id, password.
+A column that is left out is not managed: devices keep their own value.
+
+Usage:
+    python provisioning.py roster.csv --dry-run
+    python provisioning.py roster.csv --site HQ --concurrency 16
+    python provisioning.py roster.json --device 192.168.1.201 --prune --report result.json
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+from zk import const
+from zk.base import ZK
+from zk.exception import ZKErrorResponse
+
+import device_registry
+
+load_dotenv()
+
+# Field sizes in the device's 72-byte user record
+NAME_BYTES = 24
+PASSWORD_BYTES = 8
+MAX_UID = 0xFFFF
+FIELDS = ('name', 'privilege', 'password', 'group_id', 'card')
+PRIVILEGES = {'user': const.USER_DEFAULT, 'admin': const.USER_ADMIN}
+
+
+class RosterError(ValueError):
+    """Invalid roster file or entry"""
+
+
+def _fit(text, size):
+    """What the device keeps of a string field (truncated to its byte size)"""
+    return text.encode('utf-8')[:size].decode('utf-8', errors='ignore')
+
+
+def normalize(entry):
+    """
+    Roster entry -> (user_id, {field: value as the device will store it}).
+    Fields missing from the entry are None (not managed).
+    """
+    user_id = str(entry.get('user_id') or '').strip()
+    if not user_id:
+        raise RosterError(f"entry without user_id: {entry}")
+    fields = dict.fromkeys(FIELDS)
+    if 'name' in entry:
+        fields['name'] = _fit(str(entry['name'] or ''), NAME_BYTES)
+    if 'password' in entry:
+        fields['password'] = _fit(str(entry['password'] or ''), PASSWORD_BYTES)
+    if 'group_id' in entry:
+        fields['group_id'] = str(entry['group_id'] or '')
+    if 'card' in entry:
+        try:
+            fields['card'] = int(entry['card'] or 0)
+        except ValueError:
+            raise RosterError(f"user {user_id}: card must be a number")
+    if 'privilege' in entry:
+        privilege = str(entry['privilege'] if entry['privilege'] is not None else '').strip().lower()
+        privilege = PRIVILEGES.get(privilege, privilege or const.USER_DEFAULT)
+        try:
+            privilege = int(privilege)
+        except ValueError:
+            privilege = None
+        if privilege not in (const.USER_DEFAULT, const.USER_ADMIN):
+            raise RosterError(f"user {user_id}: privilege must be user/admin (0/14)")
+        fields['privilege'] = privilege
+    return user_id, fields
+
+
+def load_roster(path):
+    """{user_id: fields} from a CSV or JSON roster file"""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if path.lower().endswith('.json'):
+            entries = json.load(f)
+            if not isinstance(entries, list):
+                raise RosterError('JSON roster must be a list of users')
+        else:
+            entries = list(csv.DictReader(f))
+    roster = {}
+    for entry in entries:
+        user_id, fields = normalize(entry)
+        if user_id in roster:
+            raise RosterError(f"user {user_id} is listed twice")
+        roster[user_id] = fields
+    return roster
+
+
+def plan(roster, users, prune=False):
+    """
+    Changes that bring one device's directory (pyzk User objects) to the roster.
+    Returns {'set': [(uid, fields)], 'delete': [User], 'unchanged': n, 'kept_admins': n}.
+    Admins missing from the roster are kept even with prune, so a device can't be
+    locked out of its own menu.
+    """
+    current = {str(user.user_id): user for user in users}
+    used = {user.uid for user in users}
+    free_uids = (uid for uid in range(1, MAX_UID + 1) if uid not in used)
+
+    writes, unchanged = [], 0
+    for user_id, wanted in roster.items():
+        user = current.get(user_id)
+        if user is None:
+            uid = next(free_uids, None)
+            if uid is None:
+                raise RosterError('device has no free user slots')
+            fields = {'name': '', 'privilege': const.USER_DEFAULT, 'password': '', 'group_id': '', 'card': 0}
+        else:
+            uid = user.uid
+            fields = {field: getattr(user, field) for field in FIELDS}
+        changed = {field: value for field, value in wanted.items() if value is not None and value != fields[field]}
+        if user is not None and not changed:
+            unchanged += 1
+            continue
+        fields.update(changed)
+        fields['user_id'] = user_id
+        writes.append((uid, fields))
+
+    missing = [user for user_id, user in current.items() if user_id not in roster]
+    deletes = [user for user in missing if user.privilege != const.USER_ADMIN] if prune else []
+    kept_admins = len(missing) - len(deletes) if prune else 0
+    return {'set': writes, 'delete': deletes, 'unchanged': unchanged, 'kept_admins': kept_admins}
+
+
+def apply(conn, changes, window=200, pause=0.5):
+    """
+    Write the changes to a connected device, `window` writes per disabled stretch.
+    Returns (writes that failed, seconds disabled in total, longest disabled stretch).
+    """
+    writes = [(f"set uid {uid}", lambda uid=uid, fields=fields: conn.set_user(uid=uid, **fields))
+              for uid, fields in changes['set']]
+    writes += [(f"delete uid {user.uid}", lambda uid=user.uid: conn.delete_user(uid=uid))
+               for user in changes['delete']]
+    return write_in_windows(conn, writes, window, pause)
+
+
+def write_in_windows(conn, writes, window=200, pause=0.5):
+    """
+    Run (label, write) callables on a connected device, `window` per disabled stretch,
+    with one data refresh per window. Also used by template_backup.py.
+    Returns (writes that failed, seconds disabled in total, longest disabled stretch).
+    """
+    failed, disabled_total, disabled_max = 0, 0.0, 0.0
+    # pyzk's write calls end with a refresh round trip each; do it once per window instead
+    conn.refresh_data = lambda: None
+    try:
+        for start in range(0, len(writes), window):
+            if start:
+                time.sleep(pause)
+            conn.disable_device()
+            disabled_at = time.monotonic()
+            try:
+                for label, write in writes[start:start + window]:
+                    try:
+                        write()
+                    except ZKErrorResponse as e:
+                        failed += 1
+                        print(f"   ⚠️  {label} failed: {e}")
+            finally:
+                ZK.refresh_data(conn)
+                conn.enable_device()
+                disabled = time.monotonic() - disabled_at
+                disabled_total += disabled
+                disabled_max = max(disabled_max, disabled)
+    finally:
+        del conn.refresh_data
+    return failed, disabled_total, disabled_max
+
+
+def connect(device, timeout, ommit_ping, retries):
+    """Open a session, retrying while another client (e.g. a scheduled pull) holds the device"""
+    for attempt in range(1, retries + 1):
+        try:
+            return device.zk(timeout=timeout, ommit_ping=ommit_ping).connect()
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(2 * attempt)
+
+
+def provision_device(device, roster, args):
+    """Read, diff and (unless dry_run) apply the roster to one device; returns its result row"""
+    result = {'device': device.key, 'site': device.site, 'added': 0, 'updated': 0, 'deleted': 0,
+              'unchanged': 0, 'kept_admins': 0, 'failed': 0, 'read_seconds': 0.0, 'apply_seconds': 0.0,
+              'disabled_seconds': 0.0, 'longest_disabled_seconds': 0.0, 'error': None}
+    started = time.monotonic()
+    conn = None
+    try:
+        conn = connect(device, args.device_timeout, args.ommit_ping, args.retries)
+        users = conn.get_users()
+        existing = {str(user.user_id) for user in users}
+        changes = plan(roster, users, args.prune)
+        result['read_seconds'] = round(time.monotonic() - started, 2)
+        result['added'] = sum(1 for _, fields in changes['set'] if fields['user_id'] not in existing)
+        result['updated'] = len(changes['set']) - result['added']
+        result['deleted'] = len(changes['delete'])
+        result['unchanged'] = changes['unchanged']
+        result['kept_admins'] = changes['kept_admins']
+        if not args.dry_run and (changes['set'] or changes['delete']):
+            apply_started = time.monotonic()
+            failed, disabled_total, disabled_max = apply(conn, changes, args.window, args.pause)
+            result['apply_seconds'] = round(time.monotonic() - apply_started, 2)
+            result['failed'] = failed
+            result['disabled_seconds'] = round(disabled_total, 2)
+            result['longest_disabled_seconds'] = round(disabled_max, 2)
+    except Exception as e:
+        result['error'] = str(e) or type(e).__name__
+    finally:
+        if conn:
+            try:
+                conn.disconnect()
+            except Exception:
+                pass
+    result['total_seconds'] = round(time.monotonic() - started, 2)
+    return result
+
+
+def print_result(result, dry_run):
+    if result['error']:
+        print(f"❌ {result['device']}: {result['error']}")
+        return
+    notes = [f"{result['unchanged']} unchanged"]
+    if result['kept_admins']:
+        notes.append(f"{result['kept_admins']} admins kept")
+    if result['failed']:
+        notes.append(f"{result['failed']} writes failed")
+    print(f"{'🔎' if dry_run else '✅'} {result['device']}: {'would apply' if dry_run else 'applied'} "
+          f"+{result['added']} ~{result['updated']} -{result['deleted']} ({', '.join(notes)})  "
+          f"read {result['read_seconds']:.1f}s  apply {result['apply_seconds']:.1f}s  "
+          f"disabled {result['disabled_seconds']:.1f}s (longest {result['longest_disabled_seconds']:.1f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('roster', help='CSV or JSON roster')
+    parser.add_argument('--device', action='append', help='ip or ip:port (repeatable, default: every device in the inventory)')
+    parser.add_argument('--site', help='only inventory devices at this site')
+    parser.add_argument('--prune', action='store_true', help='delete users who are not on the roster (admins are kept)')
+    parser.add_argument('--dry-run', action='store_true', help='read and diff only, write nothing')
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv('PROVISION_CONCURRENCY', '8')))
+    parser.add_argument('--window', type=int, default=int(os.getenv('PROVISION_WINDOW', '200')),
+                        help='writes per stretch the device is disabled for')
+    parser.add_argument('--pause', type=float, default=float(os.getenv('PROVISION_PAUSE', '0.5')),
+                        help='seconds a device stays enabled between windows')
+    parser.add_argument('--retries', type=int, default=3, help='connection attempts per device')
+    parser.add_argument('--device-timeout', type=int, default=60)
+    parser.add_argument('--ommit-ping', action='store_true', help='skip the ping check before connecting')
+    parser.add_argument('--report', help='write per-device results to this JSON file')
+    args = parser.parse_args()
+    if args.window < 1:
+        parser.error('--window must be at least 1')
+
+    try:
+        roster = load_roster(args.roster)
+    except (OSError, ValueError) as e:
+        parser.error(f"roster: {e}")
+
+    # Inventory devices carry their comm key; others are used as given
+    registry = device_registry.current()
+    if args.device:
+        devices = [registry.device(*address) or device_registry.Device(*address)
+                   for address in map(device_registry.parse_address, args.device)]
+    else:
+        devices = registry.ordered
+    if args.site:
+        devices = [device for device in devices if (device.site or '').casefold() == args.site.casefold()]
+    if not devices:
+        parser.error('no devices selected (inventory empty or nothing matches --site)')
+
+    print(f"👥 Roster: {len(roster):,} users -> {len(devices)} devices, {args.concurrency} at a time"
+          f"{' (dry run)' if args.dry_run else ''}")
+    started = time.monotonic()
+    results = []
+    lock = threading.Lock()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [pool.submit(provision_device, device, roster, args) for device in devices]
+        for future in as_completed(futures):
+            result = future.result()
+            with lock:
+                results.append(result)
+                print_result(result, args.dry_run)
+
+    failed = [r for r in results if r['error']]
+    writes = sum(r['added'] + r['updated'] + r['deleted'] for r in results)
+    elapsed = time.monotonic() - started
+    longest = max((r['longest_disabled_seconds'] for r in results), default=0.0)
+    print(f"\n📊 {len(results) - len(failed)}/{len(results)} devices, {writes:,} user writes "
+          f"{'planned' if args.dry_run else 'applied'} in {elapsed:.1f}s; longest disabled stretch {longest:.1f}s")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(sorted(results, key=lambda r: r['device']), f, indent=2)
+    return 1 if failed or any(r['failed'] for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
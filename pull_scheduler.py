@@ -0,0 +1,294 @@
+# pull_scheduler.py
+"""
+Background attendance pulls for inventory devices (device_registry.py).
+
+Every device with a pull_interval is pulled that often: its attendance log is
+read, records from the last PULL_LOOKBACK_DAYS are saved to the local store
+(attendance_store.py), and whatever the backend hasn't acknowledged yet is
+uploaded to the device's tenant and marked as acked. Older history is left to
+backfill.py. Each pull also reads the device clock (clock_skew.py): the skew
+is reported per device, and with CLOCK_SKEW_CORRECTION=True it is taken out of
+the summarized and uploaded punch times.
+
+Pulls run on a fixed pool of PULL_CONCURRENCY threads. When the inventory file
+changes, only the devices that were added, removed or edited are touched:
+other devices keep their place in the schedule and pulls in flight finish.
+
+Opt-in with PULL_SCHEDULER=True. Without sharding each process that enables
+it pulls every device, so enable it in one process only (one gunicorn worker, or
+app.py). With PULL_SHARDING=True as well, every process can run it: devices are
+split between them through leases in the local store (device_leases.py).
+"""
+import os
+import time
+import atexit
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import attendance_store
+import circuit_breaker
+import clock_skew
+import cooperative
+import daily_summary
+import device_leases
+import device_registry
+import serialization
+import tracing
+from record_batch import RecordBatch
+
+UPLOAD_CHUNK = 1000
+
+
+def is_enabled():
+    return os.getenv('PULL_SCHEDULER', 'False').lower() == 'true'
+
+
+class DeviceSchedule:
+    def __init__(self, device, next_due):
+        self.device = device
+        self.next_due = next_due  # time.monotonic()
+        self.running = False
+        self.pulls = 0
+        self.failures = 0
+        self.last_pull = None  # wall clock, for display
+        self.last_records = None
+        self.last_uploaded = None
+        self.last_error = None
+
+    def describe(self):
+        return {
+            'interval': self.device.pull_interval,
+            'next_pull_in': round(max(0.0, self.next_due - time.monotonic()), 1),
+            'running': self.running,
+            'pulls': self.pulls,
+            'failures': self.failures,
+            'last_pull': self.last_pull,
+            'last_records': self.last_records,
+            'last_uploaded': self.last_uploaded,
+            'last_error': self.last_error,
+        }
+
+
+class PullScheduler:
+    def __init__(self, concurrency=4, lookback_days=2, timeout=30, leases=None):
+        self.lookback_days = lookback_days
+        self.timeout = timeout
+        self.leases = leases  # device_leases.LeaseManager when sharded, else every device is ours
+        self.lock = threading.Lock()
+        self.schedules = {}  # host:port -> DeviceSchedule
+        self.pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='pull')
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='pull-scheduler', daemon=True)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            concurrency=int(os.getenv('PULL_CONCURRENCY', cooperative.default_limit(4, 32))),
+            lookback_days=int(os.getenv('PULL_LOOKBACK_DAYS', '2')),
+            timeout=int(os.getenv('PULL_TIMEOUT', '30')),
+            leases=device_leases.LeaseManager(float(os.getenv('PULL_LEASE_SECONDS', '30')))
+            if os.getenv('PULL_SHARDING', 'False').lower() == 'true' else None,
+        )
+
+    def start(self):
+        device_registry.subscribe(self.apply_changes)
+        registry = device_registry.current()
+        now = time.monotonic()
+        with self.lock:
+            for i, device in enumerate(registry.ordered):
+                if device.pull_interval:
+                    # Spread the first pulls out instead of connecting to every device at once
+                    self.schedules[device.key] = DeviceSchedule(device, now + i % device.pull_interval)
+        if self.leases:
+            self._renew_leases()
+            print(f"⏱️  Pull scheduler started as {self.leases.member}: {len(self.leases.held)} of "
+                  f"{len(self.schedules)} devices leased, {len(self.leases.members)} schedulers")
+            atexit.register(self.stop)
+        else:
+            print(f"⏱️  Pull scheduler started: {len(self.schedules)} devices")
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        if self.leases:
+            try:
+                self.leases.release_all()  # hand devices over now instead of after the lease expires
+            except Exception as e:
+                print(f"⚠️  Could not release device leases: {e}")
+
+    def _renew_leases(self):
+        with self.lock:
+            devices = list(self.schedules)
+            busy = [key for key, schedule in self.schedules.items() if schedule.running]
+        try:
+            self.leases.heartbeat(devices, busy)
+        except Exception as e:
+            # Leases we hold stay valid until they expire; after that we simply pull nothing
+            print(f"⚠️  Device lease renewal failed: {e}")
+
+    def apply_changes(self, old, new):
+        """Registry listener: add, drop or update just the devices that changed"""
+        added, removed, changed = device_registry.changes(old, new)
+        if not (added or removed or changed):
+            return
+        now = time.monotonic()
+        with self.lock:
+            for device in removed:
+                self.schedules.pop(device.key, None)
+            for device in added + changed:
+                schedule = self.schedules.get(device.key)
+                if not device.pull_interval:
+                    self.schedules.pop(device.key, None)
+                elif schedule is None:
+                    self.schedules[device.key] = DeviceSchedule(device, now)
+                else:
+                    if device.pull_interval < schedule.device.pull_interval:
+                        schedule.next_due = min(schedule.next_due, now + device.pull_interval)
+                    schedule.device = device
+        print(f"⏱️  Pull schedule updated: +{len(added)} -{len(removed)} ~{len(changed)} devices")
+
+    def _run(self):
+        while not self.stopped.wait(1):
+            device_registry.current()  # notices inventory changes; apply_changes runs as a listener
+            if self.leases and self.leases.due():
+                self._renew_leases()
+            now = time.monotonic()
+            with self.lock:
+                due = [s for key, s in self.schedules.items() if not s.running and s.next_due <= now
+                       and (self.leases is None or self.leases.owns(key))]
+                for schedule in due:
+                    schedule.running = True
+            for schedule in due:
+                try:
+                    self.pool.submit(self._pull, schedule)
+                except RuntimeError:  # pool shut down
+                    return
+
+    def _pull(self, schedule):
+        device = schedule.device
+        error, records, uploaded = None, None, None
+        try:
+            records, uploaded = pull_and_upload(device, self.lookback_days, self.timeout)
+            if uploaded:
+                print(f"📥 {device.key}: {uploaded} new punches uploaded")
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            print(f"⚠️  Scheduled pull of {device.key} failed: {error}")
+        with self.lock:
+            schedule.running = False
+            schedule.next_due = time.monotonic() + schedule.device.pull_interval
+            schedule.pulls += 1
+            schedule.last_pull = datetime.now().isoformat(timespec='seconds')
+            schedule.last_error = error
+            if error:
+                schedule.failures += 1
+            else:
+                schedule.last_records, schedule.last_uploaded = records, uploaded
+
+    def status(self, key):
+        with self.lock:
+            schedule = self.schedules.get(key)
+            if schedule is None:
+                return None
+            status = schedule.describe()
+        if self.leases:
+            status['leased_here'] = self.leases.owns(key)
+        return status
+
+    def snapshot(self):
+        with self.lock:
+            schedules = list(self.schedules.values())
+        snapshot = {
+            'enabled': True,
+            'devices': len(schedules),
+            'running': sum(1 for s in schedules if s.running),
+            'failing': sorted(s.device.key for s in schedules if s.last_error),
+        }
+        if self.leases:
+            snapshot['sharding'] = self.leases.snapshot()
+        return snapshot
+
+
+def pull_and_upload(device, lookback_days, timeout):
+    """
+    Pull one device, store its recent records and upload the unacknowledged ones.
+    Returns (records in the lookback window, records uploaded).
+    """
+    trace = tracing.start('pull', tracing.SPAN_KIND_INTERNAL, **{'zk.source': 'pull', 'zk.device': device.key})
+    try:
+        records, uploaded = _pull_and_upload(device, lookback_days, timeout, trace)
+    except Exception as e:
+        trace.end(str(e) or type(e).__name__)
+        raise
+    trace.set(**{'zk.records': records, 'zk.uploaded': uploaded})
+    trace.end()
+    return records, uploaded
+
+
+def _pull_and_upload(device, lookback_days, timeout, trace):
+    with trace.stage('receive'):
+        conn = device.zk(timeout=timeout).connect()
+        try:
+            corrections = clock_skew.handshake(conn, device.key, sync=True)
+            users = conn.get_users()
+            data = RecordBatch.read_log(conn)
+            record_count = conn.records
+        finally:
+            try:
+                conn.disconnect()
+            except Exception:
+                pass
+    with trace.stage('parse'):
+        batch = RecordBatch.parse(data, record_count, users) if data else RecordBatch.with_users(users)
+
+    tenant = device_registry.current().tenant_for(device.host, device.port)
+    trace.set(**{'zk.tenant': tenant.name})
+    now = datetime.now()
+    start = (now - timedelta(days=lookback_days)).replace(hour=0, minute=0, second=0, microsecond=0)
+    end = now + timedelta(days=1)
+    with trace.stage('dedupe'):
+        batch = batch.filter_range(start, end).dedup()
+        records = batch.to_records()
+        cooperative.offload(attendance_store.save_punches, device.key, records)  # device clock, as on the terminal
+        if clock_skew.correct_batch(batch, corrections):
+            records = batch.to_records()
+        daily_summary.record_batch(tenant.name, records, batch.user_map())
+
+    if not tenant.configured:
+        return len(records), 0
+    with trace.stage('enqueue'):
+        pending = cooperative.offload(attendance_store.pending_punches, device.key, start.isoformat(), end.isoformat())
+    user_map = batch.user_map()
+    for i in range(0, len(pending), UPLOAD_CHUNK):
+        chunk = pending[i:i + UPLOAD_CHUNK]
+        with trace.stage('upload', **{'zk.batch_size': len(chunk)}):
+            upload_data = attendance_store.to_upload_data(clock_skew.correct_records(chunk, corrections), user_map)
+            body, headers = serialization.upload_body(upload_data, tenant.headers())
+            response = circuit_breaker.post(tenant.breaker, tenant.upload_url, session=tenant.session,
+                                            data=body, headers=headers, timeout=60)
+            response.raise_for_status()
+        with trace.stage('ack'):
+            cooperative.offload(attendance_store.mark_acked, device.key, chunk)
+    return len(records), len(pending)
+
+
+scheduler = None
+
+
+def start():
+    """Start the scheduler in this process (once)"""
+    global scheduler
+    if scheduler is None:
+        scheduler = PullScheduler.from_env()
+        scheduler.start()
+    return scheduler
+
+
+def status(key):
+    return scheduler.status(key) if scheduler else None
+
+
+def snapshot():
+    return scheduler.snapshot() if scheduler else {'enabled': False}
@@ -0,0 +1,253 @@
+# punch_parsing.py
+"""
+Parsers for pushed punches, shared by the ingest routes in server.py and the
+journal replay (ingest_journal.py), so a parser fix also applies to punches
+that were already received.
+
+- read_adms_payload(): /adms/webhook request -> dict (JSON, form, query or raw JSON)
+- parse_adms_record(): that dict -> attendance record (Format 1/2/3), or None
+- parse_iclock_lines(): /iclock/cdata body -> punches (tab-separated lines)
+
+`now` is when the request was received: it stands in for missing or unreadable
+timestamps and anchors the iClock real-time filter. `log` receives the
+diagnostic lines the routes print (replay passes a no-op).
+"""
+import json
+import time
+from datetime import datetime, timedelta
+
+# iClock posts from before this window (and from before the server started) are
+# backlog the device resends after reconnecting; they are not shown or uploaded
+ICLOCK_REALTIME_WINDOW = timedelta(minutes=5)
+
+
+def read_adms_payload(request, log=print):
+    """Webhook body as a dict, whatever way the device sent it"""
+    # ZKTeco ADMS can send data in different formats
+    # Try to parse JSON first (most common)
+    if request.is_json:
+        data = request.json
+        log(f"📦 Data Format: JSON")
+    # Try form data
+    elif request.form:
+        data = dict(request.form)
+        log(f"📦 Data Format: Form Data")
+    # Try query parameters (for GET requests)
+    elif request.args:
+        data = dict(request.args)
+        log(f"📦 Data Format: Query Parameters")
+    else:
+        # Try to parse raw data
+        raw_data = request.get_data(as_text=True)
+        log(f"📦 Data Format: Raw Data")
+        try:
+            data = json.loads(raw_data) if raw_data else {}
+        except:
+            data = {}
+    return data
+
+
+def parse_adms_record(data, now, log=print):
+    """
+    Attendance record ({'user_id', 'number', 'name', 'dateTime', 'status'}) from a
+    webhook payload, or None if no known format matches.
+    """
+    # Extract attendance data from various possible formats
+    attendance_record = None
+    log(f"\n🔍 Parsing attendance data...")
+
+    # Format 1: Direct fields in JSON
+    if 'user_id' in data or 'userId' in data or 'UserID' in data:
+        log(f"   ✅ Detected Format 1: Direct fields in JSON")
+        user_id = data.get('user_id') or data.get('userId') or data.get('UserID')
+        timestamp_str = data.get('timestamp') or data.get('time') or data.get('datetime') or data.get('DateTime')
+        punch = data.get('punch') or data.get('status') or data.get('Punch')
+        name = data.get('name') or data.get('Name') or data.get('user_name')
+
+        log(f"   👤 User ID: {user_id}")
+        log(f"   📛 Name: {name or 'Not provided'}")
+        log(f"   🕐 Timestamp String: {timestamp_str or 'Not provided'}")
+        log(f"   👊 Punch Code: {punch}")
+
+        # Parse timestamp
+        if timestamp_str:
+            try:
+                if isinstance(timestamp_str, str):
+                    # Try ISO format first
+                    try:
+                        timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
+                    except:
+                        # Try common formats
+                        for fmt in ['%Y-%m-%d %H:%M:%S', '%Y/%m/%d %H:%M:%S', '%d-%m-%Y %H:%M:%S']:
+                            try:
+                                timestamp = datetime.strptime(timestamp_str, fmt)
+                                break
+                            except:
+                                continue
+                        else:
+                            timestamp = now
+                            log(f"   ⚠️  Could not parse timestamp, using current time")
+                else:
+                    timestamp = now
+            except:
+                timestamp = now
+                log(f"   ⚠️  Error parsing timestamp, using current time")
+        else:
+            timestamp = now
+            log(f"   ⚠️  No timestamp provided, using current time")
+
+        # Determine status
+        if punch is not None:
+            status = 'Check In' if int(punch) == 0 else 'Check Out'
+        else:
+            status = data.get('status', 'Check In')
+
+        attendance_record = {
+            'user_id': str(user_id),
+            'number': str(user_id),
+            'name': name or f'User {user_id}',
+            'dateTime': timestamp.isoformat(),
+            'status': status
+        }
+
+        log(f"   ✅ Parsed successfully!")
+
+    # Format 2: Nested structure
+    elif 'data' in data:
+        log(f"   ✅ Detected Format 2: Nested structure")
+        record_data = data['data']
+        if isinstance(record_data, list) and len(record_data) > 0:
+            record_data = record_data[0]
+
+        user_id = record_data.get('user_id') or record_data.get('userId')
+        timestamp_str = record_data.get('timestamp') or record_data.get('time')
+        punch = record_data.get('punch') or record_data.get('status')
+        name = record_data.get('name')
+
+        log(f"   👤 User ID: {user_id}")
+        log(f"   📛 Name: {name or 'Not provided'}")
+        log(f"   🕐 Timestamp String: {timestamp_str or 'Not provided'}")
+        log(f"   👊 Punch Code: {punch}")
+
+        if user_id:
+            timestamp = now
+            if timestamp_str:
+                try:
+                    timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
+                except:
+                    log(f"   ⚠️  Could not parse timestamp, using current time")
+
+            status = 'Check In' if (punch == 0 or punch == '0') else 'Check Out'
+
+            attendance_record = {
+                'user_id': str(user_id),
+                'number': str(user_id),
+                'name': name or f'User {user_id}',
+                'dateTime': timestamp.isoformat(),
+                'status': status
+            }
+
+            log(f"   ✅ Parsed successfully!")
+
+    # Format 3: Attendance log format
+    elif 'attendance' in data:
+        log(f"   ✅ Detected Format 3: Attendance log format")
+        att_data = data['attendance']
+        if isinstance(att_data, list) and len(att_data) > 0:
+            att_data = att_data[0]
+
+        user_id = att_data.get('user_id') or att_data.get('userId')
+        timestamp_str = att_data.get('timestamp') or att_data.get('time')
+        punch = att_data.get('punch')
+        name = att_data.get('name')
+
+        log(f"   👤 User ID: {user_id}")
+        log(f"   📛 Name: {name or 'Not provided'}")
+        log(f"   🕐 Timestamp String: {timestamp_str or 'Not provided'}")
+        log(f"   👊 Punch Code: {punch}")
+
+        if user_id:
+            timestamp = now
+            if timestamp_str:
+                try:
+                    timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
+                except:
+                    log(f"   ⚠️  Could not parse timestamp, using current time")
+
+            status = 'Check In' if (punch == 0 or punch == '0') else 'Check Out'
+
+            attendance_record = {
+                'user_id': str(user_id),
+                'number': str(user_id),
+                'name': name or f'User {user_id}',
+                'dateTime': timestamp.isoformat(),
+                'status': status
+            }
+
+            log(f"   ✅ Parsed successfully!")
+
+    return attendance_record
+
+
+def parse_iclock_lines(raw_data, now, server_start, log=print, clock=None):
+    """
+    Punches from an iClock ATTLOG post: USERID \\t TIMESTAMP \\t STATUS \\t VERIFY \\t WORKCODE.
+    Returns [(user_id, timestamp datetime, status code, parse_ns)] for real-time lines;
+    backlog older than ICLOCK_REALTIME_WINDOW that predates server_start is skipped.
+    With a clock (clock_skew.DeviceClock) the post's device times are a skew sample,
+    and the device's correction is taken out of them before the real-time filter.
+    """
+    parsed = []
+    for line in raw_data.strip().split('\n'):
+        if not line.strip():
+            continue
+
+        parse_ns = time.time_ns()
+        parts = line.split('\t')
+
+        if len(parts) >= 2:
+            user_id = parts[0].strip()
+            timestamp_str = parts[1].strip()
+            status = parts[2].strip() if len(parts) > 2 else '0'
+
+            # Parse timestamp
+            try:
+                timestamp = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
+            except:
+                try:
+                    timestamp = datetime.strptime(timestamp_str, '%Y/%m/%d %H:%M:%S')
+                except:
+                    timestamp = None
+
+            parsed.append((user_id, timestamp, status, parse_ns))
+
+    # Device clock correction, once for the whole post (unreadable times fall back to now)
+    correction = timedelta(0)
+    if clock is not None:
+        device_times = [timestamp for _, timestamp, _, _ in parsed if timestamp is not None]
+        if device_times:
+            clock.observe_push(max(device_times), now)
+        correction = timedelta(seconds=clock.push_correction())
+
+    # Only show records from the last 5 minutes (real-time data)
+    # This filters out old backlogged records the device might send
+    time_threshold = now - ICLOCK_REALTIME_WINDOW
+    punches = []
+    for user_id, timestamp, status, parse_ns in parsed:
+        timestamp = timestamp - correction if timestamp is not None else now
+
+        # FILTER: Only show records from the last 5 minutes (real-time)
+        # This prevents showing old backlogged data
+        if timestamp < time_threshold and timestamp < server_start:
+            # Skip old records - don't display or upload
+            continue
+
+        # Determine punch status
+        punch_status = '✅ CHECKED IN' if status == '0' else '✅ CHECKED OUT'
+
+        # Simple, clean output - only for real-time data
+        time_display = timestamp.strftime('%Y-%m-%d %H:%M:%S')
+        log(f"\n{punch_status} | User ID: {user_id} | Time: {time_display}")
+
+        punches.append((user_id, timestamp, status, parse_ns))
+    return punches
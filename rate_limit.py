@@ -0,0 +1,139 @@
+# rate_limit.py
+"""
+Admission control for the device ingest endpoints (/adms/webhook, /iclock/cdata).
+
+- Token buckets per device and one global bucket decide whether a push is
+  accepted right now; over-budget requests get a fast 503 + Retry-After
+  (ZKTeco devices resend on anything other than "OK").
+- A non-blocking concurrency cap keeps ingest from occupying every worker
+  thread, so dashboard routes (/attendance, /connect) always have capacity.
+
+All limits are per worker process.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import cooperative
+
+MAX_TRACKED_DEVICES = 10000
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `burst`"""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def try_acquire(self, now=None):
+        """Take one token. Returns (allowed, retry_after_seconds)."""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True, 0
+        return False, (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    def __init__(self, device_rate, device_burst, global_rate, global_burst, max_concurrency):
+        self.device_rate = device_rate
+        self.device_burst = device_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst) if global_rate > 0 else None
+        self.max_concurrency = max_concurrency
+        self.slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency > 0 else None
+        self.lock = threading.Lock()
+        self.device_buckets = OrderedDict()
+        self.device_stats = OrderedDict()
+        self.totals = {'admitted': 0, 'throttled_device': 0, 'throttled_global': 0, 'rejected_busy': 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            device_rate=float(os.getenv('INGEST_DEVICE_RATE', '5')),
+            device_burst=float(os.getenv('INGEST_DEVICE_BURST', '20')),
+            global_rate=float(os.getenv('INGEST_GLOBAL_RATE', '100')),
+            global_burst=float(os.getenv('INGEST_GLOBAL_BURST', '200')),
+            max_concurrency=int(os.getenv('INGEST_MAX_CONCURRENCY', cooperative.default_limit(4, 200))),
+        )
+
+    def _touch(self, table, device_id, factory):
+        """LRU lookup so a flood of spoofed device IDs can't grow memory without bound"""
+        entry = table.get(device_id)
+        if entry is None:
+            entry = table[device_id] = factory()
+            if len(table) > MAX_TRACKED_DEVICES:
+                table.popitem(last=False)
+        else:
+            table.move_to_end(device_id)
+        return entry
+
+    def _record(self, device_id, outcome):
+        stats = self._touch(self.device_stats, device_id, lambda: {'admitted': 0, 'throttled': 0, 'last_throttled': None})
+        if outcome == 'admitted':
+            stats['admitted'] += 1
+        else:
+            stats['throttled'] += 1
+            stats['last_throttled'] = time.time()
+        self.totals[outcome] += 1
+
+    def admit(self, device_id):
+        """
+        Check the rate limits for one request.
+        Returns (allowed, reason, retry_after_seconds); reason is None when allowed.
+        """
+        with self.lock:
+            if self.device_rate > 0:
+                bucket = self._touch(self.device_buckets, device_id, lambda: TokenBucket(self.device_rate, self.device_burst))
+                allowed, retry_after = bucket.try_acquire()
+                if not allowed:
+                    self._record(device_id, 'throttled_device')
+                    return False, 'device rate limit exceeded', retry_after
+            if self.global_bucket is not None:
+                allowed, retry_after = self.global_bucket.try_acquire()
+                if not allowed:
+                    self._record(device_id, 'throttled_global')
+                    return False, 'server ingest limit exceeded', retry_after
+            return True, None, 0
+
+    def acquire_slot(self, device_id):
+        """Grab an ingest slot without waiting. Returns False when ingest capacity is full."""
+        if self.slots is not None and not self.slots.acquire(blocking=False):
+            with self.lock:
+                self._record(device_id, 'rejected_busy')
+            return False
+        with self.lock:
+            self._record(device_id, 'admitted')
+        return True
+
+    def release_slot(self):
+        if self.slots is not None:
+            self.slots.release()
+
+    def snapshot(self, top=20):
+        """Counters for /adms/status: totals plus the most throttled devices"""
+        with self.lock:
+            throttled = sorted(
+                ((device_id, dict(stats)) for device_id, stats in self.device_stats.items() if stats['throttled']),
+                key=lambda item: -item[1]['throttled']
+            )[:top]
+            return {
+                'limits': {
+                    'device_rate': self.device_rate,
+                    'device_burst': self.device_burst,
+                    'global_rate': self.global_bucket.rate if self.global_bucket else 0,
+                    'global_burst': self.global_bucket.burst if self.global_bucket else 0,
+                    'max_concurrency': self.max_concurrency,
+                    'scope': 'per worker process',
+                },
+                'totals': dict(self.totals),
+                'tracked_devices': len(self.device_stats),
+                'throttled_devices': [
+                    {'device': device_id, **stats} for device_id, stats in throttled
+                ],
+            }
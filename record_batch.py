@@ -0,0 +1,254 @@
+# record_batch.py
+"""
+Columnar batch of attendance records.
+
+pyzk turns every punch into an Attendance object holding a datetime, and the
+routes then copy each one into a couple of dicts with ISO strings. RecordBatch
+keeps the same data in typed arrays instead:
+
+- user_idx   array('I')  index into the user table
+- timestamps array('q')  device-local wall clock as seconds since 1970-01-01
+- status     array('B')  verify type reported by the device
+- punch      array('B')  0 = check in, 1 = check out
+
+plus one interned (user_id, name) table shared by every record of a user.
+Filtering, dedup and JSON serialization work on the columns directly;
+RecordBatch.from_device() also parses the raw attendance buffer itself, which
+avoids pyzk's per-record slicing of the whole buffer.
+"""
+import sys
+import json
+from array import array
+from bisect import bisect_right
+from struct import unpack, iter_unpack
+from datetime import datetime, timedelta
+
+from zk import const
+
+EPOCH = datetime(1970, 1, 1)
+SECONDS_PER_DAY = 86400
+MINUTES = [f"{m // 60:02d}:{m % 60:02d}:" for m in range(1440)]
+SECONDS = [f"{s:02d}" for s in range(60)]
+
+
+def to_seconds(dt):
+    """Naive datetime -> seconds since EPOCH (no timezone conversion)"""
+    delta = dt - EPOCH
+    return delta.days * SECONDS_PER_DAY + delta.seconds
+
+
+class RecordBatch:
+    def __init__(self):
+        self.user_idx = array('I')
+        self.timestamps = array('q')
+        self.status = array('B')
+        self.punch = array('B')
+        self.user_ids = []
+        self.names = []
+        self._user_lookup = {}
+        self._day_iso = {}
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def user_index(self, user_id, name=None):
+        """Index of user_id in the user table, adding it (interned) if needed"""
+        index = self._user_lookup.get(user_id)
+        if index is None:
+            index = self._user_lookup[user_id] = len(self.user_ids)
+            self.user_ids.append(sys.intern(user_id))
+            self.names.append(sys.intern(name if name is not None else f'User {user_id}'))
+        return index
+
+    def append(self, user_id, timestamp, status, punch, name=None):
+        self.user_idx.append(self.user_index(str(user_id), name))
+        self.timestamps.append(to_seconds(timestamp))
+        self.status.append(int(status))
+        self.punch.append(int(punch))
+
+    @classmethod
+    def from_attendance(cls, attendance, user_map=None):
+        """Build from pyzk Attendance objects"""
+        user_map = user_map or {}
+        batch = cls()
+        for a in attendance:
+            user_id = str(a.user_id)
+            batch.append(user_id, a.timestamp, a.status, a.punch, user_map.get(user_id))
+        return batch
+
+    @classmethod
+    def from_device(cls, conn, users=None):
+        """
+        Read the attendance log from a connected pyzk device without building
+        Attendance objects. `users` defaults to conn.get_users().
+        """
+        if users is None:
+            users = conn.get_users()
+        data = cls.read_log(conn)
+        if data is None:
+            return cls.with_users(users)
+        return cls.parse(data, conn.records, users)
+
+    @staticmethod
+    def read_log(conn):
+        """Raw CMD_ATTLOG_RRQ buffer for parse() (record count in conn.records), None if empty"""
+        conn.read_sizes()
+        if conn.records == 0:
+            return None
+        data, size = conn.read_with_buffer(const.CMD_ATTLOG_RRQ)
+        return data if size >= 4 else None
+
+    @classmethod
+    def with_users(cls, users):
+        """Empty batch whose user table already holds the device's users"""
+        batch = cls()
+        for user in users:
+            batch.user_index(str(user.user_id), user.name)
+        return batch
+
+    @classmethod
+    def parse(cls, data, record_count, users):
+        """
+        Parse a raw CMD_ATTLOG_RRQ buffer (4-byte size prefix followed by 8, 16 or
+        40 byte records, same layouts pyzk understands).
+        """
+        batch = cls.with_users(users)
+        total_size = unpack('<I', data[:4])[0]
+        record_size = total_size // record_count if record_count else 40
+        body = data[4:4 + (len(data) - 4) // record_size * record_size]
+
+        by_uid = {user.uid: str(user.user_id) for user in users}
+        user_idx, status_col, punch_col, raw_times = batch.user_idx, batch.status, batch.punch, []
+        if record_size == 8:
+            for uid, status, timestamp, punch in iter_unpack('<HBIB', body):
+                user_idx.append(batch.user_index(by_uid.get(uid, str(uid))))
+                raw_times.append(timestamp)
+                status_col.append(status)
+                punch_col.append(punch)
+        elif record_size == 16:
+            for user_id, timestamp, status, punch, _, _ in iter_unpack('<IIBB2sI', body):
+                user_id = str(user_id)
+                if user_id not in batch._user_lookup:
+                    user_id = by_uid.get(int(user_id), user_id)
+                user_idx.append(batch.user_index(user_id))
+                raw_times.append(timestamp)
+                status_col.append(status)
+                punch_col.append(punch)
+        else:
+            for _, user_id, status, timestamp, punch, _ in iter_unpack('<H24sBIB8s', body):
+                user_idx.append(batch.user_index(user_id.split(b'\x00')[0].decode(errors='ignore')))
+                raw_times.append(timestamp)
+                status_col.append(status)
+                punch_col.append(punch)
+        batch.timestamps = array('q', decode_times(raw_times))
+        return batch
+
+    def _take(self, indices):
+        """New batch with the records at `indices`, sharing this batch's user table"""
+        batch = RecordBatch()
+        batch.user_ids, batch.names, batch._user_lookup = self.user_ids, self.names, self._user_lookup
+        batch._day_iso = self._day_iso
+        batch.user_idx = array('I', (self.user_idx[i] for i in indices))
+        batch.timestamps = array('q', (self.timestamps[i] for i in indices))
+        batch.status = array('B', (self.status[i] for i in indices))
+        batch.punch = array('B', (self.punch[i] for i in indices))
+        return batch
+
+    def filter_range(self, start, end):
+        """Records with start <= timestamp <= end (naive datetimes, inclusive)"""
+        # Records have whole seconds, so flooring a fractional bound keeps the same records
+        low, high = to_seconds(start) + (1 if start.microsecond else 0), to_seconds(end)
+        return self._take([i for i, t in enumerate(self.timestamps) if low <= t <= high])
+
+    def dedup(self):
+        """Drop repeated (user, timestamp, punch) records, keeping the first"""
+        seen = set()
+        keep = []
+        for i, key in enumerate(zip(self.user_idx, self.timestamps, self.punch)):
+            if key not in seen:
+                seen.add(key)
+                keep.append(i)
+        if len(keep) == len(self):
+            return self
+        return self._take(keep)
+
+    def shift_timestamps(self, starts, seconds):
+        """
+        Subtract seconds[i] from timestamps in [starts[i-1], starts[i]), in place:
+        seconds has one more entry than starts (ascending, in timestamp seconds).
+        """
+        if not starts:
+            shift = seconds[0]
+            self.timestamps = array('q', [t - shift for t in self.timestamps])
+        else:
+            self.timestamps = array('q', [t - seconds[bisect_right(starts, t)] for t in self.timestamps])
+
+    def iso_timestamps(self):
+        """ISO 8601 strings ('YYYY-MM-DDTHH:MM:SS', same as datetime.isoformat())"""
+        day_iso = self._day_iso
+        result = []
+        for t in self.timestamps:
+            day, second = divmod(t, SECONDS_PER_DAY)
+            prefix = day_iso.get(day)
+            if prefix is None:
+                prefix = day_iso[day] = (EPOCH + timedelta(days=day)).strftime('%Y-%m-%dT')
+            minute, second = divmod(second, 60)
+            result.append(prefix + MINUTES[minute] + SECONDS[second])
+        return result
+
+    def to_records(self):
+        """attendance_store records: (user_id, timestamp_iso, status, punch)"""
+        user_ids = self.user_ids
+        return [(user_ids[u], ts, s, p) for u, ts, s, p in
+                zip(self.user_idx, self.iso_timestamps(), self.status, self.punch)]
+
+    def user_map(self):
+        return dict(zip(self.user_ids, self.names))
+
+    def _json_fields(self):
+        """Per-user JSON-encoded name and number, encoded once per user instead of per record"""
+        return [json.dumps(n) for n in self.names], [json.dumps(u) for u in self.user_ids]
+
+    def to_upload_json(self):
+        """JSON array in the /attendance/upload format: dateTime, name, status, number"""
+        names, numbers = self._json_fields()
+        return '[' + ','.join(
+            f'{{"dateTime":"{ts}","name":{names[u]},"status":"{"Check In" if p == 0 else "Check Out"}","number":{numbers[u]}}}'
+            for u, ts, p in zip(self.user_idx, self.iso_timestamps(), self.punch)
+        ) + ']'
+
+    def to_logs_json(self):
+        """JSON array of the dashboard's log rows: user_id, name, number, dateTime, status"""
+        names, numbers = self._json_fields()
+        return '[' + ','.join(
+            f'{{"user_id":{numbers[u]},"name":{names[u]},"number":{numbers[u]},"dateTime":"{ts}",'
+            f'"status":"{"Check In" if p == 0 else "Check Out"}"}}'
+            for u, ts, p in zip(self.user_idx, self.iso_timestamps(), self.punch)
+        ) + ']'
+
+    def nbytes(self):
+        """Approximate memory held by the columns and user table"""
+        columns = sum(col.itemsize * len(col) for col in (self.user_idx, self.timestamps, self.status, self.punch))
+        table = sum(sys.getsizeof(s) for s in self.user_ids) + sum(sys.getsizeof(s) for s in self.names)
+        return columns + table
+
+
+def decode_times(raw_times):
+    """
+    ZK packed timestamps -> seconds since EPOCH.
+
+    The device packs ((((year-2000)*12 + month-1)*31 + day-1)*86400 + seconds of day),
+    so the date part is converted once per distinct day.
+    """
+    days = {}
+    result = []
+    for t in raw_times:
+        day_code, second = divmod(t, SECONDS_PER_DAY)
+        base = days.get(day_code)
+        if base is None:
+            day = day_code % 31 + 1
+            month = day_code // 31 % 12 + 1
+            year = day_code // 372 + 2000
+            base = days[day_code] = to_seconds(datetime(year, month, day))
+        result.append(base + second)
+    return result
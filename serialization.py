@@ -0,0 +1,98 @@
+# serialization.py
+"""
+JSON encoding and gzip for request/response bodies.
+
+- dumps() / loads(): orjson when it is installed (pip install orjson), stdlib json
+  otherwise. JSON_ENCODER=json forces the stdlib encoder.
+- upload_body(): body + headers for POSTs to the HRMS backend. With UPLOAD_GZIP=True,
+  bodies of at least UPLOAD_GZIP_MIN_BYTES are sent with Content-Encoding: gzip
+  (the backend must accept compressed request bodies).
+- compress_response: route decorator that gzips JSON responses when the client
+  sends Accept-Encoding: gzip and the body is at least RESPONSE_GZIP_MIN_BYTES.
+"""
+import os
+import gzip
+import json
+from functools import wraps
+
+from flask import request, make_response
+
+import cooperative
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if os.getenv('JSON_ENCODER', '').lower() == 'json':
+    orjson = None
+
+ENCODER = 'orjson' if orjson else 'json'
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', '6'))
+
+
+def _enabled(name, default='False'):
+    return os.getenv(name, default).lower() == 'true'
+
+
+def dumps(obj):
+    """Compact JSON as bytes"""
+    if orjson:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+def loads(data):
+    """JSON (str or bytes) -> Python objects"""
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def to_bytes(payload):
+    """Already-serialized JSON (str/bytes, e.g. from RecordBatch) is passed through"""
+    if isinstance(payload, bytes):
+        return payload
+    if isinstance(payload, str):
+        return payload.encode()
+    return dumps(payload)
+
+
+def upload_body(payload, headers):
+    """
+    (data, headers) for requests.post(data=..., headers=...) to the backend.
+    headers is copied, not modified.
+    """
+    body = to_bytes(payload)
+    headers = dict(headers, **{'Content-Type': 'application/json'})
+    if _enabled('UPLOAD_GZIP') and len(body) >= int(os.getenv('UPLOAD_GZIP_MIN_BYTES', '16384')):
+        body = cooperative.offload(gzip.compress, body, GZIP_LEVEL)
+        headers['Content-Encoding'] = 'gzip'
+    return body, headers
+
+
+def json_response(payload, status=200):
+    """Flask response from an object or already-serialized JSON"""
+    response = make_response(to_bytes(payload), status)
+    response.mimetype = 'application/json'
+    return response
+
+
+def compress_response(f):
+    """Gzip the route's response when the client accepts it and it's big enough to matter"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        response = make_response(f(*args, **kwargs))
+        if (not _enabled('RESPONSE_GZIP', 'True')
+                or response.direct_passthrough
+                or 'Content-Encoding' in response.headers
+                or 'gzip' not in request.headers.get('Accept-Encoding', '').lower()):
+            return response
+        body = response.get_data()
+        if len(body) < int(os.getenv('RESPONSE_GZIP_MIN_BYTES', '1024')):
+            return response
+        response.set_data(cooperative.offload(gzip.compress, body, GZIP_LEVEL))
+        response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+        return response
+    return decorated_function
@@ -0,0 +1,1049 @@
+# server.py
+# Headless Flask app: everything request handling needs, nothing desktop-only.
+# gunicorn loads this module directly (see Procfile); app.py wraps it with the
+# desktop launcher (browser window, ngrok tunnel).
+from zk import ZK
+from flask import Flask, request, jsonify, render_template, session, redirect, url_for, send_file, Response, g
+from werkzeug.middleware.proxy_fix import ProxyFix
+from datetime import datetime, timedelta
+import requests
+import os
+from dotenv import load_dotenv
+from functools import wraps
+import socket
+import time
+import profiler
+from rate_limit import AdmissionController
+import circuit_breaker
+import attendance_store
+import log_rotation
+from record_batch import RecordBatch
+import serialization
+import user_index
+import live_feed
+import device_registry
+import upload_batcher
+import pull_scheduler
+import daily_summary
+import cooperative
+import tracing
+import punch_parsing
+import ingest_journal
+import clock_skew
+from serialization import compress_response
+
+# Load environment variables
+load_dotenv()
+
+# Track server start time to filter out old records
+SERVER_START_TIME = datetime.now()
+
+# Check if .env file exists
+env_path = '.env'
+if os.path.exists(env_path):
+    print(f".env file found at: {os.path.abspath(env_path)}")
+else:
+  print(f".env file NOT found at: {os.path.abspath(env_path)}")
+  # Try to find it in the bundle directory
+  bundle_dir = os.path.dirname(os.path.abspath(__file__))
+  bundle_env_path = os.path.join(bundle_dir, '.env')
+  if os.path.exists(bundle_env_path):
+    print(f".env file found in bundle at: {bundle_env_path}")
+    load_dotenv(bundle_env_path)
+  else:
+    print(f".env file not found anywhere!")
+
+app = Flask(__name__)
+
+# Behind a reverse proxy (Heroku router, nginx) the client IP is in X-Forwarded-For.
+# Only trust as many hops as there are proxies: anyone can send the header.
+TRUSTED_PROXY_COUNT = int(os.getenv('TRUSTED_PROXY_COUNT', '0'))
+if TRUSTED_PROXY_COUNT:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_COUNT)
+app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-here')  # Add a secret key for sessions
+
+# Configure session to be more persistent
+app.config['SESSION_COOKIE_SECURE'] = False  # Set to True in production with HTTPS
+app.config['SESSION_COOKIE_HTTPONLY'] = True
+app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
+app.config['PERMANENT_SESSION_LIFETIME'] = 86400  # 24 hours
+
+# Authentication decorator
+def require_auth(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # For now, we'll use a simple session check
+        # In production, you might want to validate JWT tokens
+        if 'user_id' not in session:
+            return jsonify({'error': 'Authentication required'}), 401
+        return f(*args, **kwargs)
+    return decorated_function
+
+# Admin-only decorator (roles come from the backend login response)
+def require_admin(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            return jsonify({'error': 'Authentication required'}), 401
+        admin_roles = [r.strip().lower() for r in os.getenv('ADMIN_ROLES', 'admin').split(',') if r.strip()]
+        if str(session.get('user_role') or '').lower() not in admin_roles:
+            return jsonify({'error': 'Admin role required'}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
+# Admission control for device ingest (see rate_limit.py)
+ingest_admission = AdmissionController.from_env()
+
+# Background pulls for inventory devices with a pull_interval (opt-in, see pull_scheduler.py)
+if pull_scheduler.is_enabled():
+    pull_scheduler.start()
+
+# Pushed punches still queued for upload when the last process stopped (see upload_batcher.py)
+upload_batcher.resume()
+
+# Raw device pushes kept for replay after parser fixes (opt-in, see ingest_journal.py)
+if ingest_journal.is_enabled():
+    ingest_journal.start(SERVER_START_TIME)
+
+@app.before_request
+def note_receipt_time():
+    if request.path in ingest_journal.JOURNALED_PATHS:
+        g.received_at = time.time()
+
+@app.after_request
+def journal_push(response):
+    if request.path in ingest_journal.JOURNALED_PATHS and ingest_journal.is_enabled():
+        ingest_journal.record(request, response.status_code, g.get('received_at') or time.time())
+    if 'trace' in g:
+        g.trace_status = response.status_code
+    return response
+
+@app.teardown_request
+def end_request_trace(error):
+    """End the request's trace (g.trace) on every exit path, so failed requests reach `tracing.py report`"""
+    trace = g.pop('trace', None)
+    if trace is None:
+        return
+    status = g.get('trace_status')
+    if error is not None:
+        trace.end(str(error) or type(error).__name__)
+    else:
+        trace.end(f"HTTP {status}" if status and status >= 400 else None)  # no-op if the handler ended it
+
+def get_device_id():
+    """Identify the pushing device: iClock serial number, else client IP"""
+    serial = request.args.get('SN')
+    if serial:
+        return f"SN:{serial}"
+    return get_client_ip() or 'unknown'
+
+def get_client_ip():
+    # remote_addr comes from X-Forwarded-For only via ProxyFix (TRUSTED_PROXY_COUNT)
+    return request.remote_addr
+
+# Ingest decorator: rate limits per device/globally and caps concurrent ingest requests.
+# Buckets are keyed on the connection address: ?SN= is client-supplied, so a new serial
+# per request would get a fresh bucket each time. The serial is only used for routing.
+def limit_ingest(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        device_id = get_client_ip() or 'unknown'
+        allowed, reason, retry_after = ingest_admission.admit(device_id)
+        if not allowed:
+            return _ingest_unavailable(reason, retry_after)
+        if not ingest_admission.acquire_slot(device_id):
+            return _ingest_unavailable('ingest capacity busy', 1)
+        try:
+            return f(*args, **kwargs)
+        finally:
+            ingest_admission.release_slot()
+    return decorated_function
+
+def _ingest_unavailable(reason, retry_after):
+    response = jsonify({'error': 'Service temporarily unavailable', 'reason': reason})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+    return response
+
+@app.route('/')
+def index():
+    # Redirect to login if not authenticated, otherwise to dashboard
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    return redirect(url_for('dashboard'))
+
+@app.route('/login')
+def login():
+    return render_template('login.html')
+
+@app.route('/dashboard')
+def dashboard():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    return render_template('index.html')
+
+@app.route('/login', methods=['POST'])
+def login_post():
+    data = request.json
+    email = data.get('email')
+    password = data.get('password')
+    role = data.get('role')
+    environment = data.get('environment', 'dev')
+    
+    if not email or not password or not role:
+        return jsonify({'error': 'Email, password, and role are required'}), 400
+    
+        # Determine backend URL based on environment
+    if environment == 'prod':
+        backend_url = os.getenv('PROD_BACKEND_URL', 'http://localhost:3001')
+        print(f"Using production backend URL: {backend_url}")
+    else:
+        backend_url = os.getenv('DEV_BACKEND_URL', 'https://code-huddle-hrms-dev-61ae656862e5.herokuapp.com')
+    
+    # Ensure proper URL construction by removing trailing slash if present
+    backend_url = backend_url.rstrip('/')
+    login_url = f"{backend_url}/auth/login"
+    
+    
+    # Call the main backend's login endpoint
+    try:
+        login_response = requests.post(
+            login_url,
+            json={
+                'email': email,
+                'password': password,
+                'role': role
+            },
+            headers={
+                'Content-Type': 'application/json',
+                'x-tenant': 'default'  # Add required tenant header
+            },
+            timeout=10
+        )
+        
+        
+        if login_response.status_code in [200, 201]:
+            try:
+                login_data = login_response.json()
+                
+                
+                # Try to extract tokens from different possible formats
+                tokens = {}
+                
+                # Check if tokens exist in the response
+                if 'tokens' in login_data and login_data['tokens']:
+                    tokens_data = login_data['tokens']
+                    
+                    # Check for snake_case format first (most common)
+                    if 'access_token' in tokens_data:
+                        tokens = {
+                            'accessToken': tokens_data.get('access_token'),
+                            'refreshToken': tokens_data.get('refresh_token', '')
+                        }
+                    
+                    # Check for camelCase format
+                    elif 'accessToken' in tokens_data:
+                        tokens = tokens_data
+                
+                # Format 3: Direct access_token field
+                elif 'access_token' in login_data:
+                    tokens = {
+                        'accessToken': login_data.get('access_token'),
+                        'refreshToken': login_data.get('refresh_token', '')
+                    }
+                
+                # Format 4: accessToken field
+                elif 'accessToken' in login_data:
+                    tokens = {
+                        'accessToken': login_data.get('accessToken'),
+                        'refreshToken': login_data.get('refreshToken', '')
+                    }
+                
+                # Format 5: Check if tokens are in data field
+                elif 'data' in login_data and 'tokens' in login_data['data']:
+                    tokens = login_data['data']['tokens']
+                
+                # Store user info in session
+                session['user_id'] = login_data.get('user', {}).get('_id')
+                session['user_email'] = login_data.get('user', {}).get('email')
+                session['user_role'] = login_data.get('user', {}).get('role')
+                session['environment'] = environment
+                session['tokens'] = tokens  # Store tokens in session
+                session.permanent = True  # Make session permanent
+                
+                
+                return jsonify({
+                    'success': True,
+                    'tokens': login_data.get('tokens', {}),
+                    'user': login_data.get('user', {})
+                })
+            except Exception as e:
+                return jsonify({
+                    'error': 'Invalid response format from backend'
+                }), 500
+        else:
+            try:
+                error_data = login_response.json() if login_response.content else {}
+            except:
+                error_data = {}
+            
+            return jsonify({
+                'error': f'Login failed with status {login_response.status_code}'
+            }), login_response.status_code
+            
+    except requests.exceptions.RequestException as e:
+        return jsonify({
+            'error': f'Failed to connect to {environment} backend: {str(e)}'
+        }), 500
+
+@app.route('/debug-session')
+def debug_session():
+    """Debug endpoint to check session state"""
+    return jsonify({
+        'session_data': dict(session),
+        'session_permanent': session.permanent,
+        'user_id': session.get('user_id'),
+        'tokens': session.get('tokens', {}),
+        'environment': session.get('environment')
+    })
+
+@app.route('/test-session', methods=['POST'])
+def test_session():
+    """Test endpoint to manually set session data"""
+    session['test_token'] = 'test_value_123'
+    session['tokens'] = {'accessToken': 'test_access_token', 'refreshToken': 'test_refresh_token'}
+    session.permanent = True
+    return jsonify({'message': 'Session test data set', 'session': dict(session)})
+
+@app.route('/set-token', methods=['POST'])
+def set_token():
+    """Manual endpoint to set access token for testing"""
+    data = request.json
+    access_token = data.get('accessToken') or data.get('access_token')
+    
+    if access_token:
+        session['tokens'] = {
+            'accessToken': access_token,
+            'refreshToken': data.get('refreshToken', data.get('refresh_token', ''))
+        }
+        session.permanent = True
+        return jsonify({
+            'message': 'Token set successfully',
+            'session': dict(session)
+        })
+    else:
+        return jsonify({'error': 'No access token provided'}), 400
+
+@app.route('/logout')
+def logout():
+    session.clear()
+    return redirect(url_for('login'))
+
+@app.route('/devices', methods=['GET'])
+@require_auth
+def get_devices():
+    """
+    One page of the device inventory (device_registry.py), ordered by site.
+    ?site=<site>&cursor=<next_cursor>&limit=100
+    """
+    try:
+        limit = user_index.parse_limit(request.args.get('limit'))
+        cursor = request.args.get('cursor')
+        cursor = user_index.decode_cursor(cursor) if cursor else None
+    except user_index.InvalidQuery as e:
+        return jsonify({'error': str(e)}), 400
+
+    devices, next_key, total = device_registry.current().page(cursor, limit, request.args.get('site') or None)
+    clocks = clock_skew.statuses([device.key for device in devices])
+    return jsonify({
+        'devices': [{**device.describe(), 'pull': pull_scheduler.status(device.key), 'clock': clocks.get(device.key)}
+                    for device in devices],
+        'total': total,
+        'next_cursor': user_index.encode_cursor(next_key) if next_key else None
+    })
+
+@app.route('/hrms-urls', methods=['GET'])
+@require_auth
+def get_hrms_urls():
+    """Get HRMS URLs for different environments"""
+    dev_hrms_url = os.getenv('DEV_HRMS_URL', 'https://dev-hrms.yourcompany.com')
+    prod_hrms_url = os.getenv('PROD_HRMS_URL', 'https://hrms.yourcompany.com')
+    
+    return jsonify({
+        'dev': dev_hrms_url,
+        'prod': prod_hrms_url
+    })
+
+@app.route('/connect', methods=['POST'])
+@require_auth
+@compress_response
+def connect():
+    data = request.json
+    ip = data.get('ip')
+    if not ip:
+        return jsonify({'error': 'IP address is required'}), 400
+
+    parts = ip.split(':')
+    host = parts[0]
+    port = int(parts[1]) if len(parts) > 1 else 4370
+
+    try:
+        index = user_index.store(f"{host}:{port}", read_device_users(host, port))
+    except Exception as e:
+        return jsonify({'error': str(e) or 'Failed to connect to ZKTeco device'}), 500
+
+    # First page only; the dashboard pages through the rest with /users
+    page = index.page(limit=user_index.DEFAULT_LIMIT)
+    return serialization.json_response({
+        'message': 'Successfully connected to device',
+        **page
+    })
+
+
+def device_zk(host, port, timeout=10):
+    """ZK client for a device, with its comm key if it's in the inventory"""
+    device = device_registry.current().device(host, port)
+    return device.zk(timeout=timeout) if device else ZK(host, port=port, timeout=timeout)
+
+
+def read_device_users(host, port):
+    """Read the user directory from a device"""
+    zk = device_zk(host, port)
+    conn = zk.connect()
+    try:
+        return conn.get_users()
+    finally:
+        try:
+            conn.disconnect()
+        except Exception:
+            pass
+
+
+@app.route('/users', methods=['GET'])
+@require_auth
+@compress_response
+def list_users():
+    """
+    One page of a device's users from the cached index.
+    ?ip=host[:port]&q=<name or user_id prefix>&cursor=<next_cursor>&limit=100&fields=user_id,name
+    """
+    ip = request.args.get('ip')
+    if not ip:
+        return jsonify({'error': 'IP address is required'}), 400
+
+    parts = ip.split(':')
+    host = parts[0]
+    port = int(parts[1]) if len(parts) > 1 else 4370
+
+    try:
+        fields = user_index.parse_fields(request.args.get('fields'))
+        limit = user_index.parse_limit(request.args.get('limit'))
+        index = user_index.get(f"{host}:{port}", lambda: read_device_users(host, port))
+        page = index.page(request.args.get('q', ''), request.args.get('cursor'), limit, fields)
+    except user_index.InvalidQuery as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e) or 'Failed to connect to ZKTeco device'}), 500
+
+    return serialization.json_response(page)
+
+@app.route('/attendance', methods=['POST'])
+@require_auth
+@compress_response
+def attendance():
+    data = request.json
+    ip = data.get('ip')
+    start_date = data.get('startDate')
+    end_date = data.get('endDate')
+    environment = data.get('environment', 'dev')  # Default to dev if not specified
+    
+    if not ip:
+        return jsonify({'error': 'IP address is required'}), 400
+
+    parts = ip.split(':')
+    host = parts[0]
+    port = int(parts[1]) if len(parts) > 1 else 4370
+
+    trace = g.trace = tracing.start('pull', **{'zk.source': 'attendance', 'zk.device': f"{host}:{port}"})
+    zk = device_zk(host, port)
+    conn = None
+    try:
+        with trace.stage('receive'):
+            conn = zk.connect()
+            corrections = clock_skew.handshake(conn, f"{host}:{port}")
+            users = conn.get_users()
+            data = RecordBatch.read_log(conn)
+        user_map = {str(user.user_id): user.name for user in users}
+        with trace.stage('parse'):
+            batch = RecordBatch.parse(data, conn.records, users) if data else RecordBatch.with_users(users)
+    except Exception as e:
+        trace.end(str(e) or type(e).__name__)
+        return jsonify({'error': str(e) or 'Failed to connect to ZKTeco device'}), 500
+    finally:
+        try:
+            if conn:
+                conn.disconnect()
+        except Exception:
+            pass
+
+    start = datetime.strptime(start_date, "%Y-%m-%d")
+    end = datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1) - timedelta(milliseconds=1)
+
+    # Backend tenant for this device (device registry), else the dev/prod backend from .env
+    tenant = device_registry.current().tenant_for(host, port, environment)
+
+    # Columnar batch: no per-record objects or dicts; upload and response JSON are built from it
+    with trace.stage('dedupe'):
+        batch = batch.filter_range(start, end).dedup()
+        records = batch.to_records()  # device clock: what log rotation finds on the terminal
+        if clock_skew.correct_batch(batch, corrections):
+            daily_summary.record_batch(tenant.name, batch.to_records(), user_map)
+        else:
+            daily_summary.record_batch(tenant.name, records, user_map)
+
+    trace.set(**{'zk.tenant': tenant.name, 'zk.records': len(records)})
+    if tenant.name == 'prod':
+        print(f"Using production backend URL: {tenant.backend_url}")
+
+    # Get tokens from session
+    tokens = session.get('tokens', {})
+    access_token = tokens.get('accessToken') or tokens.get('access_token')
+
+    # Forward to external backend
+    upload_ns = time.time_ns()
+    try:
+        body, upload_headers = serialization.upload_body(batch.to_upload_json(), tenant.headers(access_token))
+        upload_response = circuit_breaker.post(
+            tenant.breaker,
+            tenant.upload_url,
+            session=tenant.session,
+            data=body,
+            headers=upload_headers,
+            timeout=60
+        )
+        
+        upload_response.raise_for_status()
+        upload_result = upload_response.json() if upload_response.content else {'success': True}
+    except Exception as e:
+        trace.span('upload', upload_ns, **{'zk.batch_size': len(records)})
+        trace.end(str(e))
+        return attendance_response(batch, user_map, {
+            'success': False,
+            'error': f'Failed to upload to {tenant.name} backend: {str(e)}',
+            'trace_id': trace.trace_id
+        })
+    trace.span('upload', upload_ns, **{'zk.batch_size': len(records)})
+
+    # Remember what the backend acknowledged so device log rotation can verify against it
+    with trace.stage('ack'):
+        if log_rotation.is_enabled():
+            try:
+                cooperative.offload(attendance_store.mark_acked, f"{host}:{port}", records)
+            except Exception as e:
+                print(f"⚠️  Could not record acknowledged punches: {str(e)}")
+    trace.end()
+
+    return attendance_response(batch, user_map, {
+        'success': True,
+        'result': upload_result,
+        'environment': environment,
+        'tenant': tenant.name,
+        'trace_id': trace.trace_id
+    })
+
+
+def attendance_response(batch, user_map, upload):
+    """/attendance response body; the logs array is serialized straight from the batch"""
+    body = b'{"attendance":{"logs":%s,"userMap":%s},"upload":%s}' % (
+        batch.to_logs_json().encode(), serialization.dumps(user_map), serialization.dumps(upload)
+    )
+    return serialization.json_response(body)
+
+@app.route('/attendance/summary', methods=['GET'])
+@require_auth
+@compress_response
+def attendance_summary():
+    """
+    Daily summaries (first in, last out, worked hours) from daily_summary.py, without
+    reading raw logs. ?start=YYYY-MM-DD&end=YYYY-MM-DD&tenant=&user_id=1,2&cursor=&limit=100
+    &group=user returns per-employee totals for the range instead of one row per day.
+    Summaries are per tenant; without ?tenant= every tenant's are listed.
+    """
+    start = request.args.get('start')
+    end = request.args.get('end')
+    try:
+        datetime.strptime(start or '', '%Y-%m-%d')
+        datetime.strptime(end or '', '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'error': 'start and end are required (YYYY-MM-DD)'}), 400
+    user_ids = [u.strip() for u in request.args.get('user_id', '').split(',') if u.strip()]
+    tenant = request.args.get('tenant')
+
+    if request.args.get('group') == 'user':
+        totals = cooperative.offload(daily_summary.totals, start, end, user_ids, tenant)
+        return serialization.json_response({'totals': totals})
+
+    try:
+        limit = user_index.parse_limit(request.args.get('limit'))
+        cursor = request.args.get('cursor')
+        cursor = user_index.decode_cursor(cursor, parts=3) if cursor else None
+    except user_index.InvalidQuery as e:
+        return jsonify({'error': str(e)}), 400
+    summaries, next_key = cooperative.offload(daily_summary.query, start, end, user_ids, cursor, limit, tenant)
+    return serialization.json_response({
+        'summaries': summaries,
+        'next_cursor': user_index.encode_cursor(next_key) if next_key else None
+    })
+
+@app.route('/attendance/rotate', methods=['POST'])
+@require_admin
+def rotate_attendance_log():
+    """
+    Clear a device's attendance log once every record on it is stored locally and
+    acknowledged by the backend (opt-in: DEVICE_LOG_ROTATION=True). See log_rotation.py.
+    """
+    if not log_rotation.is_enabled():
+        return jsonify({'error': 'Device log rotation is disabled (set DEVICE_LOG_ROTATION=True)'}), 403
+
+    data = request.json
+    ip = data.get('ip')
+    environment = data.get('environment', 'dev')
+    if not ip:
+        return jsonify({'error': 'IP address is required'}), 400
+
+    parts = ip.split(':')
+    host = parts[0]
+    port = int(parts[1]) if len(parts) > 1 else 4370
+
+    tenant = device_registry.current().tenant_for(host, port, environment)
+    tokens = session.get('tokens', {})
+    access_token = tokens.get('accessToken') or tokens.get('access_token')
+    headers = tenant.headers(access_token)
+    # The store and the device log keep device times; the backend gets corrected ones
+    corrections = clock_skew.stored_corrections(f"{host}:{port}")
+
+    def upload(records, user_map):
+        upload_data = attendance_store.to_upload_data(clock_skew.correct_records(records, corrections), user_map)
+        body, upload_headers = serialization.upload_body(upload_data, headers)
+        upload_response = circuit_breaker.post(
+            tenant.breaker,
+            tenant.upload_url,
+            session=tenant.session,
+            data=body,
+            headers=upload_headers,
+            timeout=60
+        )
+        upload_response.raise_for_status()
+
+    try:
+        device = device_registry.current().device(host, port)
+        result = log_rotation.rotate_device_log(host, port, upload, password=device.password if device else 0)
+    except log_rotation.RotationAborted as e:
+        return jsonify({'error': f'Rotation aborted: {str(e)}', 'rotated': False}), 409
+    except Exception as e:
+        return jsonify({'error': str(e) or 'Failed to rotate device log', 'rotated': False}), 500
+
+    result['rotated'] = True
+    result['last_rotation'] = cooperative.offload(attendance_store.last_rotation, result['device'])
+    return jsonify(result)
+
+@app.route('/adms/webhook', methods=['POST', 'GET'])
+@limit_ingest
+def adms_webhook():
+    """
+    ADMS (Push SDK) webhook endpoint to receive real-time attendance data from ZKTeco devices.
+    This endpoint is called automatically by the device when attendance is recorded.
+    No authentication required for device push, but can be secured with API key validation.
+    """
+    # Get current timestamp for logging
+    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    trace = g.trace = tracing.start('punch', **{'zk.source': 'adms', 'zk.device': get_device_id()})
+    
+    # Get API key from environment for device authentication (optional but recommended)
+    adms_api_key = os.getenv('ADMS_API_KEY', '')
+    
+    # Get device IP from request (for logging/validation)
+    device_ip = request.remote_addr
+    device_ip_header = request.headers.get('X-Forwarded-For', device_ip)
+    
+    # Log incoming request
+    print(f"\n{'='*80}")
+    print(f"🔔 [{current_time}] ADMS WEBHOOK - New Request Received")
+    print(f"{'='*80}")
+    print(f"📍 Device IP: {device_ip_header}")
+    print(f"🌐 Method: {request.method}")
+    print(f"🔗 URL: {request.url}")
+    print(f"📋 Headers: {dict(request.headers)}")
+    
+    # Validate API key if configured
+    if adms_api_key:
+        provided_key = request.headers.get('X-API-Key') or request.args.get('api_key')
+        if provided_key != adms_api_key:
+            print(f"❌ Authentication Failed: Invalid API key")
+            print(f"{'='*80}\n")
+            return jsonify({'error': 'Invalid API key'}), 401
+        else:
+            print(f"✅ Authentication: API key validated")
+    else:
+        print(f"⚠️  Authentication: No API key configured (running without authentication)")
+    
+    try:
+        request.get_data()  # read (and cache) the body so 'receive' covers it
+        trace.span('receive', trace.start_ns)
+        parse_ns = time.time_ns()
+        
+        data = punch_parsing.read_adms_payload(request)
+        
+        # Log raw received data
+        print(f"📥 Raw Data Received:")
+        print(f"   {data}")
+        
+        attendance_record = punch_parsing.parse_adms_record(data, datetime.now())
+        
+        trace.span('parse', parse_ns)
+        if not attendance_record:
+            trace.end('invalid data format')
+            # Log the received data for debugging
+            print(f"\n❌ ERROR: Could not parse attendance data")
+            print(f"   Received data structure: {data}")
+            print(f"   Available keys: {list(data.keys()) if isinstance(data, dict) else 'Not a dict'}")
+            print(f"{'='*80}\n")
+            return jsonify({
+                'error': 'Invalid data format',
+                'received': data
+            }), 400
+        
+        # Log parsed attendance record
+        print(f"\n✅ ATTENDANCE RECORD PARSED:")
+        print(f"   👤 User ID: {attendance_record['user_id']}")
+        print(f"   📛 Name: {attendance_record['name']}")
+        print(f"   🕐 Date/Time: {attendance_record['dateTime']}")
+        print(f"   📍 Status: {attendance_record['status']}")
+        
+        trace.punch(attendance_record['user_id'], attendance_record['dateTime'])
+        print(f"   🔗 Trace ID: {trace.trace_id}")
+        
+        # Determine environment (default to dev, can be overridden by device config)
+        environment = data.get('environment', os.getenv('ADMS_DEFAULT_ENV', 'dev'))
+        serial = request.args.get('SN') or data.get('serial') or data.get('SN')
+        tenant = device_registry.resolve(serial=serial, ip=get_client_ip(), environment=environment)
+        print(f"\n🌍 Environment: {environment.upper()} | Tenant: {tenant.name}")
+        trace.set(**{'zk.tenant': tenant.name})
+        
+        placeholder = attendance_record['name'] == f"User {attendance_record['user_id']}"
+        with trace.stage('dedupe'):
+            daily_summary.record_safely(
+                tenant.name,
+                [(attendance_record['user_id'], attendance_record['dateTime'], attendance_record['status'])],
+                None if placeholder else {attendance_record['user_id']: attendance_record['name']}
+            )
+        
+        # Prepare upload data
+        upload_record = {
+            'dateTime': attendance_record['dateTime'],
+            'name': attendance_record['name'],
+            'status': attendance_record['status'],
+            'number': attendance_record['number']
+        }
+        
+        # Shown on the dashboard now; the upload outcome follows separately
+        punch_id = live_feed.publish('adms', device_ip_header, attendance_record['user_id'],
+                                     attendance_record['dateTime'], attendance_record['status'],
+                                     name=attendance_record['name'])
+        
+        def on_uploaded(uploaded, error):
+            if not uploaded:
+                live_feed.upload_failed(punch_id, error)
+            if uploaded:
+                print(f"📤 Uploaded: {attendance_record['name']} (ID: {attendance_record['user_id']}) "
+                      f"at {attendance_record['dateTime']} -> {tenant.name}")
+            else:
+                print(f"❌ Upload failed for {attendance_record['name']} (ID: {attendance_record['user_id']}) "
+                      f"at {attendance_record['dateTime']} -> {tenant.name}: rejected by the backend: {error}")
+        
+        # The tenant's upload worker sends it (batched with other punches for the same
+        # tenant), so a slow backend doesn't hold this request. See upload_batcher.py.
+        # The worker ends the trace once the backend answers.
+        g.pop('trace')
+        if not upload_batcher.submit(tenant.name, upload_record, on_uploaded, trace):
+            trace.end('upload queue full')
+            live_feed.upload_failed(punch_id, 'upload queue full - device will resend')
+            print(f"⏳ Upload queue for tenant '{tenant.name}' is full - asking the device to retry")
+            print(f"{'='*80}\n")
+            return _ingest_unavailable(f"upload queue full for tenant {tenant.name}", 5)
+        
+        print(f"\n📊 SUMMARY:")
+        print(f"   👤 Employee: {attendance_record['name']} (ID: {attendance_record['user_id']})")
+        print(f"   🕐 Time: {attendance_record['dateTime']}")
+        print(f"   📍 Action: {attendance_record['status']}")
+        print(f"   🌍 Tenant: {tenant.name} ({tenant.upload_url})")
+        print(f"   📡 Device IP: {device_ip_header}")
+        print(f"   📤 Upload: queued")
+        print(f"{'='*80}\n")
+        
+        return jsonify({
+            'success': True,
+            'message': 'Attendance recorded successfully, upload queued',
+            'data': attendance_record,
+            'upload': {'queued': True, 'tenant': tenant.name},
+            'trace_id': trace.trace_id
+        }), 200
+            
+    except Exception as e:
+        trace.end(str(e) or type(e).__name__)
+        print(f"\n❌❌❌ CRITICAL ERROR in ADMS Webhook ❌❌❌")
+        print(f"   Error Type: {type(e).__name__}")
+        print(f"   Error Message: {str(e)}")
+        print(f"   Device IP: {device_ip_header}")
+        import traceback
+        print(f"\n📋 Full Traceback:")
+        traceback.print_exc()
+        print(f"{'='*80}\n")
+        return jsonify({
+            'error': 'Internal server error',
+            'message': str(e)
+        }), 500
+
+# ============================================
+# ZKTeco iClock/ADMS Protocol Endpoints
+# ============================================
+# These endpoints use the native ZKTeco iClock protocol
+# Device sends plain text (tab-separated) data, not JSON
+
+@app.route('/iclock/getrequest', methods=['GET'])
+def iclock_getrequest():
+    """
+    Heartbeat endpoint - Device pings this every 30-60 seconds to say "I'm alive"
+    This is the ZKTeco iClock protocol's keep-alive mechanism
+    """
+    # Silent heartbeat - device is just checking in, no need to log every time
+    return "OK"
+
+@app.route('/iclock/cdata', methods=['GET', 'POST'])
+@limit_ingest
+def iclock_cdata():
+    """
+    Data receiver endpoint - This is where punch logs actually arrive
+    Device sends tab-separated plain text data (not JSON)
+    Format: USERID \t TIMESTAMP \t STATUS \t VERIFY \t WORKCODE
+    Only shows real-time data (records from last 5 minutes or after server start)
+    """
+    if request.method == 'POST':
+        # Capture the raw text body from the ZKTeco device
+        received_ns = time.time_ns()
+        raw_data = request.get_data(as_text=True)
+        read_ns = time.time_ns()
+        
+        if raw_data.strip():
+            # Backend tenant for this device (device registry). Built-in dev/prod tenants
+            # only get uploads when their *_BACKEND_URL is set.
+            tenant = device_registry.resolve(serial=request.args.get('SN'), ip=get_client_ip())
+            tenant_batcher = upload_batcher.batcher(tenant.name) if tenant.configured else None
+            
+            device = get_device_id()
+            received = []  # (user_id, timestamp, status) for the daily summaries
+            punches = []  # (trace, user_id, timestamp, status_text, live feed id) to upload
+            for user_id, timestamp, status, parse_ns in punch_parsing.parse_iclock_lines(
+                    raw_data, datetime.now(), SERVER_START_TIME, clock=clock_skew.clock(device)):
+                status_text = 'Check In' if status == '0' else 'Check Out'
+                trace = tracing.start('punch', start_ns=received_ns, **{
+                    'zk.source': 'iclock', 'zk.device': device, 'zk.tenant': tenant.name})
+                trace.span('receive', received_ns, read_ns)
+                trace.span('parse', parse_ns)
+                trace.punch(user_id, timestamp)
+                received.append((user_id, timestamp.isoformat(), status))
+                # Shown on the dashboard now; a failed upload is reported separately
+                punch_id = live_feed.publish('iclock', device, user_id, timestamp.isoformat(), status_text)
+                punches.append((trace, user_id, timestamp.isoformat(), status_text, punch_id))
+            
+            dedupe_ns = time.time_ns()
+            daily_summary.record_safely(tenant.name, received)
+            dedupe_end_ns = time.time_ns()
+            
+            uploads = []  # (upload record, on_done, trace) for the tenant's upload worker
+            for trace, user_id, timestamp, status_text, punch_id in punches:
+                trace.span('dedupe', dedupe_ns, dedupe_end_ns)
+                # Forward to backend if configured; the tenant's upload worker sends it
+                if tenant_batcher:
+                    upload_record = {
+                        'number': user_id,
+                        'dateTime': timestamp,
+                        'status': status_text,
+                        'name': f"User {user_id}"
+                    }
+                    
+                    def on_uploaded(uploaded, error, user_id=user_id, punch_id=punch_id):
+                        if not uploaded:
+                            live_feed.upload_failed(punch_id, error)
+                            print(f"   ⚠️  Backend upload rejected for User ID {user_id}: {error}")
+                    
+                    uploads.append((upload_record, on_uploaded, trace))
+                else:
+                    trace.end()
+            
+            # All of the post is queued (and stored) or none of it: a refused post is
+            # resent whole by the device, so nothing is lost or half-uploaded
+            if uploads and not tenant_batcher.submit_many(uploads):
+                for trace, user_id, timestamp, status_text, punch_id in punches:
+                    live_feed.upload_failed(punch_id, 'upload queue full - device will resend')
+                    trace.end('upload queue full')
+                print(f"⏳ Upload queue for tenant '{tenant.name}' is full - asking the device to retry")
+                return _ingest_unavailable(f"upload queue full for tenant {tenant.name}", 5)
+        
+        # Return "OK" to device to acknowledge receipt
+        return "OK"
+    
+    # Initial setup sometimes sends a GET request
+    return "OK"
+
+@app.route('/live/punches', methods=['GET'])
+@require_auth
+def live_punches():
+    """
+    Server-Sent Events stream of punches received on /adms/webhook and /iclock/cdata.
+    Resumes after the Last-Event-ID header (sent by EventSource on reconnect).
+    """
+    try:
+        last_seen = int(request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0)
+    except ValueError:
+        last_seen = 0
+    if not live_feed.try_join():
+        response = jsonify({'error': 'Too many live feed connections'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '30'
+        return response
+
+    response = Response(live_feed.stream(last_seen), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # don't let proxies buffer the stream
+    response.call_on_close(live_feed.leave)
+    return response
+
+@app.route('/adms/status', methods=['GET'])
+def adms_status():
+    """Health check endpoint for ADMS configuration"""
+    return jsonify({
+        'status': 'active',
+        'endpoints': {
+            'webhook': '/adms/webhook',
+            'iclock_heartbeat': '/iclock/getrequest',
+            'iclock_data': '/iclock/cdata'
+        },
+        'protocols': ['JSON Webhook', 'iClock Protocol'],
+        'api_key_required': bool(os.getenv('ADMS_API_KEY', '')),
+        'default_environment': os.getenv('ADMS_DEFAULT_ENV', 'dev'),
+        'worker_mode': cooperative.mode(),
+        'admission': ingest_admission.snapshot(),
+        'backends': {name: tenant.breaker.snapshot() for name, tenant in device_registry.current().tenants.items()},
+        'tenants': [tenant.describe() for tenant in device_registry.current().tenants.values()],
+        'upload_queues': upload_batcher.snapshot(),
+        'inventory_devices': len(device_registry.current().devices),
+        'pull_scheduler': pull_scheduler.snapshot(),
+        'tracing': tracing.snapshot(),
+        'ingest_journal': ingest_journal.snapshot(),
+        'clock_skew': clock_skew.snapshot(),
+        'live_feed': live_feed.feed.snapshot()
+    }), 200
+
+@app.route('/network/ip', methods=['GET'])
+def get_current_ip():
+    """
+    Get the current local IP address of this computer.
+    Useful when switching networks - shows what IP to configure on the device.
+    """
+    try:
+        # Connect to a remote server to determine local IP
+        # This works even if you're behind NAT
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            # Doesn't actually connect, just determines the local IP
+            s.connect(('8.8.8.8', 80))
+            local_ip = s.getsockname()[0]
+        except Exception:
+            local_ip = '127.0.0.1'
+        finally:
+            s.close()
+        
+        port = int(os.getenv('FLASK_PORT', '5000'))
+        
+        return jsonify({
+            'local_ip': local_ip,
+            'port': port,
+            'server_url': f'http://{local_ip}:{port}',
+            'iclock_heartbeat': f'http://{local_ip}:{port}/iclock/getrequest',
+            'iclock_data': f'http://{local_ip}:{port}/iclock/cdata',
+            'message': f'Configure your device Server Address to: {local_ip}',
+            'note': 'This IP changes when you switch networks. Use ngrok for a permanent URL.'
+        }), 200
+    except Exception as e:
+        return jsonify({
+            'error': 'Failed to get IP address',
+            'message': str(e)
+        }), 500
+
+@app.route('/debug/profile', methods=['POST'])
+@require_admin
+def profile_start():
+    """
+    Start an on-demand profile inside the worker that handles this request.
+    Body: {"mode": "sample" | "cprofile", "seconds": 10, "interval_ms": 10}
+    Returns immediately; fetch the result from result_url once the window ends.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        info = profiler.start_profile(
+            app,
+            mode=data.get('mode', 'sample'),
+            seconds=data.get('seconds', 10),
+            interval_ms=data.get('interval_ms', 10)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
+
+    print(f"🔬 Profiling worker {info['pid']} ({info['mode']}) for {info['seconds']}s - id {info['profile_id']}")
+    info['result_url'] = url_for('profile_result', profile_id=info['profile_id'])
+    return jsonify(info), 202
+
+@app.route('/debug/profile/<profile_id>', methods=['GET'])
+@require_admin
+def profile_result(profile_id):
+    """Download a finished profile (collapsed stacks or pstats dump)"""
+    path, mode = profiler.get_profile_result(profile_id)
+    if not path:
+        return jsonify({'error': 'Profile not found or still running'}), 404
+    if mode == 'sample':
+        return send_file(path, mimetype='text/plain', as_attachment=True, download_name=f"{profile_id}.folded")
+    return send_file(path, mimetype='application/octet-stream', as_attachment=True, download_name=f"{profile_id}.pstats")
+
+@app.route('/exit', methods=['POST'])
+@require_auth
+def exit_app():
+    import threading
+    import time
+    
+    def delayed_exit():
+        time.sleep(0.5)  # Small delay to allow browser to close
+        os._exit(0)
+    
+    # Start delayed exit in a separate thread
+    threading.Thread(target=delayed_exit, daemon=True).start()
+    
+    # Return success response to browser
+    return jsonify({"status": "exiting"}), 200
+
+def get_local_ip():
+    """Get the local IP address of this computer"""
+    try:
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            s.connect(('8.8.8.8', 80))
+            local_ip = s.getsockname()[0]
+        except Exception:
+            local_ip = '127.0.0.1'
+        finally:
+            s.close()
+        return local_ip
+    except Exception:
+        return '127.0.0.1'
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+# template_backup.py
+"""
+Fingerprint template backup and restore, so a replaced terminal doesn't mean
+re-enrolling everyone.
+
+backup: every selected device is read in parallel (--concurrency at a time, one
+session each, opened like /connect does with the device's comm key): its user
+directory and all fingerprint templates, each in one buffered transfer. Templates
+go into the local store (attendance_store.py) content-addressed: under the
+SHA-256 of the raw template, so a person enrolled on ten terminals is stored once,
+and zlib-compressed unless that doesn't make it smaller. Each device's backup is
+replaced by its latest read; a read that comes back empty never replaces a
+non-empty backup (a wiped or swapped terminal).
+
+restore: reads the target's users and templates, and pushes only the fingers it
+is missing or holds a different template for. Users are created if needed (with
+their backed-up name, privilege, card, group and password). Writes go in windows
+like provisioning.py: the device is disabled for --window users at a time and
+refreshed once per window. Each user's write takes several round trips, so the
+window is smaller than provisioning's (TEMPLATE_RESTORE_WINDOW, default 50).
+
+Only fingerprint templates are covered: pyzk has no API for face templates.
+
+Usage:
+    python template_backup.py backup
+    python template_backup.py backup --site HQ --concurrency 16
+    python template_backup.py restore --device 192.168.1.201 --dry-run
+    python template_backup.py restore --device 192.168.1.210 --from 192.168.1.201
+    python template_backup.py status
+"""
+import os
+import sys
+import zlib
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+from zk.user import User
+from zk.finger import Finger
+
+import attendance_store
+import device_registry
+import provisioning
+
+load_dotenv()
+
+COMPRESSION_LEVEL = 9  # templates are written once and read rarely
+
+
+def digest(template):
+    return hashlib.sha256(template).hexdigest()
+
+
+def pack(template):
+    """(compressed, data) as stored: zlib only when it saves space"""
+    data = zlib.compress(template, COMPRESSION_LEVEL)
+    return (1, data) if len(data) < len(template) else (0, template)
+
+
+def unpack(compressed, data):
+    return zlib.decompress(data) if compressed else data
+
+
+def read_device(conn):
+    """
+    Users and templates of a connected device.
+    Returns ({user_id: User}, {(user_id, fid): Finger}); templates of uids without a user are skipped.
+    """
+    users = conn.get_users()
+    by_uid = {user.uid: user for user in users}
+    templates = {}
+    for finger in conn.get_templates():
+        user = by_uid.get(finger.uid)
+        if user is not None:
+            templates[(str(user.user_id), finger.fid)] = finger
+    return {str(user.user_id): user for user in users}, templates
+
+
+def save_backup(device_key, users, templates):
+    """
+    Replace the device's backup with what was just read. Returns (templates, new blobs,
+    bytes stored for the new blobs), or None if an empty read was not allowed to
+    replace a non-empty backup.
+    """
+    now = time.time()
+    # Hash and compress outside the transaction; zlib releases the GIL
+    rows = [(user_id, fid, finger.valid, digest(finger.template), finger.template)
+            for (user_id, fid), finger in templates.items()]
+    blobs = {row[3]: row[4] for row in rows}
+    with attendance_store.transaction() as conn:
+        known = set()
+        digests = list(blobs)
+        for start in range(0, len(digests), 500):
+            chunk = digests[start:start + 500]
+            known.update(d for (d,) in conn.execute(
+                f"SELECT digest FROM template_blobs WHERE digest IN ({','.join('?' * len(chunk))})", chunk))
+    new = {d: pack(template) for d, template in blobs.items() if d not in known}
+
+    with attendance_store.transaction() as conn:
+        if not rows and conn.execute('SELECT 1 FROM template_backups WHERE device = ? LIMIT 1',
+                                     (device_key,)).fetchone():
+            return None
+        conn.executemany(
+            'INSERT OR IGNORE INTO template_blobs (digest, size, compressed, data) VALUES (?, ?, ?, ?)',
+            ((d, len(blobs[d]), compressed, data) for d, (compressed, data) in new.items())
+        )
+        conn.execute('DELETE FROM template_backups WHERE device = ?', (device_key,))
+        conn.executemany(
+            'INSERT INTO template_backups (device, user_id, fid, valid, digest, backed_up_at) VALUES (?, ?, ?, ?, ?, ?)',
+            ((device_key, user_id, fid, valid, d, now) for user_id, fid, valid, d, _ in rows)
+        )
+        enrolled = {user_id for user_id, *_ in rows}
+        conn.execute('DELETE FROM template_users WHERE device = ?', (device_key,))
+        conn.executemany(
+            'INSERT INTO template_users (device, user_id, name, privilege, password, group_id, card) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            ((device_key, user_id, user.name or '', user.privilege, user.password or '', str(user.group_id or ''),
+              int(user.card or 0))
+             for user_id, user in users.items() if user_id in enrolled)
+        )
+    return len(rows), len(new), sum(len(data) for _, data in new.values())
+
+
+def load_backup(device_key):
+    """Backed-up ({user_id: fields}, {(user_id, fid): (valid, digest, template)}) of a device"""
+    with attendance_store.transaction() as conn:
+        users = {
+            user_id: {'name': name, 'privilege': privilege, 'password': password, 'group_id': group_id, 'card': card}
+            for user_id, name, privilege, password, group_id, card in conn.execute(
+                'SELECT user_id, name, privilege, password, group_id, card FROM template_users WHERE device = ?',
+                (device_key,))
+        }
+        rows = conn.execute(
+            'SELECT b.user_id, b.fid, b.valid, b.digest, t.compressed, t.data FROM template_backups b '
+            'JOIN template_blobs t ON t.digest = b.digest WHERE b.device = ?',
+            (device_key,)
+        ).fetchall()
+    templates = {(user_id, fid): (valid, d, unpack(compressed, data))
+                 for user_id, fid, valid, d, compressed, data in rows}
+    return users, templates
+
+
+def plan_restore(backup_users, backup_templates, users, templates):
+    """
+    What to push so a device (current users and templates, as read_device returns them)
+    has every backed-up template. Returns [(User, [Finger])], one entry per user to write.
+    """
+    current = {key: digest(finger.template) for key, finger in templates.items()}
+    missing = {}
+    for (user_id, fid), (valid, d, template) in sorted(backup_templates.items()):
+        if current.get((user_id, fid)) != d:
+            missing.setdefault(user_id, []).append((fid, valid, template))
+
+    used = {user.uid for user in users.values()}
+    free_uids = (uid for uid in range(1, provisioning.MAX_UID + 1) if uid not in used)
+    writes = []
+    for user_id, fingers in missing.items():
+        user = users.get(user_id)
+        if user is None:
+            fields = backup_users.get(user_id) or {'name': '', 'privilege': 0, 'password': '', 'group_id': '',
+                                                   'card': 0}
+            uid = next(free_uids, None)
+            if uid is None:
+                raise provisioning.RosterError('device has no free user slots')
+            user = User(uid, fields['name'], fields['privilege'], fields['password'], fields['group_id'],
+                        user_id, fields['card'])
+        writes.append((user, [Finger(user.uid, fid, valid, template) for fid, valid, template in fingers]))
+    return writes
+
+
+def backup_device(device, args):
+    result = {'device': device.key, 'site': device.site, 'users': 0, 'templates': 0, 'new_blobs': 0,
+              'new_bytes': 0, 'read_seconds': 0.0, 'skipped': False, 'error': None}
+    started = time.monotonic()
+    conn = None
+    try:
+        conn = provisioning.connect(device, args.device_timeout, args.ommit_ping, args.retries)
+        users, templates = read_device(conn)
+        conn.disconnect()
+        conn = None
+        result['read_seconds'] = round(time.monotonic() - started, 2)
+        result['users'] = len({user_id for user_id, _ in templates})
+        saved = save_backup(device.key, users, templates)
+        if saved is None:
+            result['skipped'] = True
+        else:
+            result['templates'], result['new_blobs'], result['new_bytes'] = saved
+    except Exception as e:
+        result['error'] = str(e) or type(e).__name__
+    finally:
+        if conn:
+            try:
+                conn.disconnect()
+            except Exception:
+                pass
+    result['total_seconds'] = round(time.monotonic() - started, 2)
+    return result
+
+
+def restore_device(device, source_key, args):
+    result = {'device': device.key, 'source': source_key, 'users_written': 0, 'users_created': 0,
+              'templates_pushed': 0, 'templates_present': 0, 'failed': 0, 'apply_seconds': 0.0,
+              'longest_disabled_seconds': 0.0, 'error': None}
+    started = time.monotonic()
+    backup_users, backup_templates = load_backup(source_key)
+    if not backup_templates:
+        result['error'] = f"no template backup for {source_key}"
+        return result
+    conn = None
+    try:
+        conn = provisioning.connect(device, args.device_timeout, args.ommit_ping, args.retries)
+        users, templates = read_device(conn)
+        writes = plan_restore(backup_users, backup_templates, users, templates)
+        result['users_written'] = len(writes)
+        result['users_created'] = sum(1 for user, _ in writes if str(user.user_id) not in users)
+        result['templates_pushed'] = sum(len(fingers) for _, fingers in writes)
+        result['templates_present'] = len(backup_templates) - result['templates_pushed']
+        if writes and not args.dry_run:
+            apply_started = time.monotonic()
+            failed, _, disabled_max = provisioning.write_in_windows(
+                conn,
+                [(f"templates of user {user.user_id}", lambda user=user, fingers=fingers:
+                  conn.save_user_template(user, fingers)) for user, fingers in writes],
+                args.window, args.pause
+            )
+            result['failed'] = failed
+            result['apply_seconds'] = round(time.monotonic() - apply_started, 2)
+            result['longest_disabled_seconds'] = round(disabled_max, 2)
+    except Exception as e:
+        result['error'] = str(e) or type(e).__name__
+    finally:
+        if conn:
+            try:
+                conn.disconnect()
+            except Exception:
+                pass
+    result['total_seconds'] = round(time.monotonic() - started, 2)
+    return result
+
+
+def stats():
+    """Backup totals: per device, and stored vs raw template bytes"""
+    with attendance_store.transaction() as conn:
+        devices = conn.execute(
+            'SELECT device, COUNT(DISTINCT user_id), COUNT(*), MAX(backed_up_at) FROM template_backups '
+            'GROUP BY device ORDER BY device'
+        ).fetchall()
+        referenced, raw = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(t.size), 0) FROM template_backups b '
+            'JOIN template_blobs t ON t.digest = b.digest'
+        ).fetchone()
+        blobs, unique, stored = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(data)), 0) FROM template_blobs'
+        ).fetchone()
+    return {
+        'devices': [{'device': device, 'users': users, 'templates': count, 'backed_up_at': backed_up_at}
+                    for device, users, count, backed_up_at in devices],
+        'templates': referenced, 'raw_bytes': raw, 'unique_templates': blobs, 'unique_bytes': unique,
+        'stored_bytes': stored,
+    }
+
+
+def prune_blobs():
+    """Drop templates no device backup refers to any more; returns how many"""
+    with attendance_store.transaction() as conn:
+        return conn.execute(
+            'DELETE FROM template_blobs WHERE digest NOT IN (SELECT digest FROM template_backups)'
+        ).rowcount
+
+
+def select_devices(parser, args):
+    """Inventory devices (with their comm key) for --device / --site, like provisioning.py"""
+    registry = device_registry.current()
+    if args.device:
+        devices = [registry.device(*address) or device_registry.Device(*address)
+                   for address in map(device_registry.parse_address, args.device)]
+    else:
+        devices = registry.ordered
+    if args.site:
+        devices = [device for device in devices if (device.site or '').casefold() == args.site.casefold()]
+    if not devices:
+        parser.error('no devices selected (inventory empty or nothing matches --site)')
+    return devices
+
+
+def run_parallel(task, devices, concurrency, report):
+    results = []
+    lock = threading.Lock()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(task, device) for device in devices]
+        for future in as_completed(futures):
+            result = future.result()
+            with lock:
+                results.append(result)
+                report(result)
+    return results
+
+
+def print_backup(result):
+    if result['error']:
+        print(f"❌ {result['device']}: {result['error']}")
+    elif result['skipped']:
+        print(f"⚠️  {result['device']}: no templates on the device; kept the previous backup")
+    else:
+        print(f"✅ {result['device']}: {result['templates']} templates of {result['users']} users, "
+              f"{result['new_blobs']} new ({result['new_bytes'] / 1024:.1f} KB stored)  "
+              f"read {result['read_seconds']:.1f}s")
+
+
+def print_restore(result, dry_run):
+    if result['error']:
+        print(f"❌ {result['device']}: {result['error']}")
+        return
+    failed = f", {result['failed']} users failed" if result['failed'] else ''
+    print(f"{'🔎' if dry_run else '✅'} {result['device']} (from {result['source']}): "
+          f"{'would push' if dry_run else 'pushed'} {result['templates_pushed']} templates for "
+          f"{result['users_written']} users ({result['users_created']} new), "
+          f"{result['templates_present']} already there{failed}  apply {result['apply_seconds']:.1f}s "
+          f"(longest disabled {result['longest_disabled_seconds']:.1f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['backup', 'restore', 'status'])
+    parser.add_argument('--device', action='append', help='ip or ip:port (repeatable, default: every device in the inventory)')
+    parser.add_argument('--site', help='only inventory devices at this site')
+    parser.add_argument('--from', dest='source', help='restore: device whose backup to use (default: the target itself)')
+    parser.add_argument('--dry-run', action='store_true', help='restore: compare only, write nothing')
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv('TEMPLATE_BACKUP_CONCURRENCY', '8')))
+    parser.add_argument('--window', type=int, default=int(os.getenv('TEMPLATE_RESTORE_WINDOW', '50')),
+                        help='restore: users written per stretch the device is disabled for')
+    parser.add_argument('--pause', type=float, default=float(os.getenv('PROVISION_PAUSE', '0.5')),
+                        help='restore: seconds a device stays enabled between windows')
+    parser.add_argument('--retries', type=int, default=3, help='connection attempts per device')
+    parser.add_argument('--device-timeout', type=int, default=60)
+    parser.add_argument('--ommit-ping', action='store_true', help='skip the ping check before connecting')
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        summary = stats()
+        for row in summary['devices']:
+            print(f"{row['device']:<24} {row['users']:>6} users {row['templates']:>7} templates  "
+                  f"backed up {time.strftime('%Y-%m-%d %H:%M', time.localtime(row['backed_up_at']))}")
+        raw, stored = summary['raw_bytes'], summary['stored_bytes']
+        print(f"\n📦 {summary['templates']:,} templates ({raw / 1024 / 1024:.1f} MB) stored as "
+              f"{summary['unique_templates']:,} unique ({stored / 1024 / 1024:.1f} MB compressed"
+              f"{f', {raw / stored:.1f}x smaller' if stored else ''})")
+        return 0
+
+    devices = select_devices(parser, args)
+    started = time.monotonic()
+    if args.command == 'backup':
+        print(f"🧬 Backing up templates of {len(devices)} devices, {args.concurrency} at a time")
+        results = run_parallel(lambda device: backup_device(device, args), devices, args.concurrency, print_backup)
+        pruned = prune_blobs()
+        templates = sum(r['templates'] for r in results)
+        print(f"\n📊 {sum(1 for r in results if not r['error'])}/{len(results)} devices, {templates:,} templates, "
+              f"{sum(r['new_blobs'] for r in results):,} new in {time.monotonic() - started:.1f}s"
+              f"{f'; {pruned} unreferenced templates dropped' if pruned else ''}")
+    else:
+        if args.source and len(devices) > 1:
+            parser.error('--from restores one backup onto one --device')
+        source = device_registry.Device(*device_registry.parse_address(args.source)).key if args.source else None
+        print(f"🧬 Restoring templates to {len(devices)} devices{' (dry run)' if args.dry_run else ''}")
+        results = run_parallel(lambda device: restore_device(device, source or device.key, args), devices,
+                               args.concurrency, lambda result: print_restore(result, args.dry_run))
+        print(f"\n📊 {sum(r['templates_pushed'] for r in results):,} templates "
+              f"{'to push' if args.dry_run else 'pushed'} in {time.monotonic() - started:.1f}s")
+    return 1 if any(r['error'] or r.get('failed') for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
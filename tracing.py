@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+# tracing.py
+"""
+End-to-end punch tracing, from receipt at the server to the backend's
+acknowledgement.
+
+Every pushed punch (/iclock/cdata, /adms/webhook) and every pulled batch
+(/attendance, pull_scheduler.py) gets a correlation ID (its trace ID) and, when
+sampled, timestamped spans for the stages it went through:
+
+    receive   request body read, or attendance log transferred from the device
+    parse     punch line / webhook body / attendance log decoded
+    dedupe    recorded in the local store and daily summaries (duplicates dropped)
+    enqueue   waiting in the tenant's upload queue (pushes), or picked for upload (pulls)
+    upload    POST to the tenant's backend
+    ack       backend acknowledgement handled (live feed, acked in the store)
+
+Pushed punches also carry zk.device_lag_ms: how long after the punch time (device
+clock) the server received it, i.e. the device's push interval plus clock skew.
+
+Traces are appended to TRACE_FILE as OTLP/JSON, one ExportTraceServiceRequest per
+line. That is what the OpenTelemetry Collector's file exporter writes and its
+otlpjsonfile receiver reads, so the file can be shipped to Jaeger, Tempo etc. as
+is. Tracing is off unless TRACE_FILE is set. TRACE_SAMPLE_RATE (0-1) is the share
+of traces written; unsampled punches still get an ID and cost a few clock reads.
+A background thread writes finished traces, so requests never wait on the file.
+
+Usage (end-to-end latency percentiles per device):
+    python tracing.py report
+    python tracing.py report --file traces.jsonl traces.jsonl.1 --source iclock
+"""
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import socket
+import argparse
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+import serialization
+
+STAGES = ('receive', 'parse', 'dedupe', 'enqueue', 'upload', 'ack')
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+class Trace:
+    """One punch or pulled batch. Spans are only kept when the trace is sampled."""
+
+    __slots__ = ('trace_id', 'name', 'kind', 'start_ns', 'attributes', 'spans', 'sampled', 'ended')
+
+    def __init__(self, name, sampled, kind=SPAN_KIND_SERVER, start_ns=None, attributes=None):
+        self.trace_id = '%032x' % random.getrandbits(128)
+        self.name = name
+        self.kind = kind
+        self.sampled = sampled
+        self.start_ns = start_ns or time.time_ns()
+        self.attributes = attributes or {}
+        self.spans = []
+        self.ended = False
+
+    def set(self, **attributes):
+        if self.sampled:
+            self.attributes.update(attributes)
+
+    def punch(self, user_id, punch_time):
+        """Note the punch this trace follows; punch_time is device local time (datetime or ISO)"""
+        if self.sampled:
+            if isinstance(punch_time, str):
+                punch_time = datetime.fromisoformat(punch_time)
+            self.attributes.update({
+                'zk.user_id': str(user_id),
+                'zk.punch_time': punch_time.isoformat(),
+                'zk.device_lag_ms': round(self.start_ns / 1e6 - punch_time.timestamp() * 1000),
+            })
+
+    def span(self, name, start_ns, end_ns=None, **attributes):
+        """Record a finished stage; times are time.time_ns(), end defaults to now"""
+        if self.sampled:
+            self.spans.append((name, start_ns, end_ns or time.time_ns(), attributes))
+
+    @contextmanager
+    def stage(self, name, **attributes):
+        start_ns = time.time_ns()
+        try:
+            yield
+        finally:
+            self.span(name, start_ns, **attributes)
+
+    def end(self, error=None):
+        """Close the trace (once); a sampled trace is queued for the trace file"""
+        if self.ended:
+            return
+        self.ended = True
+        if self.sampled:
+            writer().put(self, error, time.time_ns())
+
+
+def _settings():
+    global _config
+    if _config is None:
+        _config = (
+            os.getenv('TRACE_FILE', ''),
+            float(os.getenv('TRACE_SAMPLE_RATE', '1.0')),
+            int(float(os.getenv('TRACE_MAX_MB', '100')) * 1024 * 1024),
+        )
+    return _config
+
+
+_config = None
+
+
+def is_enabled():
+    path, rate, _ = _settings()
+    return bool(path) and rate > 0
+
+
+def start(name, kind=SPAN_KIND_SERVER, start_ns=None, **attributes):
+    """
+    New trace, sampled at TRACE_SAMPLE_RATE. Attribute names use dots
+    (zk.device, zk.source), so pass them with start(..., **{'zk.device': ...}).
+    """
+    path, rate, _ = _settings()
+    sampled = bool(path) and (rate >= 1 or random.random() < rate)
+    return Trace(name, sampled, kind, start_ns, attributes)
+
+
+def _attributes(values):
+    attributes = []
+    for key, value in values.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            value = {'boolValue': value}
+        elif isinstance(value, int):
+            value = {'intValue': str(value)}
+        elif isinstance(value, float):
+            value = {'doubleValue': value}
+        else:
+            value = {'stringValue': str(value)}
+        attributes.append({'key': key, 'value': value})
+    return attributes
+
+
+RESOURCE = {'attributes': _attributes({
+    'service.name': 'zk-sync',
+    'host.name': socket.gethostname(),
+    'process.pid': os.getpid(),
+})}
+
+
+def to_otlp(trace, error, end_ns):
+    """A finished trace as an OTLP/JSON ExportTraceServiceRequest"""
+    root_id = '%016x' % random.getrandbits(64)
+    spans = [{
+        'traceId': trace.trace_id,
+        'spanId': root_id,
+        'name': trace.name,
+        'kind': trace.kind,
+        'startTimeUnixNano': str(trace.start_ns),
+        'endTimeUnixNano': str(end_ns),
+        'attributes': _attributes(trace.attributes),
+        'status': {'code': STATUS_ERROR, 'message': str(error)} if error else {'code': STATUS_OK},
+    }]
+    for name, start_ns, stage_end_ns, attributes in trace.spans:
+        spans.append({
+            'traceId': trace.trace_id,
+            'spanId': '%016x' % random.getrandbits(64),
+            'parentSpanId': root_id,
+            'name': name,
+            'kind': SPAN_KIND_INTERNAL,
+            'startTimeUnixNano': str(start_ns),
+            'endTimeUnixNano': str(stage_end_ns),
+            'attributes': _attributes(attributes),
+        })
+    return {'resourceSpans': [{
+        'resource': RESOURCE,
+        'scopeSpans': [{'scope': {'name': 'zk-sync.tracing'}, 'spans': spans}],
+    }]}
+
+
+class TraceWriter:
+    """Appends finished traces to the trace file from a background thread"""
+
+    def __init__(self, path, max_bytes, max_queue=10000, interval=0.5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, name='trace-writer', daemon=True)
+        self.thread.start()
+
+    def put(self, trace, error, end_ns):
+        try:
+            self.queue.put_nowait((trace, error, end_ns))
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def _run(self):
+        while True:
+            items = [self.queue.get()]
+            time.sleep(self.interval)  # let more traces pile up: one file write per batch
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(b''.join(serialization.dumps(to_otlp(*item)) + b'\n' for item in items), len(items))
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+
+    def _write(self, data, count):
+        try:
+            # The file is reopened per batch, so several workers can share it and
+            # rotation by any of them is picked up by the others
+            if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) + len(data) > self.max_bytes:
+                os.replace(self.path, self.path + '.1')
+            with open(self.path, 'ab') as f:
+                f.write(data)
+        except OSError as e:
+            print(f"⚠️  Could not write traces to {self.path}: {e}")
+            with self.lock:
+                self.dropped += count
+            return
+        with self.lock:
+            self.written += count
+
+    def flush(self, timeout):
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def snapshot(self):
+        with self.lock:
+            return {'written': self.written, 'dropped': self.dropped, 'pending': self.queue.qsize()}
+
+
+_writer = None
+_lock = threading.Lock()
+
+
+def writer():
+    """The process's trace writer, started on first use"""
+    global _writer
+    with _lock:
+        if _writer is None:
+            path, _, max_bytes = _settings()
+            _writer = TraceWriter(path, max_bytes)
+        return _writer
+
+
+def snapshot():
+    path, rate, _ = _settings()
+    if not is_enabled():
+        return {'enabled': False}
+    with _lock:
+        counters = _writer.snapshot() if _writer else {'written': 0, 'dropped': 0, 'pending': 0}
+    return {'enabled': True, 'file': path, 'sample_rate': rate, **counters}
+
+
+@atexit.register
+def _flush_at_exit():
+    with _lock:
+        trace_writer = _writer
+    if trace_writer:
+        trace_writer.flush(2)
+
+
+# ---------------------------------------------------------------------------
+# Report
+# ---------------------------------------------------------------------------
+
+def _attribute_values(attributes):
+    return {a['key']: next(iter(a['value'].values())) for a in attributes or []}
+
+
+def read_traces(paths):
+    """{trace_id: {'root': span, 'stages': {name: total_ms}}} from OTLP/JSON files"""
+    traces = {}
+    for path in paths:
+        with open(path, 'rb') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by a crash
+                for resource_spans in request.get('resourceSpans', []):
+                    for scope_spans in resource_spans.get('scopeSpans', []):
+                        for span in scope_spans.get('spans', []):
+                            trace = traces.setdefault(span['traceId'], {'root': None, 'stages': {}})
+                            duration = (int(span['endTimeUnixNano']) - int(span['startTimeUnixNano'])) / 1e6
+                            if span.get('parentSpanId'):
+                                trace['stages'][span['name']] = trace['stages'].get(span['name'], 0) + duration
+                            else:
+                                trace['root'] = dict(_attribute_values(span.get('attributes')), duration_ms=duration,
+                                                     error=span.get('status', {}).get('code') == STATUS_ERROR)
+    return [trace for trace in traces.values() if trace['root']]
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def _ms(value):
+    return f"{value:9.1f}" if value is not None else f"{'-':>9}"
+
+
+def report(traces, source=None):
+    by_device = {}
+    for trace in traces:
+        root = trace['root']
+        if source and root.get('zk.source') != source:
+            continue
+        by_device.setdefault((root.get('zk.device', 'unknown'), root.get('zk.source', '')), []).append(trace)
+
+    if not by_device:
+        print("No traces found")
+        return
+
+    print(f"{'device':<28} {'source':<10} {'traces':>7} {'errors':>6} {'p50 ms':>9} {'p90 ms':>9} "
+          f"{'p99 ms':>9} {'max ms':>9}  {'device lag p50 s':>16}")
+    for (device, trace_source), device_traces in sorted(by_device.items()):
+        latencies = sorted(t['root']['duration_ms'] for t in device_traces)
+        lags = sorted(float(t['root']['zk.device_lag_ms']) for t in device_traces if 'zk.device_lag_ms' in t['root'])
+        errors = sum(1 for t in device_traces if t['root']['error'])
+        lag = percentile(lags, 0.5)
+        lag_text = f"{lag / 1000:16.1f}" if lag is not None else f"{'-':>16}"
+        print(f"{device:<28} {trace_source:<10} {len(latencies):>7} {errors:>6} {_ms(percentile(latencies, 0.5))} "
+              f"{_ms(percentile(latencies, 0.9))} {_ms(percentile(latencies, 0.99))} {_ms(latencies[-1])}  {lag_text}")
+
+    print(f"\np50 ms per stage")
+    print(f"{'device':<28} {'source':<10} " + ' '.join(f"{stage:>9}" for stage in STAGES))
+    for (device, trace_source), device_traces in sorted(by_device.items()):
+        cells = []
+        for stage in STAGES:
+            durations = sorted(t['stages'][stage] for t in device_traces if stage in t['stages'])
+            cells.append(_ms(percentile(durations, 0.5)))
+        print(f"{device:<28} {trace_source:<10} " + ' '.join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['report'])
+    parser.add_argument('--file', nargs='+', help='trace files (default: TRACE_FILE and its rotated .1)')
+    parser.add_argument('--source', choices=['iclock', 'adms', 'attendance', 'pull'], help='only this ingest path')
+    args = parser.parse_args()
+    load_dotenv()
+
+    paths = args.file
+    if not paths:
+        path = os.getenv('TRACE_FILE', '')
+        if not path:
+            parser.error('no trace file (set TRACE_FILE or pass --file)')
+        paths = [p for p in (path + '.1', path) if os.path.exists(p)]
+    report(read_traces(paths), args.source)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,319 @@
+# upload_batcher.py
+"""
+Per-tenant upload queues for pushed punches (/iclock/cdata, /adms/webhook).
+
+Pushed punches used to be uploaded one request at a time from the request
+thread, so a slow backend held ingest threads and delayed every other tenant.
+Now each tenant (device_registry.py) has its own bounded queue and worker
+thread. A worker sends up to UPLOAD_BATCH_SIZE punches in one POST, waiting at
+most UPLOAD_BATCH_WAIT_MS for a batch to fill, through the tenant's own
+connection pool and circuit breaker. A slow or failing tenant only backs up
+its own queue; once that is full (UPLOAD_QUEUE_SIZE) submit() refuses and the
+ingest route tells the device to retry later.
+
+The device is told OK once its punches are queued, so the queue is durable:
+- submit_many() queues all of a post's punches or none of them, and writes them
+  to the local store (attendance_store.py, upload_queue) before returning.
+- A batch that fails is retried with backoff (up to UPLOAD_RETRY_MAX_SECONDS
+  apart) until the backend takes it. Only a 4xx answer (other than 408/429),
+  i.e. the backend rejecting the punches themselves, ends it as failed.
+- Rows are deleted once their batch is done. Each process renews its claim on
+  the rows it holds every LEASE_SECONDS / 3; rows of a process that exited or
+  died are taken over by the tenant's worker in another (or the next) process.
+
+Delivery is at least once: a batch the backend took but whose answer was lost,
+or one in flight when the process died, is sent again.
+"""
+import os
+import json
+import time
+import uuid
+import queue
+import atexit
+import socket
+import threading
+
+import requests
+
+import tracing  # imported first so its exit flush runs after ours (atexit is LIFO)
+import cooperative
+import serialization
+import circuit_breaker
+import device_registry
+import attendance_store
+
+LEASE_SECONDS = 60  # rows whose holder stopped renewing for this long are taken over
+
+
+def _retryable(error):
+    """Whether a failed upload may succeed later (anything but the backend rejecting the batch)"""
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status >= 500 or status in (408, 429)
+    return True
+
+
+class TenantBatcher:
+    def __init__(self, tenant_name, batch_size=50, wait=0.2, max_queue=1000, timeout=10.0, max_retry_delay=300.0):
+        self.tenant_name = tenant_name
+        self.batch_size = batch_size
+        self.wait = wait
+        self.timeout = timeout
+        self.max_retry_delay = max_retry_delay
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.capacity = max_queue  # queued plus in flight (being sent or retried)
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.counters = {'queued': 0, 'uploaded': 0, 'failed': 0, 'rejected': 0, 'batches': 0,
+                         'retries': 0, 'recovered': 0}
+        self.last_error = None
+        self.next_renewal = 0.0
+        self.worker = threading.Thread(target=self._run, name=f'upload-{tenant_name}', daemon=True)
+        self.worker.start()
+
+    @classmethod
+    def from_env(cls, tenant_name):
+        return cls(
+            tenant_name,
+            batch_size=int(os.getenv('UPLOAD_BATCH_SIZE', '50')),
+            wait=float(os.getenv('UPLOAD_BATCH_WAIT_MS', '200')) / 1000,
+            max_queue=int(os.getenv('UPLOAD_QUEUE_SIZE', '1000')),
+            timeout=float(os.getenv('UPLOAD_TIMEOUT', '10')),
+            max_retry_delay=float(os.getenv('UPLOAD_RETRY_MAX_SECONDS', '300')),
+        )
+
+    def submit_many(self, items):
+        """
+        Queue upload records ({'dateTime', 'name', 'status', 'number'}), given as
+        (record, on_done, trace) tuples, all or none.
+        on_done(uploaded, error) is called from the worker once the punch is uploaded
+        or rejected by the backend. A trace (tracing.py) gets enqueue/upload/ack spans
+        and is ended after on_done.
+        Returns False, queuing nothing, if the queue lacks room or the store write fails.
+        """
+        with self.lock:
+            if self.queue.unfinished_tasks + len(items) > self.capacity:
+                self.counters['rejected'] += len(items)
+                return False
+            try:
+                row_ids = cooperative.offload(self._store, [record for record, _, _ in items])
+            except Exception as e:
+                print(f"⚠️  Could not store {len(items)} punches for tenant '{self.tenant_name}': {e}")
+                self.counters['rejected'] += len(items)
+                return False
+            queued_ns = time.time_ns()
+            for row_id, (record, on_done, trace) in zip(row_ids, items):
+                self.queue.put_nowait((row_id, record, on_done, trace, queued_ns))
+            self.counters['queued'] += len(items)
+        return True
+
+    def submit(self, record, on_done=None, trace=None):
+        """Queue one upload record; see submit_many()"""
+        return self.submit_many([(record, on_done, trace)])
+
+    # -- local store ---------------------------------------------------------
+
+    def _store(self, records):
+        now = time.time()
+        with attendance_store.transaction() as conn:
+            return [
+                conn.execute(
+                    'INSERT INTO upload_queue (tenant, record, queued_at, owner, claimed_at) VALUES (?, ?, ?, ?, ?)',
+                    (self.tenant_name, json.dumps(record), now, self.owner, now)
+                ).lastrowid
+                for record in records
+            ]
+
+    def _remove(self, row_ids):
+        with attendance_store.transaction() as conn:
+            conn.executemany('DELETE FROM upload_queue WHERE id = ?', [(row_id,) for row_id in row_ids])
+
+    def _claim(self, now, room):
+        with attendance_store.transaction() as conn:
+            conn.execute('UPDATE upload_queue SET claimed_at = ? WHERE owner = ?', (now, self.owner))
+            if room <= 0:
+                return []
+            return conn.execute(
+                'UPDATE upload_queue SET owner = ?, claimed_at = ? WHERE id IN ('
+                'SELECT id FROM upload_queue WHERE tenant = ? AND claimed_at < ? ORDER BY id LIMIT ?'
+                ') RETURNING id, record',
+                (self.owner, now, self.tenant_name, now - LEASE_SECONDS, room)
+            ).fetchall()
+
+    def _renew(self):
+        """Keep our claim on the rows we hold, and take over this tenant's abandoned ones"""
+        with self.lock:
+            rows = cooperative.offload(self._claim, time.time(), self.capacity - self.queue.unfinished_tasks)
+            queued_ns = time.time_ns()
+            for row_id, record in sorted(rows):
+                self.queue.put_nowait((row_id, json.loads(record), None, None, queued_ns))
+            self.counters['recovered'] += len(rows)
+        if rows:
+            print(f"📥 Took over {len(rows)} queued punches for tenant '{self.tenant_name}'")
+        self.next_renewal = time.monotonic() + LEASE_SECONDS / 3
+
+    def _renew_if_due(self):
+        if time.monotonic() >= self.next_renewal:
+            try:
+                self._renew()
+            except Exception as e:
+                print(f"⚠️  Could not renew the upload queue of tenant '{self.tenant_name}': {e}")
+                self.next_renewal = time.monotonic() + 5
+
+    # -- worker --------------------------------------------------------------
+
+    def _next_batch(self):
+        try:
+            batch = [self.queue.get(timeout=max(self.next_renewal - time.monotonic(), 0.01))]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            self._renew_if_due()
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                self._deliver(batch, time.time_ns())
+            except Exception as e:
+                print(f"⚠️  Upload worker for tenant '{self.tenant_name}' failed: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _send(self, batch):
+        tenant = device_registry.tenant(self.tenant_name)
+        if tenant is None:
+            raise LookupError(f"tenant '{self.tenant_name}' is no longer in the device registry")
+        body, headers = serialization.upload_body([record for _, record, *_ in batch], tenant.headers())
+        response = circuit_breaker.post(tenant.breaker, tenant.upload_url, session=tenant.session,
+                                        data=body, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+
+    def _deliver(self, batch, taken_ns):
+        """Send a batch until the backend takes or rejects it, then settle it"""
+        upload_ns = time.time_ns()
+        attempts, delay = 0, 1.0
+        while True:
+            attempts += 1
+            try:
+                self._send(batch)
+                error = None
+                break
+            except Exception as e:
+                error = str(e)
+                with self.lock:
+                    self.last_error = error
+                if not _retryable(e):
+                    print(f"❌ Upload of {len(batch)} punches to tenant '{self.tenant_name}' rejected: {error}")
+                    break
+            print(f"⚠️  Upload of {len(batch)} punches to tenant '{self.tenant_name}' failed: {error} "
+                  f"(retrying in {delay:.0f}s)")
+            with self.lock:
+                self.counters['retries'] += 1
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+            self._renew_if_due()
+        uploaded_ns = time.time_ns()
+
+        try:
+            cooperative.offload(self._remove, [row_id for row_id, *_ in batch])
+        except Exception as e:
+            print(f"⚠️  Could not remove {len(batch)} sent punches from the upload queue: {e}")
+        with self.lock:
+            self.counters['batches'] += 1
+            self.counters['failed' if error else 'uploaded'] += len(batch)
+        for _, _, on_done, trace, queued_ns in batch:
+            ack_ns = time.time_ns()
+            if on_done:
+                try:
+                    on_done(error is None, error)
+                except Exception as e:
+                    print(f"⚠️  Upload callback failed: {e}")
+            if trace:
+                trace.span('enqueue', queued_ns, taken_ns)
+                trace.span('upload', upload_ns, uploaded_ns, **{'zk.batch_size': len(batch), 'zk.attempts': attempts})
+                trace.span('ack', ack_ns)
+                trace.end(error)
+
+    def flush(self, timeout):
+        """Wait up to `timeout` seconds for the queue to drain"""
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def release(self):
+        """Let another process take over our stored rows right away (at exit)"""
+        with attendance_store.transaction() as conn:
+            conn.execute('UPDATE upload_queue SET claimed_at = 0 WHERE owner = ?', (self.owner,))
+
+    def snapshot(self):
+        with self.lock:
+            return {'pending': self.queue.unfinished_tasks, 'capacity': self.capacity,
+                    'last_error': self.last_error, **self.counters}
+
+
+_batchers = {}
+_lock = threading.Lock()
+
+
+def batcher(tenant_name):
+    """The tenant's batcher, started on first use"""
+    with _lock:
+        tenant_batcher = _batchers.get(tenant_name)
+        if tenant_batcher is None:
+            tenant_batcher = _batchers[tenant_name] = TenantBatcher.from_env(tenant_name)
+        return tenant_batcher
+
+
+def submit(tenant_name, record, on_done=None, trace=None):
+    return batcher(tenant_name).submit(record, on_done, trace)
+
+
+def resume():
+    """Start the batchers of tenants with stored punches, so they are sent without waiting for a push"""
+    try:
+        with attendance_store.transaction() as conn:
+            tenant_names = [name for (name,) in conn.execute('SELECT DISTINCT tenant FROM upload_queue')]
+    except Exception as e:
+        print(f"⚠️  Could not read the stored upload queue: {e}")
+        return
+    for tenant_name in tenant_names:
+        batcher(tenant_name)
+
+
+def snapshot():
+    with _lock:
+        batchers = list(_batchers.items())
+    return {name: tenant_batcher.snapshot() for name, tenant_batcher in batchers}
+
+
+def flush(timeout):
+    """Wait up to `timeout` seconds per tenant for the queues to drain"""
+    with _lock:
+        batchers = list(_batchers.values())
+    for tenant_batcher in batchers:
+        tenant_batcher.flush(timeout)
+
+
+@atexit.register
+def _flush_at_exit():
+    flush(float(os.getenv('UPLOAD_FLUSH_SECONDS', '5')))
+    with _lock:
+        batchers = list(_batchers.values())
+    for tenant_batcher in batchers:
+        if not tenant_batcher.queue.unfinished_tasks:
+            continue  # everything sent: no stored rows to hand over
+        try:
+            tenant_batcher.release()
+        except Exception as e:
+            print(f"⚠️  Could not release the upload queue of tenant '{tenant_batcher.tenant_name}': {e}")
@@ -0,0 +1,160 @@
+# user_index.py
+"""
+Per-device user directory with cursor pagination, prefix search and projection.
+
+/connect used to return every enrolled user (passwords included) in one array.
+Instead, the directory read from the device is cached per device and indexed
+twice: by (name, user_id) for ordering and name-prefix search, and by user_id
+for user_id-prefix search. Pages are served from the index, so a response holds
+at most `limit` users no matter how big the terminal is.
+
+Cursors are opaque, but they encode the sort key of the last row rather than a
+position. A rebuilt index therefore continues after the same user.
+"""
+import os
+import json
+import time
+import base64
+import heapq
+import threading
+from bisect import bisect_left, bisect_right
+
+# Fields a client may ask for; password is never served
+FIELDS = ('uid', 'user_id', 'name', 'privilege', 'group_id', 'card')
+DEFAULT_FIELDS = ('uid', 'user_id', 'name', 'privilege')
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+
+
+class InvalidQuery(ValueError):
+    """Bad cursor, field or limit in a user query"""
+
+
+class UserIndex:
+    def __init__(self, users):
+        rows = [{
+            'uid': user.uid,
+            'user_id': str(user.user_id),
+            'name': user.name or '',
+            'privilege': user.privilege,
+            'group_id': user.group_id,
+            'card': user.card,
+        } for user in users]
+        rows.sort(key=lambda r: (r['name'].casefold(), r['user_id']))
+        self.rows = rows
+        self.keys = [(r['name'].casefold(), r['user_id']) for r in rows]
+        # (user_id, position in rows) for user_id prefix search
+        self.by_user_id = sorted((r['user_id'], i) for i, r in enumerate(rows))
+        self.built_at = time.time()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _name_range(self, prefix):
+        lo = bisect_left(self.keys, (prefix,))
+        hi = bisect_left(self.keys, (prefix + '\U0010ffff',))
+        return lo, hi
+
+    def _user_id_positions(self, prefix):
+        lo = bisect_left(self.by_user_id, (prefix,))
+        hi = bisect_left(self.by_user_id, (prefix + '\U0010ffff',))
+        return [pos for _, pos in self.by_user_id[lo:hi]]
+
+    def page(self, q='', cursor=None, limit=DEFAULT_LIMIT, fields=DEFAULT_FIELDS):
+        """
+        One page of users ordered by name. q matches a prefix of the name
+        (case-insensitive) or of the user_id.
+        Returns {'users', 'total', 'next_cursor'}.
+        """
+        start = bisect_right(self.keys, decode_cursor(cursor)) if cursor else 0
+        q = (q or '').strip()
+
+        if not q:
+            positions = range(start, min(start + limit, len(self.rows)))
+            total = len(self.rows)
+            has_more = start + limit < len(self.rows)
+        else:
+            name_lo, name_hi = self._name_range(q.casefold())
+            id_positions = [p for p in self._user_id_positions(q) if not name_lo <= p < name_hi]
+            total = (name_hi - name_lo) + len(id_positions)
+            first = max(start, name_lo)
+            from_names = range(first, min(first + limit, name_hi))
+            from_ids = heapq.nsmallest(limit, (p for p in id_positions if p >= start))
+            positions = heapq.nsmallest(limit, list(from_names) + from_ids)
+            has_more = False
+            if positions:
+                last = positions[-1]
+                has_more = name_hi > max(last + 1, name_lo) or any(p > last for p in id_positions)
+
+        users = [{f: self.rows[p][f] for f in fields} for p in positions]
+        next_cursor = encode_cursor(self.keys[positions[-1]]) if has_more and positions else None
+        return {'users': users, 'total': total, 'next_cursor': next_cursor}
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, parts=2):
+    """encode_cursor() output -> the sort key (`parts` strings) it was made from"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise InvalidQuery('Invalid cursor')
+    if not isinstance(key, list) or len(key) != parts:
+        raise InvalidQuery('Invalid cursor')
+    return tuple(str(part) for part in key)
+
+
+def parse_fields(value):
+    """'user_id,name' -> ('user_id', 'name'); empty means DEFAULT_FIELDS"""
+    if not value:
+        return DEFAULT_FIELDS
+    fields = tuple(f.strip() for f in value.split(',') if f.strip())
+    unknown = [f for f in fields if f not in FIELDS]
+    if unknown:
+        raise InvalidQuery(f"Unknown fields: {', '.join(unknown)} (allowed: {', '.join(FIELDS)})")
+    return fields
+
+
+def parse_limit(value):
+    try:
+        limit = int(value) if value not in (None, '') else DEFAULT_LIMIT
+    except ValueError:
+        raise InvalidQuery('limit must be a number')
+    return max(1, min(limit, MAX_LIMIT))
+
+
+_indexes = {}
+_locks = {}
+_lock = threading.Lock()
+
+
+def cache_ttl():
+    return float(os.getenv('USER_INDEX_TTL', '300'))
+
+
+def store(device, users):
+    """Index a freshly read directory (e.g. from /connect) and cache it"""
+    index = UserIndex(users)
+    with _lock:
+        _indexes[device] = index
+    return index
+
+
+def get(device, load_users):
+    """
+    Cached index for device, rebuilt with load_users() once it's older than
+    USER_INDEX_TTL seconds. Concurrent misses for one device share one device read.
+    """
+    with _lock:
+        index = _indexes.get(device)
+        if index and time.time() - index.built_at < cache_ttl():
+            return index
+        device_lock = _locks.setdefault(device, threading.Lock())
+    with device_lock:
+        with _lock:
+            index = _indexes.get(device)
+        if index and time.time() - index.built_at < cache_ttl():
+            return index
+        return store(device, load_users())
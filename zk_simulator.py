@@ -0,0 +1,551 @@
+#!/usr/bin/env python3
+# zk_simulator.py
+"""
+Local stand-in for a ZKTeco terminal that speaks the pyzk wire protocol.
+
+Serves TCP and UDP on the same port (4370 by default) with a configurable number
+of users, fingerprint templates and attendance records, so /connect, /attendance,
+zk_utils.fetch_attendance, provisioning.py and template_backup.py can be exercised
+and benchmarked without hardware.
+
+Like the real terminals it only allows one session at a time: a second
+CMD_CONNECT while another client holds the session gets CMD_ACK_ERROR.
+
+Usage:
+    python zk_simulator.py --users 5000 --records 1000000
+    python zk_simulator.py --users 1000 --fingers 2 --records 0
+    python zk_simulator.py --records 200000 --latency-ms 2 --loss 0.01 --port 4371
+    python zk_simulator.py --clock-skew -300      # terminal clock 5 minutes behind
+
+Network impairments:
+    --latency-ms  delay before every reply packet
+    --loss        probability of losing a reply packet. UDP replies are dropped
+                  (pyzk does not retry, so the pull fails like on a bad link);
+                  TCP replies are delayed by --rto-ms to model a retransmission.
+"""
+import time
+import random
+import struct
+import argparse
+import threading
+import socketserver
+from datetime import datetime, timedelta
+
+from zk import const
+from zk.base import make_commkey
+
+CMD_PREPARE_BUFFER = 1503
+CMD_READ_BUFFER = 1504
+CMD_SAVE_USERTEMPS = 110  # pyzk save_user_template: user record + templates from the upload buffer
+
+USER_STRUCT = struct.Struct('<HB8s24sIx7sx24s')  # 72-byte user record (ZK8 firmware)
+ATT_STRUCT = struct.Struct('<H24sB4sB8s')        # 40-byte attendance record
+HEADER_STRUCT = struct.Struct('<4H')
+FINGER_STRUCT = struct.Struct('<HHbb')           # template record header: size (incl. header), uid, fid, valid
+USERTEMP_STRUCT = struct.Struct('<BHB8s24sIB7sx24s')  # 73-byte user record of save_user_template
+TEMPLATE_ENTRY_STRUCT = struct.Struct('<bHbI')    # template table entry: type, uid, 0x10 + fid, offset
+TCP_TOP_STRUCT = struct.Struct('<HHI')
+UDP_CHUNK = 1024
+
+
+def encode_time(t):
+    """Device time encoding (same formula as pyzk / zkemsdk.c EncodeTime)"""
+    return (
+        ((t.year % 100) * 12 * 31 + ((t.month - 1) * 31) + t.day - 1) *
+        (24 * 60 * 60) + (t.hour * 60 + t.minute) * 60 + t.second
+    )
+
+
+def make_template(user_id, fid):
+    """
+    Synthetic fingerprint template, the same for a user_id/finger on every simulator
+    (like a person enrolled on several terminals). 80-150 minutiae of x, y, angle, type.
+    """
+    rng = random.Random(f"{user_id}:{fid}")
+    minutiae = [(rng.randrange(256), rng.randrange(256), rng.randrange(64), rng.randrange(4))
+                for _ in range(rng.randint(80, 150))]
+    header = struct.pack('<4sBHH', b'SS21', 10, 256, len(minutiae))
+    return header + b''.join(struct.pack('<BBBB', x, y, angle, kind) for x, y, angle, kind in minutiae)
+
+
+def create_checksum(buf):
+    """Packet checksum, as computed by pyzk"""
+    checksum = 0
+    length = len(buf)
+    i = 0
+    while length > 1:
+        checksum += buf[i] | (buf[i + 1] << 8)
+        if checksum > const.USHRT_MAX:
+            checksum -= const.USHRT_MAX
+        i += 2
+        length -= 2
+    if length:
+        checksum += buf[-1]
+    while checksum > const.USHRT_MAX:
+        checksum -= const.USHRT_MAX
+    checksum = ~checksum
+    while checksum < 0:
+        checksum += const.USHRT_MAX
+    return checksum
+
+
+def create_packet(command, session_id, reply_id, data=b''):
+    header = HEADER_STRUCT.pack(command, 0, session_id, reply_id) + data
+    checksum = create_checksum(header)
+    return HEADER_STRUCT.pack(command, checksum, session_id, reply_id) + data
+
+
+class SimulatedDevice:
+    """Device state and command handling, shared by the TCP and UDP servers"""
+
+    def __init__(self, users=100, records=10000, days=30, serial='SIM0000001', comm_key=0,
+                 latency_ms=0.0, loss=0.0, rto_ms=200.0, session_timeout=60.0, seed=1, fingers=0,
+                 clock_skew=0.0):
+        self.serial = serial
+        self.comm_key = int(comm_key)
+        self.latency = latency_ms / 1000.0
+        self.loss = loss
+        self.rto = rto_ms / 1000.0
+        self.session_timeout = session_timeout
+        self.random = random.Random(seed)
+        self.clock_offset = timedelta(seconds=clock_skew)  # device clock minus real time
+
+        self.lock = threading.RLock()
+        self.session = None  # {'client': key, 'session_id': int, 'authenticated': bool, 'last_seen': float}
+        self.next_session_id = 1
+        self.buffer = b''
+        self.upload = bytearray()  # CMD_PREPARE_DATA / CMD_DATA from the client
+        self.disabled_since = None
+
+        self.users = {}
+        for uid in range(1, users + 1):
+            self.users[uid] = {
+                'uid': uid, 'privilege': 0, 'password': '', 'name': f"Employee {uid:05d}",
+                'card': 0, 'group_id': '1', 'user_id': str(uid),
+            }
+        self.templates = {}  # (uid, fid) -> (valid, template)
+        for uid, user in self.users.items():
+            for fid in range(fingers):
+                self.templates[(uid, fid)] = (1, make_template(user['user_id'], fid))
+        self.attlog = bytearray()
+        self._generate_attendance(records, days)
+
+        self.stats = {
+            'connects': 0, 'busy_rejections': 0, 'commands': 0, 'packets_sent': 0,
+            'packets_lost': 0, 'bytes_sent': 0, 'disabled_seconds_total': 0.0,
+            'last_disabled_seconds': 0.0, 'max_disabled_seconds': 0.0, 'users_written': 0, 'users_deleted': 0,
+            'templates_written': 0,
+        }
+
+    # ---- data -----------------------------------------------------------
+
+    def now(self):
+        return datetime.now() + self.clock_offset
+
+    def _generate_attendance(self, records, days):
+        """Spread `records` punches evenly over the last `days` days"""
+        if not records or not self.users:
+            return
+        uids = sorted(self.users)
+        end = self.now().replace(microsecond=0)
+        start = end - timedelta(days=days)
+        step = (end - start).total_seconds() / records
+        start_ts = start.timestamp()
+        self.attlog = bytearray(records * ATT_STRUCT.size)
+        for i in range(records):
+            user = self.users[uids[i % len(uids)]]
+            timestamp = datetime.fromtimestamp(start_ts + i * step)
+            ATT_STRUCT.pack_into(
+                self.attlog, i * ATT_STRUCT.size,
+                user['uid'], user['user_id'].encode(), 1,
+                struct.pack('<I', encode_time(timestamp)), (i // len(uids)) % 2, b''
+            )
+
+    def add_punch(self, user_id, timestamp=None, punch=0):
+        """Append a live punch to the attendance log"""
+        timestamp = timestamp or self.now()
+        user = next((u for u in self.users.values() if u['user_id'] == str(user_id)), None)
+        uid = user['uid'] if user else 0
+        with self.lock:
+            self.attlog += ATT_STRUCT.pack(uid, str(user_id).encode(), 1, struct.pack('<I', encode_time(timestamp)), punch, b'')
+
+    @property
+    def record_count(self):
+        return len(self.attlog) // ATT_STRUCT.size
+
+    def _pack_users(self):
+        return b''.join(
+            USER_STRUCT.pack(
+                u['uid'], u['privilege'], u['password'].encode(), u['name'].encode(),
+                u['card'], u['group_id'].encode(), u['user_id'].encode()
+            )
+            for u in sorted(self.users.values(), key=lambda u: u['uid'])
+        )
+
+    def _pack_templates(self):
+        return b''.join(
+            FINGER_STRUCT.pack(FINGER_STRUCT.size + len(template), uid, fid, valid) + template
+            for (uid, fid), (valid, template) in sorted(self.templates.items())
+        )
+
+    def _free_sizes(self):
+        fields = [0] * 20
+        fields[4] = len(self.users)
+        fields[6] = len(self.templates)  # fingers
+        fields[8] = self.record_count
+        fields[14] = 10000                   # fingers capacity
+        fields[15] = max(10000, len(self.users))
+        fields[16] = max(100000, self.record_count)
+        fields[17] = fields[14] - fields[6]
+        fields[18] = fields[15] - fields[4]
+        fields[19] = fields[16] - fields[8]
+        return struct.pack('20i', *fields) + struct.pack('3i', 0, 0, 0)
+
+    def _options(self, key):
+        values = {
+            '~SerialNumber': self.serial,
+            '~Platform': 'ZMM220_TFT',
+            '~DeviceName': 'ZK Simulator',
+            '~ZKFPVersion': '10',
+            'ZKFaceVersion': '0',
+            '~ExtendFmt': '0',
+            '~UserExtFmt': '1',
+            'FaceFunOn': '0',
+            'CompatOldFirmware': '0',
+            '~PIN2Width': '9',
+            'MAC': '00:17:61:00:00:01',
+        }
+        if key not in values:
+            return None
+        return f"{key}={values[key]}\x00".encode()
+
+    # ---- sessions -------------------------------------------------------
+
+    def _enable(self):
+        if self.disabled_since is not None:
+            elapsed = time.monotonic() - self.disabled_since
+            self.stats['last_disabled_seconds'] = elapsed
+            self.stats['disabled_seconds_total'] += elapsed
+            self.stats['max_disabled_seconds'] = max(self.stats['max_disabled_seconds'], elapsed)
+            self.disabled_since = None
+
+    def end_session(self, client):
+        """Called on CMD_EXIT and when a TCP client goes away"""
+        with self.lock:
+            if self.session and self.session['client'] == client:
+                self._enable()  # Terminals re-enable themselves when the session ends
+                self.session = None
+                self.buffer = b''
+
+    def _session_busy(self, client):
+        if not self.session or self.session['client'] == client:
+            return False
+        if time.monotonic() - self.session['last_seen'] > self.session_timeout:
+            self._enable()
+            self.session = None
+            return False
+        return True
+
+    # ---- command dispatch -----------------------------------------------
+
+    def handle(self, client, tcp, command, session_id, reply_id, payload):
+        """Return the list of (command, data) packets to send back"""
+        with self.lock:
+            self.stats['commands'] += 1
+            if command == const.CMD_CONNECT:
+                if self._session_busy(client):
+                    self.stats['busy_rejections'] += 1
+                    return [(const.CMD_ACK_ERROR, b'')], 0
+                sid = self.next_session_id
+                self.next_session_id = (self.next_session_id % 0xFFFE) + 1
+                self.session = {'client': client, 'session_id': sid,
+                                'authenticated': not self.comm_key, 'last_seen': time.monotonic()}
+                self.stats['connects'] += 1
+                return [(const.CMD_ACK_OK if not self.comm_key else const.CMD_ACK_UNAUTH, b'')], sid
+
+            if not self.session or self.session['client'] != client:
+                return [(const.CMD_ACK_UNAUTH, b'')], session_id
+            self.session['last_seen'] = time.monotonic()
+            sid = self.session['session_id']
+
+            if command == const.CMD_AUTH:
+                if payload == make_commkey(self.comm_key, sid):
+                    self.session['authenticated'] = True
+                    return [(const.CMD_ACK_OK, b'')], sid
+                return [(const.CMD_ACK_UNAUTH, b'')], sid
+            if not self.session['authenticated']:
+                return [(const.CMD_ACK_UNAUTH, b'')], sid
+
+            if command == const.CMD_EXIT:
+                self.end_session(client)
+                return [(const.CMD_ACK_OK, b'')], sid
+            return self._dispatch(tcp, command, payload), sid
+
+    def _dispatch(self, tcp, command, payload):
+        ok = [(const.CMD_ACK_OK, b'')]
+        if command == const.CMD_DISABLEDEVICE:
+            if self.disabled_since is None:
+                self.disabled_since = time.monotonic()
+            return ok
+        if command == const.CMD_ENABLEDEVICE:
+            self._enable()
+            return ok
+        if command in (const.CMD_REFRESHDATA, const.CMD_FREE_DATA):
+            if command == const.CMD_FREE_DATA:
+                self.buffer = b''
+                self.upload = bytearray()
+            return ok
+        if command == const.CMD_GET_FREE_SIZES:
+            return [(const.CMD_ACK_OK, self._free_sizes())]
+        if command == const.CMD_GET_VERSION:
+            return [(const.CMD_ACK_OK, b'Ver 6.60 Sim\x00')]
+        if command == const.CMD_OPTIONS_RRQ:
+            value = self._options(payload.split(b'\x00')[0].decode(errors='ignore'))
+            return [(const.CMD_ACK_OK, value)] if value else [(const.CMD_ACK_ERROR, b'')]
+        if command == const.CMD_GET_TIME:
+            return [(const.CMD_ACK_OK, struct.pack('<I', encode_time(self.now())))]
+        if command == const.CMD_SET_TIME:
+            return self._set_time(payload)
+        if command == const.CMD_USER_WRQ:
+            return self._set_user(payload)
+        if command == const.CMD_DELETE_USER:
+            uid = struct.unpack('<h', payload[:2])[0]
+            if self.users.pop(uid, None) is None:
+                return [(const.CMD_ACK_ERROR, b'')]
+            for key in [key for key in self.templates if key[0] == uid]:
+                del self.templates[key]
+            self.stats['users_deleted'] += 1
+            return ok
+        if command == const.CMD_PREPARE_DATA:
+            self.upload = bytearray()
+            return ok
+        if command == const.CMD_DATA:
+            self.upload += payload
+            return ok
+        if command == CMD_SAVE_USERTEMPS:
+            return self._save_user_templates()
+        if command == const.CMD_DELETE_USERTEMP:
+            uid, fid = struct.unpack('<hb', payload[:3])
+            if self.templates.pop((uid, fid), None) is None:
+                return [(const.CMD_ACK_ERROR, b'')]
+            return ok
+        if command == const.CMD_CLEAR_ATTLOG:
+            self.attlog = bytearray()
+            return ok
+        if command == CMD_PREPARE_BUFFER:
+            return self._prepare_buffer(payload)
+        if command == CMD_READ_BUFFER:
+            start, size = struct.unpack('<ii', payload[:8])
+            return self._chunk(tcp, self.buffer[start:start + size])
+        return [(const.CMD_ACK_UNKNOWN, b'')]
+
+    def _set_user(self, payload):
+        """Create or replace the user with this uid (72-byte record, as pyzk's set_user packs it)"""
+        if len(payload) < USER_STRUCT.size:
+            return [(const.CMD_ACK_ERROR, b'')]
+        uid, privilege, password, name, card, group_id, user_id = USER_STRUCT.unpack(payload[:USER_STRUCT.size])
+        self.users[uid] = {
+            'uid': uid, 'privilege': privilege, 'card': card,
+            'password': password.split(b'\x00')[0].decode(errors='ignore'),
+            'name': name.split(b'\x00')[0].decode(errors='ignore'),
+            'group_id': group_id.split(b'\x00')[0].decode(errors='ignore'),
+            'user_id': user_id.split(b'\x00')[0].decode(errors='ignore'),
+        }
+        self.stats['users_written'] += 1
+        return [(const.CMD_ACK_OK, b'')]
+
+    def _save_user_templates(self):
+        """User record + fingerprint templates, laid out as pyzk's save_user_template sends them"""
+        data = bytes(self.upload)
+        self.upload = bytearray()
+        try:
+            user_size, table_size, _ = struct.unpack('<III', data[:12])
+            if user_size != USERTEMP_STRUCT.size:
+                return [(const.CMD_ACK_ERROR, b'')]
+            _, uid, privilege, password, name, card, _, group_id, user_id = USERTEMP_STRUCT.unpack_from(data, 12)
+            table = data[12 + user_size:12 + user_size + table_size]
+            fingers = data[12 + user_size + table_size:]
+            templates = {}
+            for offset in range(0, len(table), TEMPLATE_ENTRY_STRUCT.size):
+                _, _, fnum, start = TEMPLATE_ENTRY_STRUCT.unpack_from(table, offset)
+                size = struct.unpack_from('<H', fingers, start)[0]
+                templates[(uid, fnum - 0x10)] = (1, fingers[start + 2:start + 2 + size])
+        except struct.error:
+            return [(const.CMD_ACK_ERROR, b'')]
+        self.users[uid] = {
+            'uid': uid, 'privilege': privilege, 'card': card,
+            'password': password.split(b'\x00')[0].decode(errors='ignore'),
+            'name': name.split(b'\x00')[0].decode(errors='ignore'),
+            'group_id': group_id.split(b'\x00')[0].decode(errors='ignore'),
+            'user_id': user_id.split(b'\x00')[0].decode(errors='ignore'),
+        }
+        self.templates.update(templates)
+        self.stats['users_written'] += 1
+        self.stats['templates_written'] += len(templates)
+        return [(const.CMD_ACK_OK, b'')]
+
+    def _set_time(self, payload):
+        t = struct.unpack('<I', payload[:4])[0]
+        second, t = t % 60, t // 60
+        minute, t = t % 60, t // 60
+        hour, t = t % 24, t // 24
+        day, t = t % 31 + 1, t // 31
+        month, t = t % 12 + 1, t // 12
+        device_time = datetime(t + 2000, month, day, hour, minute, second)
+        self.clock_offset = device_time - datetime.now()
+        return [(const.CMD_ACK_OK, b'')]
+
+    def _prepare_buffer(self, payload):
+        _, command, fct, _ext = struct.unpack('<bhii', payload[:11])
+        if command == const.CMD_USERTEMP_RRQ and fct == const.FCT_USER:
+            body = self._pack_users()
+        elif command == const.CMD_DB_RRQ and fct == const.FCT_FINGERTMP:
+            body = self._pack_templates()
+        elif command == const.CMD_ATTLOG_RRQ:
+            body = bytes(self.attlog)
+        else:
+            return [(const.CMD_ACK_ERROR, b'')]
+        self.buffer = struct.pack('<I', len(body)) + body
+        return [(const.CMD_ACK_OK, b'\x00' + struct.pack('<I', len(self.buffer)) + b'\x00' * 4)]
+
+    def _chunk(self, tcp, data):
+        if tcp:
+            return [(const.CMD_DATA, data)]
+        # UDP: announce the size, stream 1 KB datagrams, finish with ACK_OK
+        packets = [(const.CMD_PREPARE_DATA, struct.pack('<I', len(data)))]
+        for offset in range(0, len(data), UDP_CHUNK):
+            packets.append((const.CMD_DATA, data[offset:offset + UDP_CHUNK]))
+        packets.append((const.CMD_ACK_OK, b''))
+        return packets
+
+    # ---- network impairment ---------------------------------------------
+
+    def before_send(self, tcp):
+        """Apply latency/loss to one outgoing packet. Returns False if it is lost."""
+        if self.latency:
+            time.sleep(self.latency)
+        if self.loss and self.random.random() < self.loss:
+            self.stats['packets_lost'] += 1
+            if not tcp:
+                return False
+            time.sleep(self.rto)  # TCP: the packet arrives after a retransmission
+        return True
+
+    def count_sent(self, nbytes):
+        self.stats['packets_sent'] += 1
+        self.stats['bytes_sent'] += nbytes
+
+
+class _TCPHandler(socketserver.BaseRequestHandler):
+    def _recv_exact(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return bytes(data)
+
+    def handle(self):
+        device = self.server.device
+        client = ('tcp', self.client_address, id(self))
+        try:
+            while True:
+                top = self._recv_exact(TCP_TOP_STRUCT.size)
+                if top is None:
+                    return
+                magic1, magic2, length = TCP_TOP_STRUCT.unpack(top)
+                if (magic1, magic2) != (const.MACHINE_PREPARE_DATA_1, const.MACHINE_PREPARE_DATA_2):
+                    return
+                packet = self._recv_exact(length)
+                if packet is None or len(packet) < 8:
+                    return
+                command, _, session_id, reply_id = HEADER_STRUCT.unpack(packet[:8])
+                replies, sid = device.handle(client, True, command, session_id, reply_id, packet[8:])
+                for reply_command, data in replies:
+                    body = create_packet(reply_command, sid, reply_id, data)
+                    frame = TCP_TOP_STRUCT.pack(const.MACHINE_PREPARE_DATA_1, const.MACHINE_PREPARE_DATA_2, len(body)) + body
+                    device.before_send(True)
+                    self.request.sendall(frame)
+                    device.count_sent(len(frame))
+        except (ConnectionError, OSError):
+            return
+        finally:
+            device.end_session(client)
+
+
+class _UDPHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        device = self.server.device
+        packet, sock = self.request
+        if len(packet) < 8:
+            return
+        command, _, session_id, reply_id = HEADER_STRUCT.unpack(packet[:8])
+        client = ('udp', self.client_address)
+        replies, sid = device.handle(client, False, command, session_id, reply_id, packet[8:])
+        for reply_command, data in replies:
+            datagram = create_packet(reply_command, sid, reply_id, data)
+            if device.before_send(False):
+                sock.sendto(datagram, self.client_address)
+                device.count_sent(len(datagram))
+
+
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _UDPServer(socketserver.UDPServer):
+    allow_reuse_address = True
+
+
+def start_simulator(device, host='127.0.0.1', port=4370):
+    """
+    Serve `device` over TCP and UDP in background threads.
+    Returns (tcp_server, udp_server); call .shutdown() on both to stop. Port 0 picks a free port.
+    """
+    tcp_server = _ThreadingTCPServer((host, port), _TCPHandler)
+    port = tcp_server.server_address[1]
+    udp_server = _UDPServer((host, port), _UDPHandler)
+    tcp_server.device = udp_server.device = device
+    for server in (tcp_server, udp_server):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return tcp_server, udp_server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=4370)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--records', type=int, default=10000)
+    parser.add_argument('--fingers', type=int, default=0, help='fingerprint templates per user (0-10)')
+    parser.add_argument('--days', type=int, default=30, help='spread records over the last N days')
+    parser.add_argument('--serial', default='SIM0000001')
+    parser.add_argument('--comm-key', type=int, default=0, help='device communication password')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--loss', type=float, default=0.0)
+    parser.add_argument('--rto-ms', type=float, default=200.0)
+    parser.add_argument('--clock-skew', type=float, default=0.0, help='device clock offset in seconds (+ ahead)')
+    args = parser.parse_args()
+
+    print(f"🔧 Generating {args.users} users ({args.fingers} fingers each) and {args.records} attendance records...")
+    started = time.perf_counter()
+    device = SimulatedDevice(
+        users=args.users, records=args.records, days=args.days, serial=args.serial,
+        comm_key=args.comm_key, latency_ms=args.latency_ms, loss=args.loss, rto_ms=args.rto_ms,
+        fingers=args.fingers, clock_skew=args.clock_skew
+    )
+    print(f"   Done in {time.perf_counter() - started:.1f}s")
+    start_simulator(device, args.host, args.port)
+    print(f"✅ ZK simulator {args.serial} listening on {args.host}:{args.port} (TCP + UDP)")
+    print(f"   Latency: {args.latency_ms} ms/packet | Loss: {args.loss * 100:.1f}%")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(f"\n📊 {device.stats}")
+
+
+if __name__ == '__main__':
+    main()
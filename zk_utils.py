@@ -2,8 +2,8 @@
 from zk import ZK, const
 from datetime import datetime
 
-def fetch_attendance(ip, port, start_date, end_date):
-    zk = ZK(ip, port=int(port), timeout=5, password=0, force_udp=False, ommit_ping=False)
+def fetch_attendance(ip, port, start_date, end_date, force_udp=False, ommit_ping=False):
+    zk = ZK(ip, port=int(port), timeout=5, password=0, force_udp=force_udp, ommit_ping=ommit_ping)
     conn = None
     try:
         conn = zk.connect()